@@ -2,6 +2,7 @@ import logging
 import sys
 import uvicorn
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from pathlib import Path
 
@@ -9,6 +10,11 @@ from pathlib import Path
 sys.path.append(str(Path(__file__).parent.parent))
 
 from app.routes import router
+from app.services.admission_control import AdmissionControlMiddleware
+from app.services.profiling import ProfilingMiddleware
+from app.services.corpus_snapshot import start_snapshot_refresher
+from app.services.service_factory import start_warm_up
+from app.services.tracing import get_tracer
 from app.settings import get_settings, load_env
 
 settings = get_settings()
@@ -25,11 +31,31 @@ logging.basicConfig(
 )
 
 logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm-up runs in the background so that /health answers immediately, /ready reports its progress
+    if settings.WARM_UP_ON_STARTUP:
+        start_warm_up()
+    if settings.CORPUS_SNAPSHOT_ENABLED:
+        start_snapshot_refresher()
+    yield
+    # Export the spans still queued
+    get_tracer().shutdown()
+
+
 app = FastAPI(
     title = "Scientific Chatbot",
     summary = "An AI-powered chatbot for scientific queries",
+    lifespan = lifespan,
 )
 app.include_router(router)
+if settings.ADMISSION_CONTROL_ENABLED:
+    app.add_middleware(AdmissionControlMiddleware)
+# Added last so that profiles include the admission wait
+if settings.ADMIN_TOKEN:
+    app.add_middleware(ProfilingMiddleware)
 
 
 if __name__ == '__main__':
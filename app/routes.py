@@ -1,22 +1,74 @@
+import asyncio
+import hashlib
 import logging
+import time
+import uuid
 
 from fastapi import (
     APIRouter,
     Depends,
     Form,
+    Header,
     HTTPException,
+    Query,
+    Request,
     UploadFile,
     File,
 )
 
-from app.services.upload_pdf_service import UploadPdfService
-from app.services.pdf_information_extraction_service import PdfInformationExtractionService
-from app.services.db_service import get_firebase_db, DatabaseService
-from app.services.chatbot_service import ChatbotService
+from fastapi.responses import JSONResponse, StreamingResponse
+from pydantic import BaseModel
 
+# Services are created through factories so that heavy SDKs are not imported with the routes
+from app.services.service_factory import (
+    get_upload_pdf_service,
+    get_pdf_information_extraction_service,
+    get_batch_ingestion_service,
+    get_paper_digest_service,
+    get_database_service,
+    get_chatbot_service,
+    readiness,
+)
+from app.services.batch_query_service import BatchQueryService, normalize_query
+from app.services.blob_store import get_blob_store
+from app.services.checkpoint_service import IngestionCheckpointStore, is_valid_job_id
+from app.services.citation_graph import get_citation_graph_store
+from app.services.hedging import request_deadline
+from app.services.metrics import metrics_registry
+from app.services.pdf_information_extraction_service import ExtractionFailed
+from app.services.profiling import is_admin_token, list_profiles, load_profile
+from app.services.serialization import dumps, json_response, parse_fields, project
+from app.services.session_store import get_session_store, use_session
+from app.services.single_flight import get_single_flight
+from app.services.table_store import get_table_store
+from app.services.task_queue import IngestionTaskQueue
+from app.services.tracing import trace
+from app.settings import get_settings
+
+settings = get_settings()
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+
+def require_admin(x_admin_token: str = Header(None, description="Admin token, see `ADMIN_TOKEN`.")):
+    """
+    Dependency of the admin-only endpoints.
+    """
+    if not is_admin_token(x_admin_token):
+        raise HTTPException(status_code=403, detail="A valid admin token is required.")
+
+
+def upload_content_hash(file: UploadFile) -> str:
+    """
+    Compute the SHA-256 of an uploaded file without loading it in memory, and rewind it.
+    """
+    digest = hashlib.sha256()
+    for block in iter(lambda: file.file.read(1024 * 1024), b""):
+        digest.update(block)
+    file.file.seek(0)
+    return digest.hexdigest()
+
+
 @router.get(
     "/health",
     summary="Service Health Check",
@@ -53,16 +105,89 @@ def health_check():
     logger.info("Health check endpoint successfully accessed.")
     return {"status": "ok"}
 
+
+@router.get(
+    "/ready",
+    summary="Service Readiness Check",
+    response_description="Returns whether the model, database and agent clients are warmed up",
+    tags=["System"],
+    responses={
+        200: {
+            "description": "Service is ready to serve requests",
+            "content": {
+                "application/json": {
+                    "example": {"ready": True, "subsystems": {"model": "ready", "database": "ready", "agents": "ready"},
+                                "errors": {}, "warm_up_seconds": 2.4}
+                }
+            },
+        },
+        503: {"description": "Service is still warming up or a subsystem failed to warm up"},
+    },
+)
+def readiness_check():
+    """
+    Endpoint to check if the service clients are warmed up.
+
+    Unlike `/health`, which answers as soon as the process is up, `/ready` returns `503`
+    until the SDKs are imported and the model, database and agent clients are created.
+    Use it as the readiness probe of the load balancer.
+    """
+    readiness_status = readiness.to_dict()
+    return JSONResponse(status_code=200 if readiness_status["ready"] else 503, content=readiness_status)
+
+@router.get(
+    "/metrics",
+    summary="Service Metrics",
+    response_description="In-process metrics of the service",
+    tags=["System"],
+)
+def metrics():
+    """
+    Endpoint returning the in-process metrics of this worker, e.g. the latency of each model routing tier
+    and the latency saved compared to the baseline tier.
+
+    ### Example response:
+    ```json
+    {
+        "model_routing": {
+            "baseline_tier": "standard",
+            "tiers": {"small": {"calls": 12, "accepted": 11, "escalated": 1, "low_confidence": 1, "average_latency_ms": 640.2, "latency_saved_ms": 5120.4}}
+        }
+    }
+    ```
+    """
+    return metrics_registry.collect()
+
+
 @router.post(
     "/pdf_upload",
     summary="Upload a PDF or ZIP file",
-    response_description="Parsed data extracted from uploaded PDF(s)",
+    response_description="Parsed data extracted from uploaded PDF(s), or an NDJSON stream of the files with `stream`",
     tags=["PdfUpload"]
 )
 def pdf_upload(
+        request: Request,
         file: UploadFile = File(...,
                                 description="Upload a single `.pdf` file or a `.zip` containing multiple PDFs."
-                                )
+                                ),
+        ingest_mode: str = Form("interactive",
+                                description="`interactive` extracts the files in this request, "
+                                            "`worker` queues them for the ingestion workers (`python -m app.worker`), "
+                                            "`batch` submits them as one Gemini batch prediction job."
+                                ),
+        job_id: str = Form(None,
+                           description="Identifier of an interrupted `interactive` job to resume. "
+                                       "Files already extracted by that job are not extracted again. "
+                                       "Must be a hex string or a UUID, as returned by a previous upload."
+                           ),
+        stream: bool = Form(False,
+                            description="Stream one JSON line per file as soon as it is extracted and stored "
+                                        "(`interactive` mode only)."
+                            ),
+        fields: str = Query(None,
+                            description="Comma-separated fields of the returned documents, dotted for nested fields, "
+                                        "e.g. `title,authors,tables_and_figures.tables`. All fields if not provided."
+                            ),
 ):
     """
         Upload a single PDF or ZIP archive of PDFs.
@@ -78,6 +203,34 @@ def pdf_upload(
         - Only **one** file may be uploaded per request.
         - All files inside a `.zip` must be valid `.pdf` files.
 
+        **Ingest modes**:
+        - `interactive` (default): Returns the extracted documents and the files that failed once all files are processed.
+          Extracted documents are checkpointed as soon as they are available, re-upload the same file(s)
+          with the returned `job_id` to resume a job without extracting the finished files again.
+        - `worker`: Returns a `job_id` immediately. Files are processed by the ingestion workers,
+          the job status is available at `/ingest_jobs/{job_id}`.
+        - `batch`: Returns a `batch_job_id` immediately. All files and recipes are submitted as one
+          Gemini batch prediction job (cheaper and not rate limited, but slower), poll `/batch_jobs/{batch_job_id}`
+          to store the results once the job has completed.
+
+        Concurrent uploads of the same content with the same options are processed once and share the response.
+
+        **Streaming** (`stream=true`, `interactive` mode): the response is a stream of JSON lines, a `job` line,
+        one line per file as soon as its extraction and database write are finished (in completion order,
+        with its `status`, `timings` and either the `document` or the `error`), and a `summary` line.
+        The first results of a large archive are available before the last file is extracted, and the client
+        does not hold the whole response in memory. Streamed uploads share their model calls, not their response,
+        with concurrent uploads of the same content.
+        ```
+        {"job": {"job_id": "3f2c...", "files": 2}}
+        {"file": "papers/b.pdf", "status": "done", "document": {...}, "timings": {"extraction_ms": 41230.5, "store_ms": 310.2, "elapsed_ms": 41560.1}}
+        {"file": "papers/a.pdf", "status": "failed", "error": "...", "attempts": 3, "timings": {"extraction_ms": 60112.0, "store_ms": 0.0, "elapsed_ms": 60120.4}}
+        {"summary": {"job_id": "3f2c...", "files": 2, "documents": 1, "failed_files": 1, "elapsed_ms": 60121.0}}
+        ```
+
+        Use `fields` to only return some fields of the documents. Responses are gzip-compressed
+        when the client sends `Accept-Encoding: gzip`.
+
         ### Example using `curl`:
         ```bash
         curl -X 'POST' 'http://localhost:8000/pdf_upload' \
@@ -94,27 +247,236 @@ def pdf_upload(
         if not (file.filename.endswith('.pdf') or file.filename.endswith('.zip')):
             logger.error("Invalid file type uploaded.")
             raise HTTPException(status_code=400, detail="Only .pdf or .zip files are allowed.")
+        if ingest_mode not in ("interactive", "worker", "batch"):
+            logger.error(f"Invalid ingest mode: {ingest_mode}")
+            raise HTTPException(status_code=400, detail="ingest_mode must be 'interactive', 'worker' or 'batch'.")
+        if stream and ingest_mode != "interactive":
+            raise HTTPException(status_code=400, detail="stream is only available with the 'interactive' ingest mode.")
+        if job_id and not is_valid_job_id(job_id):
+            logger.error(f"Invalid job id: {job_id!r}")
+            raise HTTPException(status_code=400, detail="job_id must be a hex string or a UUID.")
 
-        new_uploaded_files = UploadPdfService().upload(file)
-        if new_uploaded_files is None or len(new_uploaded_files) == 0:
-            logger.error("No valid PDF files found in the uploaded file.")
-            raise ValueError("No valid PDF files found in the uploaded file.")
-        logger.info(f"Successfully uploaded {len(new_uploaded_files)} file(s).")
-
-        # Process the uploaded files
-        pdf_information_extraction_service = PdfInformationExtractionService()
-        extracted_data = pdf_information_extraction_service.run(new_uploaded_files)
-
-        # Add the extracted data to the database
-        db_service = DatabaseService()
-        db_service.add_documents(extracted_data)
+        if stream:
+            # The files are stored before the response starts, the upload is closed once the endpoint returns
+            upload_job_id = job_id or uuid.uuid4().hex
+            stored_files = store_upload(file, upload_job_id)
+            return StreamingResponse(stream_upload(stored_files, upload_job_id, parse_fields(fields)),
+                                     media_type="application/x-ndjson")
 
-        return extracted_data
+        # Concurrent uploads of the same content share one upload, extraction and database write
+        flight_key = (upload_content_hash(file), ingest_mode, job_id)
+        result = get_single_flight("pdf_upload").do(flight_key, process_upload, file, ingest_mode, job_id)
+        projected_fields = parse_fields(fields)
+        if projected_fields and "documents" in result:
+            result = {**result, "documents": [project(document, projected_fields) for document in result["documents"]]}
+        return json_response(result, request)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error while uploading/processing files: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing file: {str(e)}")
 
 
+@trace("routes.process_upload", capture_input=False, capture_output=False)
+def process_upload(file: UploadFile, ingest_mode: str, job_id: str | None):
+    """
+    Store the uploaded file(s) and ingest them with the requested mode.
+
+    :param file: The uploaded PDF or ZIP file.
+    :param ingest_mode: `interactive`, `worker` or `batch`.
+    :param job_id: Identifier of an interrupted `interactive` job to resume.
+    :return dict: The ingestion report, or the identifier of the queued or batch job.
+    """
+    # Uploaded files are referenced by the job in the blob store until it no longer needs them
+    upload_job_id = job_id if ingest_mode == "interactive" and job_id else uuid.uuid4().hex
+    blob_store = get_blob_store()
+    stored_files = store_upload(file, upload_job_id)
+    pdf_paths = [blob_store.path(blob_hash) for blob_hash in stored_files]
+
+    if ingest_mode == "worker":
+        # The workers release the files when the last task of the job is finished
+        job_id = IngestionTaskQueue().enqueue(pdf_paths, job_id=upload_job_id)
+        return {"job_id": job_id, "queued_files": len(pdf_paths)}
+    if ingest_mode == "batch":
+        # The files are uploaded to the model provider when the job is submitted
+        try:
+            batch_job_id = get_batch_ingestion_service().submit(pdf_paths)
+        finally:
+            blob_store.release(upload_job_id)
+        return {"batch_job_id": batch_job_id, "submitted_files": len(pdf_paths)}
+
+    # Process the uploaded files
+    pdf_information_extraction_service = get_pdf_information_extraction_service()
+    try:
+        with request_deadline(settings.PDF_UPLOAD_REQUEST_DEADLINE_SECONDS):
+            ingestion_report = pdf_information_extraction_service.run(pdf_paths, job_id=upload_job_id)
+    finally:
+        # Finished files are checkpointed by content, a resumed job uploads its files again
+        blob_store.release(upload_job_id)
+    if ingestion_report.failed_files:
+        logger.error(f"Extraction failed for {len(ingestion_report.failed_files)} file(s) of job {ingestion_report.job_id}.")
+
+    # Add the extracted data and the paper digests to the database
+    documents = store_documents(ingestion_report.documents) if ingestion_report.documents else []
+
+    file_names = {str(blob_store.path(blob_hash)): name for blob_hash, name in stored_files.items()}
+    return {
+        "job_id": ingestion_report.job_id,
+        "documents": documents,
+        "failed_files": [{**failed_file.model_dump(), "file": file_names.get(failed_file.file, failed_file.file)}
+                         for failed_file in ingestion_report.failed_files],
+    }
+
+
+def store_upload(file: UploadFile, upload_job_id: str) -> dict[str, str]:
+    """
+    Store the uploaded file(s) in the blob store, referenced by the ingestion job.
+
+    :param file: The uploaded PDF or ZIP file.
+    :param upload_job_id: The ingestion job using the files.
+    :return dict: Original file name by blob hash.
+    """
+    stored_files = get_upload_pdf_service().upload(file, upload_job_id)
+    if not stored_files:
+        logger.error("No valid PDF files found in the uploaded file.")
+        get_blob_store().release(upload_job_id)
+        raise ValueError("No valid PDF files found in the uploaded file.")
+    logger.info(f"Successfully uploaded {len(stored_files)} file(s).")
+    return stored_files
+
+
+@trace("routes.store_documents", capture_input=False, capture_output=False)
+def store_documents(documents: list) -> list[dict]:
+    """
+    Add the paper digests to extracted documents and store them in the database, the citation graph
+    and the table store.
+
+    :param documents: Extracted documents.
+    :return list[dict]: The stored documents.
+    """
+    # Documents are dumped once, the same dicts are stored and returned
+    documents = [document.model_dump() for document in get_paper_digest_service().add_digests(documents)]
+    get_database_service().add_documents(documents)
+    get_citation_graph_store().add_papers(documents)
+    get_table_store().add_documents(documents)
+    return documents
+
+
+async def stream_upload(stored_files: dict[str, str], upload_job_id: str, fields: list[str] | None):
+    """
+    Extract and store the files of an interactive upload, yielding one NDJSON line per file as soon as
+    it is stored. The files are released once the stream ends, also when the client goes away.
+
+    :param stored_files: Original file name by blob hash.
+    :param upload_job_id: The ingestion job using the files.
+    :param fields: Fields of the returned documents, all fields if not provided.
+    """
+    start_time = time.monotonic()
+    blob_store = get_blob_store()
+    file_names = {blob_store.path(blob_hash): name for blob_hash, name in stored_files.items()}
+    checkpoint_store = IngestionCheckpointStore(upload_job_id)
+    documents = failed_files = 0
+    try:
+        yield dumps({"job": {"job_id": checkpoint_store.job_id, "files": len(file_names)}}) + b"\n"
+        with request_deadline(settings.PDF_UPLOAD_REQUEST_DEADLINE_SECONDS):
+            extraction = get_pdf_information_extraction_service().astream(list(file_names), checkpoint_store)
+            async for file_path, result, extraction_ms in extraction:
+                record = {"file": file_names.get(file_path, str(file_path))}
+                store_start_time = time.monotonic()
+                if isinstance(result, ExtractionFailed):
+                    record.update(status="failed", error=str(result), attempts=result.attempts)
+                else:
+                    try:
+                        document, = await asyncio.to_thread(store_documents, [result])
+                        record.update(status="done", document=project(document, fields))
+                    except Exception as e:
+                        logger.error(f"Error storing {record['file']} of job {checkpoint_store.job_id}: {e}")
+                        record.update(status="failed", error=f"Error storing the document: {e}")
+                documents += record["status"] == "done"
+                failed_files += record["status"] == "failed"
+                record["timings"] = {
+                    "extraction_ms": extraction_ms,
+                    "store_ms": round((time.monotonic() - store_start_time) * 1000, 1),
+                    "elapsed_ms": round((time.monotonic() - start_time) * 1000, 1),
+                }
+                yield dumps(record) + b"\n"
+    finally:
+        # Finished files are checkpointed by content, a resumed job uploads its files again
+        blob_store.release(upload_job_id)
+    if failed_files:
+        logger.error(f"Extraction failed for {failed_files} file(s) of job {checkpoint_store.job_id}.")
+    yield dumps({"summary": {
+        "job_id": checkpoint_store.job_id,
+        "files": len(file_names),
+        "documents": documents,
+        "failed_files": failed_files,
+        "elapsed_ms": round((time.monotonic() - start_time) * 1000, 1),
+    }}) + b"\n"
+
+
+@router.get(
+    "/ingest_jobs/{job_id}",
+    summary="Ingestion Job Status",
+    response_description="Status of the files of an ingestion job processed by the workers",
+    tags=["PdfUpload"],
+)
+def ingest_job_status(job_id: str):
+    """
+    Get the status of an ingestion job queued with `ingest_mode=worker`.
+
+    ### Response example:
+    ```json
+    {
+        "job_id": "3f2c...",
+        "tasks": [{"file_path": "extracted_files/blobs/3a/3a7bd3e2...c1.pdf", "status": "done", "attempts": 1, "result": "Example Title", "error": null}]
+    }
+    ```
+    """
+    tasks = IngestionTaskQueue().get_job(job_id)
+    if not tasks:
+        raise HTTPException(status_code=404, detail=f"Ingestion job '{job_id}' not found.")
+    return {
+        "job_id": job_id,
+        "tasks": [
+            {key: task[key] for key in ("file_path", "status", "attempts", "result", "error")}
+            for task in tasks
+        ],
+    }
+
+
+@router.get(
+    "/batch_jobs/{batch_job_id}",
+    summary="Batch Ingestion Job Status",
+    response_description="Status of a batch ingestion job, with its ingestion report once completed",
+    tags=["PdfUpload"],
+)
+def batch_job_status(batch_job_id: str):
+    """
+    Poll a batch ingestion job submitted with `ingest_mode=batch`.
+    When the batch job has completed, the extracted documents are stored in the database on this call.
+    Polls received while another poll is storing them return the `collecting` status.
+
+    ### Response example:
+    ```json
+    {
+        "job_id": "9b1e...",
+        "status": "succeeded",
+        "files": ["extracted_files/blobs/3a/3a7bd3e2...c1.pdf"],
+        "report": {"documents": ["Example Title"], "failed_files": []}
+    }
+    ```
+    """
+    batch_ingestion_service = get_batch_ingestion_service()
+    if batch_ingestion_service.load_job(batch_job_id) is None:
+        raise HTTPException(status_code=404, detail=f"Batch job '{batch_job_id}' not found.")
+    try:
+        job = batch_ingestion_service.poll(batch_job_id)
+    except Exception as e:
+        logger.error(f"Error polling batch job {batch_job_id}: {e}")
+        raise HTTPException(status_code=500, detail=f"Error polling batch job: {str(e)}")
+    return {key: job.get(key) for key in ("job_id", "status", "files", "report")}
+
+
 @router.post(
     "/chatbot",
     summary="Chatbot Query Endpoint",
@@ -141,6 +503,16 @@ def pdf_upload(
                 }
             },
         },
+        404: {
+            "description": "Unknown or expired chat session",
+            "content": {
+                "application/json": {
+                    "example": {
+                        "detail": "Session '9f1c2e...' not found or expired, create one with POST /sessions."
+                    }
+                }
+            },
+        },
         500: {
             "description": "Internal server error while processing query",
             "content": {
@@ -156,13 +528,20 @@ def pdf_upload(
 def chatbot(
         query: str = Form(...,
                           description="The user query string to send to the chatbot."
-                          )
+                          ),
+        session_id: str = Form(None,
+                               description="Identifier of a chat session created with `POST /sessions`. "
+                                           "Follow-up questions of a session get the conversation history "
+                                           "and reuse the documents already retrieved."
+                               ),
 ):
     """
     Handle chatbot queries by passing the user input to the ChatbotService.
 
-    - Accepts a single form parameter `query` which contains the user input.
+    - Accepts a form parameter `query` which contains the user input, and an optional `session_id`.
     - Returns the chatbot-generated response.
+    - Identical queries (ignoring case and whitespace) of the same session received while one is being answered share its response.
+    - Without `session_id` every query is answered independently. An unknown or expired `session_id` is rejected with 404.
 
     ### Example using curl:
     ```bash
@@ -174,7 +553,8 @@ def chatbot(
     ### Response example:
     ```json
     {
-        "response": "Paper X and Paper Y talk about LLMs"
+        "response": "Paper X and Paper Y talk about LLMs",
+        "session_id": null
     }
     ```
     """
@@ -184,13 +564,162 @@ def chatbot(
             logger.error("Empty query received.")
             raise HTTPException(status_code=400, detail="Query cannot be empty.")
 
-        db_service = DatabaseService()
+        session = None
+        if session_id is not None:
+            session = get_session_store().get(session_id)
+            if session is None:
+                raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found or expired, "
+                                                            "create one with POST /sessions.")
+
+        db_service = get_database_service()
+
+        service = get_chatbot_service()
+
+        def answer():
+            with request_deadline(settings.CHATBOT_REQUEST_DEADLINE_SECONDS):
+                if session is None:
+                    return service.get_response(query=query, db_service=db_service)
+                with use_session(session):
+                    return service.get_response(query=query, db_service=db_service, session=session)
 
-        service = ChatbotService()
-        response = service.get_response(query=query, db_service=db_service)
+        # Identical questions asked concurrently in the same session (or without session) are answered once
+        response = get_single_flight("chatbot").do((session_id, normalize_query(query)), answer)
 
         logger.info("Chatbot query processed successfully.")
-        return {"response": response}
+        return {"response": response, "session_id": session_id}
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error processing chatbot query: {e}")
-        raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=f"Error processing query: {str(e)}")
+
+
+class BatchQueryRequest(BaseModel):
+    queries: list[str]
+
+
+@router.post(
+    "/chatbot/batch",
+    summary="Chatbot Batch Query Endpoint",
+    response_description="NDJSON stream of the responses, in completion order",
+    tags=["Chatbot"],
+)
+async def chatbot_batch(batch: BatchQueryRequest):
+    """
+    Answer a batch of queries, e.g. for evaluation and reporting jobs, with shared retrieval.
+
+    - Identical queries (ignoring case and whitespace) are answered once.
+    - Papers named in the queries are fetched once for the whole batch, and documents retrieved by one query
+      are reused by the others.
+    - Queries are answered concurrently (`CHATBOT_BATCH_MAX_CONCURRENCY`), within the admission control budget
+      of the `batch` class, so interactive requests keep priority.
+
+    The response is a stream of JSON lines: a `plan` line, one line per query as soon as it is answered
+    (with the `index` of the query in the batch, and `response` or `error`), and a `summary` line.
+
+    ### Example using curl:
+    ```bash
+    curl -N -X POST "http://localhost:8000/chatbot/batch" \
+         -H "Content-Type: application/json" \
+         -d '{"queries": ["Compare paper X and Y?", "Summarize paper X"]}'
+    ```
+
+    ### Response example:
+    ```
+    {"plan": {"queries": 2, "distinct_queries": 2, "planned_documents": ["Paper X", "Paper Y"], "prefetched_documents": 2}}
+    {"index": 1, "query": "Summarize paper X", "response": "...", "latency_ms": 5210.4}
+    {"index": 0, "query": "Compare paper X and Y?", "response": "...", "latency_ms": 8120.9}
+    {"summary": {"queries": 2, "distinct_queries": 2, "failed_queries": 0, "document_cache": {...}, "elapsed_ms": 8200.3}}
+    ```
+    """
+    queries = [query for query in batch.queries if query and query.strip()]
+    if not queries:
+        raise HTTPException(status_code=400, detail="At least one non-empty query is required.")
+    if len(queries) > settings.CHATBOT_BATCH_MAX_QUERIES:
+        raise HTTPException(status_code=400,
+                            detail=f"A batch is limited to {settings.CHATBOT_BATCH_MAX_QUERIES} queries.")
+    logger.info(f"Received a batch of {len(queries)} chatbot queries.")
+    service = BatchQueryService(db_service=get_database_service())
+
+    async def records():
+        async for record in service.astream(queries):
+            yield dumps(record) + b"\n"
+
+    return StreamingResponse(records(), media_type="application/x-ndjson")
+
+
+@router.post(
+    "/sessions",
+    summary="Create a Chat Session",
+    response_description="Identifier of the new chat session",
+    tags=["Chatbot"],
+)
+def create_session():
+    """
+    Create a chat session for multi-turn conversations. Pass the returned `session_id` to `/chatbot`.
+
+    Sessions are kept in memory by the worker that created them, and expire after `SESSION_TTL_SECONDS` without requests.
+
+    ### Response example:
+    ```json
+    {
+        "session_id": "9f1c2e..."
+    }
+    ```
+    """
+    return {"session_id": get_session_store().create().session_id}
+
+
+@router.delete(
+    "/sessions/{session_id}",
+    summary="Delete a Chat Session",
+    response_description="Deletion status",
+    tags=["Chatbot"],
+)
+def delete_session(session_id: str):
+    """
+    Delete a chat session, with its history and cached documents.
+    """
+    if not get_session_store().delete(session_id):
+        raise HTTPException(status_code=404, detail=f"Session '{session_id}' not found.")
+    return {"session_id": session_id, "deleted": True}
+
+
+@router.get(
+    "/profiles",
+    summary="Request Profiles",
+    response_description="Summaries of the stored request profiles",
+    tags=["Admin"],
+    dependencies=[Depends(require_admin)],
+)
+def profiles():
+    """
+    List the profiles of the requests sent with the `X-Profile: true` header, most recent first.
+    Profiling is only available when `ADMIN_TOKEN` is set, and requires the `X-Admin-Token` header.
+
+    ### Example using curl:
+    ```bash
+    curl -X POST "http://localhost:8000/chatbot" -H "X-Profile: true" -H "X-Admin-Token: $ADMIN_TOKEN" \
+         -d "query=Compare paper X and Y?" -i   # returns the X-Profile-Id header
+    curl "http://localhost:8000/profiles" -H "X-Admin-Token: $ADMIN_TOKEN"
+    ```
+    """
+    return {"profiles": list_profiles()}
+
+
+@router.get(
+    "/profiles/{profile_id}",
+    summary="Request Profile",
+    response_description="Stage breakdown, allocations and folded CPU stacks of a request",
+    tags=["Admin"],
+    dependencies=[Depends(require_admin)],
+)
+def profile(profile_id: str):
+    """
+    Get a request profile: wall and CPU time per stage, peak memory, top allocation sites and
+    the sampled CPU stacks in folded format (`cpu_folded`, input of flamegraph.pl or speedscope).
+    """
+    request_profile = load_profile(profile_id)
+    if request_profile is None:
+        raise HTTPException(status_code=404, detail=f"Profile '{profile_id}' not found.")
+    return request_profile
@@ -0,0 +1,293 @@
+import asyncio
+import logging
+import math
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+from starlette.responses import JSONResponse
+
+from app.settings import get_settings
+from app.services.metrics import metrics_registry
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Weight of the last request in the moving average of the service time of a class
+SERVICE_TIME_SMOOTHING = 0.2
+
+
+class AdmissionRejected(Exception):
+    """
+    Raised when a request is shed. The middleware answers with its status code and Retry-After header.
+    """
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class AdmissionClass:
+    """
+    Requests of an endpoint class (e.g. chat or ingest): their concurrency, their bounded queue and their statistics.
+    """
+    def __init__(self, name: str, priority: int, max_concurrency: int, max_queue: int, max_wait_seconds: float,
+                 client_max_concurrency: int, initial_service_seconds: float, reserved_concurrency: int = 0):
+        self.name = name
+        self.priority = priority
+        self.max_concurrency = max_concurrency
+        # Slots granted to the class before the classes with a higher priority, so that it is not starved
+        self.reserved_concurrency = reserved_concurrency
+        self.max_queue = max_queue
+        self.max_wait_seconds = max_wait_seconds
+        self.client_max_concurrency = client_max_concurrency
+        # Moving average of the time a request holds its slot
+        self.service_seconds = initial_service_seconds
+        self.running = 0
+        self.queue = deque()
+        self.clients = {}
+        self.stats = {"admitted": 0, "completed": 0, "failed": 0,
+                      "shed_queue_full": 0, "shed_wait_estimate": 0, "shed_wait_timeout": 0, "shed_client_quota": 0}
+
+
+class _Waiter:
+    def __init__(self, admission_class: AdmissionClass, client: str):
+        self.admission_class = admission_class
+        self.client = client
+        self.loop = asyncio.get_running_loop()
+        self.future = self.loop.create_future()
+        self.granted = False
+
+
+class Ticket:
+    """
+    Slot held by an admitted request, returned to the controller with `release`.
+    """
+    def __init__(self, admission_class: AdmissionClass, client: str):
+        self.admission_class = admission_class
+        self.client = client
+        self.started_at = time.monotonic()
+
+
+class AdmissionController:
+    """
+    Admission control of the LLM-heavy endpoints.
+
+    At most `max_concurrency` requests run at once. Each class has its own concurrency cap, a bounded FIFO queue
+    and a per-client quota of running and queued requests. When a slot frees up it goes to the waiting request
+    of the class with the highest priority (lowest value), so interactive chat overtakes bulk ingest, and the
+    ingest cap keeps slots available for chat. A class running fewer requests than its reserved concurrency
+    is served first, so a sustained chat overload slows ingest down without starving it.
+
+    A request is shed instead of queued when the queue of its class is full, when its client exceeds its quota
+    (429), or when the estimated wait exceeds the maximum wait of its class (503): failing fast with Retry-After
+    lets clients back off, instead of queueing work that would time out anyway.
+    """
+    def __init__(self, classes: dict = None, max_concurrency: int = None):
+        """
+        :param classes: Settings of the classes by name, see settings.ADMISSION_CLASSES.
+        :param max_concurrency: Requests running at once across classes. Defaults to settings.ADMISSION_MAX_CONCURRENCY.
+        """
+        self.max_concurrency = max_concurrency or settings.ADMISSION_MAX_CONCURRENCY
+        self.classes = {name: AdmissionClass(name, **options)
+                        for name, options in (classes or settings.ADMISSION_CLASSES).items()}
+        self.running = 0
+        self._lock = threading.Lock()
+
+    def _ahead(self, admission_class: AdmissionClass):
+        if admission_class.running < admission_class.reserved_concurrency:
+            return [admission_class]
+        return [other for other in self.classes.values() if other.priority <= admission_class.priority]
+
+    def _has_free_slot(self, admission_class: AdmissionClass) -> bool:
+        return self.running < self.max_concurrency and admission_class.running < admission_class.max_concurrency
+
+    def estimated_wait(self, admission_class: AdmissionClass) -> float:
+        """
+        Rough estimate of the queueing time of a new request: the work queued ahead of it (in its class and
+        in the classes with a higher priority), plus the request holding the first slot to free up,
+        spread over the slots of its class.
+        """
+        ahead = self._ahead(admission_class)
+        if self._has_free_slot(admission_class) and not any(other.queue for other in ahead):
+            return 0.0
+        queued_work = sum(len(other.queue) * other.service_seconds for other in ahead)
+        slots = min(admission_class.max_concurrency, self.max_concurrency)
+        return (queued_work + admission_class.service_seconds) / slots
+
+    def _dispatch(self):
+        # Grant the free slots to the waiting requests, the classes below their reservation first,
+        # then by priority
+        by_priority = sorted(self.classes.values(), key=lambda other: other.priority)
+        for admission_class, reserved_only in [(other, True) for other in by_priority] + [(other, False) for other in by_priority]:
+            while (admission_class.queue and self._has_free_slot(admission_class)
+                   and (not reserved_only or admission_class.running < admission_class.reserved_concurrency)):
+                waiter = admission_class.queue.popleft()
+                waiter.granted = True
+                self.running += 1
+                admission_class.running += 1
+                waiter.loop.call_soon_threadsafe(self._wake, waiter.future)
+
+    @staticmethod
+    def _wake(future: asyncio.Future):
+        if not future.done():
+            future.set_result(None)
+
+    def _admit(self, admission_class: AdmissionClass, client: str) -> Ticket:
+        admission_class.stats["admitted"] += 1
+        return Ticket(admission_class, client)
+
+    def _leave(self, admission_class: AdmissionClass, client: str):
+        admission_class.clients[client] -= 1
+        if not admission_class.clients[client]:
+            del admission_class.clients[client]
+
+    async def acquire(self, class_name: str, client: str) -> Ticket:
+        """
+        Wait for a slot of a class.
+
+        :param class_name: Class of the request, one of settings.ADMISSION_CLASSES.
+        :param client: Identifier of the client, for its quota.
+        :return Ticket: The slot, to release once the response is sent.
+        :raises AdmissionRejected: If the request is shed.
+        """
+        admission_class = self.classes[class_name]
+        with self._lock:
+            if admission_class.clients.get(client, 0) >= admission_class.client_max_concurrency:
+                admission_class.stats["shed_client_quota"] += 1
+                raise AdmissionRejected(429, f"Too many concurrent {class_name} requests for this client.",
+                                        admission_class.service_seconds)
+            if self._has_free_slot(admission_class) and not any(other.queue for other in self._ahead(admission_class)):
+                self.running += 1
+                admission_class.running += 1
+                admission_class.clients[client] = admission_class.clients.get(client, 0) + 1
+                return self._admit(admission_class, client)
+            if len(admission_class.queue) >= admission_class.max_queue:
+                admission_class.stats["shed_queue_full"] += 1
+                raise AdmissionRejected(503, f"The {class_name} queue is full.", self.estimated_wait(admission_class))
+            estimated_wait = self.estimated_wait(admission_class)
+            if estimated_wait > admission_class.max_wait_seconds:
+                admission_class.stats["shed_wait_estimate"] += 1
+                raise AdmissionRejected(503, f"Estimated {class_name} queue wait of {estimated_wait:.1f}s exceeds "
+                                             f"{admission_class.max_wait_seconds:.1f}s.", estimated_wait)
+            waiter = _Waiter(admission_class, client)
+            admission_class.queue.append(waiter)
+            admission_class.clients[client] = admission_class.clients.get(client, 0) + 1
+
+        try:
+            await asyncio.wait_for(waiter.future, timeout=admission_class.max_wait_seconds)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                if not waiter.granted:
+                    admission_class.queue.remove(waiter)
+                    self._leave(admission_class, client)
+                    if isinstance(e, asyncio.TimeoutError):
+                        admission_class.stats["shed_wait_timeout"] += 1
+                        raise AdmissionRejected(503, f"No {class_name} slot freed up within "
+                                                     f"{admission_class.max_wait_seconds:.1f}s.",
+                                                self.estimated_wait(admission_class))
+                    raise
+            # The slot was granted as the wait ended
+            if isinstance(e, asyncio.CancelledError):
+                self.release(self._admit(admission_class, client), succeeded=False)
+                raise
+        with self._lock:
+            return self._admit(admission_class, client)
+
+    def release(self, ticket: Ticket, succeeded: bool = True):
+        """
+        Return the slot of a request and hand it to the next waiting request.
+
+        :param ticket: Slot returned by `acquire`.
+        :param succeeded: False if the request failed, for the goodput statistics.
+        """
+        admission_class = ticket.admission_class
+        with self._lock:
+            self.running -= 1
+            admission_class.running -= 1
+            self._leave(admission_class, ticket.client)
+            admission_class.stats["completed" if succeeded else "failed"] += 1
+            admission_class.service_seconds += SERVICE_TIME_SMOOTHING * (
+                    time.monotonic() - ticket.started_at - admission_class.service_seconds)
+            self._dispatch()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "running": self.running,
+                "max_concurrency": self.max_concurrency,
+                "classes": {
+                    name: {
+                        **admission_class.stats,
+                        "running": admission_class.running,
+                        "queue_depth": len(admission_class.queue),
+                        "service_seconds": round(admission_class.service_seconds, 3),
+                        "estimated_wait_seconds": round(self.estimated_wait(admission_class), 3),
+                    }
+                    for name, admission_class in self.classes.items()
+                },
+            }
+
+
+class AdmissionControlMiddleware:
+    """
+    ASGI middleware applying admission control to the routes of settings.ADMISSION_ROUTES.
+    Clients are identified by the settings.ADMISSION_CLIENT_HEADER header, or by their address.
+    """
+    def __init__(self, app, controller: AdmissionController = None, routes: dict = None):
+        """
+        :param app: The ASGI application.
+        :param controller: Defaults to the process-wide controller.
+        :param routes: Class of each controlled path. Defaults to settings.ADMISSION_ROUTES.
+        """
+        self.app = app
+        self.controller = controller or get_admission_controller()
+        self.routes = routes or settings.ADMISSION_ROUTES
+        self.client_header = settings.ADMISSION_CLIENT_HEADER.lower().encode("latin-1")
+
+    def _client(self, scope) -> str:
+        for name, value in scope.get("headers", []):
+            if name == self.client_header:
+                return value.decode("latin-1")
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    async def __call__(self, scope, receive, send):
+        class_name = self.routes.get(scope.get("path")) if scope["type"] == "http" and scope.get("method") == "POST" else None
+        if class_name is None:
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            ticket = await self.controller.acquire(class_name, self._client(scope))
+        except AdmissionRejected as e:
+            logger.warning(f"Shedding {class_name} request to {scope['path']}: {e.reason}")
+            response = JSONResponse(status_code=e.status_code, content={"detail": e.reason},
+                                    headers={"Retry-After": str(e.retry_after)})
+            await response(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.controller.release(ticket, succeeded=status_code < 500)
+
+
+@lru_cache
+def get_admission_controller() -> AdmissionController:
+    """
+    Get the process-wide admission controller.
+    """
+    controller = AdmissionController()
+    metrics_registry.register("admission", controller.to_dict)
+    return controller
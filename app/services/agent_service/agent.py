@@ -2,11 +2,13 @@ import logging
 import json
 from abc import ABC, abstractmethod
 from google import genai
-from opik import track
-from opik.integrations.genai import track_genai
 
 from app.settings import get_settings
+from app.services.agent_service.pre_validator import DeterministicValidator, get_pre_validation_stats
 from app.services.agent_service.tool import Tool
+from app.services.hedging import get_hedged_caller
+from app.services.model_router import get_model_router
+from app.services.tracing import record_model_response, start_span, trace
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
@@ -60,6 +62,7 @@ class Agent(AbstractAgent):
                  model_name: str,
                  prompt: dict,
                  tools: dict[str: Tool] = None,
+                 step_type: str = None,
                  ):
         """
         Initializes an Agent instance.
@@ -68,9 +71,15 @@ class Agent(AbstractAgent):
         :param model_name: The name of the language model used by the agent.
         :param prompt: A dictionary containing the prompt messages for the agent.
         :param tools: A dictionary of tools that the agent can use.
+        :param step_type: Step type used by the model router to pick the model tier.
+                          The agent always uses model_name if not provided.
         """
         super().__init__(name, description, model_name)
-        self.client = track_genai(genai.Client(api_key=settings.API_KEY))
+        settings.validate_subsystem("model")
+        self.client = genai.Client(api_key=settings.API_KEY)
+        self.step_type = step_type
+        self.model_router = get_model_router()
+        self.hedged_caller = get_hedged_caller("agent")
         self.tools = tools
         self.load_prompt(prompt)
         if self.tools:
@@ -111,7 +120,7 @@ class Agent(AbstractAgent):
         except Exception as e:
             raise ValueError(f"Error loading prompt: {e}")
 
-    @track("agent.invoke")
+    @trace("agent.invoke")
     def invoke(self, query: str, context: str = None) -> str:
         """
         Invoke the agent with a query and optional context.
@@ -120,15 +129,31 @@ class Agent(AbstractAgent):
         :return str: Response generated by LLM
         """
         logger.info("Sending query, context, and tools to the model.")
+        contents = [self.prompt_messages, query, self.tools_message, context]
+        prompt_chars = sum(len(str(content)) for content in contents if content)
+
+        def generate(model_name: str, timeout_seconds: float):
+            with start_span("genai.generate_content", kind="llm", input=lambda: {"contents": contents},
+                            attributes={"model": model_name}) as span:
+                response = self.client.models.generate_content(
+                    model=model_name,
+                    contents=contents,
+                    config={
+                        "temperature": 0.2,
+                        "response_mime_type": "application/json",
+                        "http_options": {"timeout": int(timeout_seconds * 1000)},
+                    }
+                )
+                record_model_response(span, response)
+                return response
+
+        def call_model(model_name: str):
+            # The call is bounded by the request deadline, and hedged if it is slower than usual
+            return self.hedged_caller.call(lambda timeout_seconds: generate(model_name, timeout_seconds))
         try:
-            response = self.client.models.generate_content(
-                model=self.model_name,
-                contents=[self.prompt_messages, query, self.tools_message, context],
-                config={
-                    "temperature": 0.2,
-                    "response_mime_type": "application/json",
-                }
-            )
+            response = self.model_router.run(self.step_type, prompt_chars, call_model,
+                                             self.is_valid_model_response, self.model_name,
+                                             confidence=self.model_response_confidence)
             if not response or not response.candidates:
                 logger.error("No response from the model.")
                 return None
@@ -141,6 +166,29 @@ class Agent(AbstractAgent):
             logger.error(f"Error processing model response: {e}")
             raise ValueError(f"Error processing model response: {e}")
 
+    def is_valid_model_response(self, response) -> bool:
+        """
+        Check a model response before accepting it from a cheaper model tier.
+        The response must be a JSON object.
+        """
+        response_json = self.load_json_from_model_response(response.candidates[0].content.parts[0].text)
+        return isinstance(response_json, dict)
+
+    def model_response_confidence(self, response) -> float | None:
+        """
+        :return float: The confidence the model reported in its response (the "confidence" field of the prompts'
+                       response formats), None if it reported none.
+        """
+        response_json = self.load_json_from_model_response(response.candidates[0].content.parts[0].text)
+        confidence = response_json.get("confidence") if isinstance(response_json, dict) else None
+        if isinstance(confidence, bool) or not isinstance(confidence, (int, float, str)):
+            return None
+        try:
+            return float(confidence)
+        except ValueError:
+            return None
+
+    @trace("agent.load_json_from_model_response", capture_input=False)
     def load_json_from_model_response(self, llm_response: str) -> dict:
         """
         Load JSON data from the LLM response.
@@ -157,7 +205,7 @@ class Agent(AbstractAgent):
                 llm_response = llm_response[3:-3]
                 return json.loads(llm_response)
 
-    @track("agent.invoke_tool")
+    @trace("agent.invoke_tool")
     def invoke_tool(self, response_data: str) -> str:
         """
         Invoke a tool based on the LLM response.
@@ -178,7 +226,7 @@ class Agent(AbstractAgent):
             logger.error(f"Error invoking tool: {e}")
             raise ValueError(f"Error invoking tool: {e}")
 
-    @track("agent.invoke_code")
+    @trace("agent.invoke_code")
     def invoke_code(self, response_data: str) -> str:
         """
         The function checks if a code snippet is available in response
@@ -200,7 +248,7 @@ class Agent(AbstractAgent):
         except Exception as e:
             return f"Code Output: Error parsing/executing code snippet: {e}"
 
-    @track("agent.execute_with_context")
+    @trace("agent.execute_with_context")
     def execute_with_context(self, query:str) -> dict:
         """
         LLM decides whether to use a tool. The LLM is prompted with the query and available tools.
@@ -239,7 +287,7 @@ class Agent(AbstractAgent):
         return llm_response_json
 
 
-    @track("agent.execute")
+    @trace("agent.execute")
     def execute(self, query: str, MAX_LOOPS: int = settings.MAX_LOOPS) -> str:
         """
         The method calls LLM and checks if response should be sent to LLM further based on flags.
@@ -283,7 +331,9 @@ class SuperAgent(Agent):
                  description: str,
                  model_name: str,
                  prompt: dict = None,
-                 agents: dict[str: Agent] = None
+                 agents: dict[str: Agent] = None,
+                 step_type: str = None,
+                 pre_validators: dict[str: DeterministicValidator] = None,
                  ):
         """
         Initializes a SuperAgent instance.
@@ -292,8 +342,13 @@ class SuperAgent(Agent):
         :param model_name: The name of the language model used by the agent.
         :param prompt: A dictionary containing the prompt messages for the agent.
         :param agents: A dictionary of agents that the SuperAgent can manage.
+        :param step_type: Step type used by the model router to pick the model tier.
+        :param pre_validators: Deterministic validators by agent name. They check the response against the
+                               previous agent response before the agent, which is skipped if a check fails.
         """
-        super().__init__(name, description, model_name, prompt)
+        super().__init__(name, description, model_name, prompt, step_type=step_type)
+        self.pre_validators = pre_validators or {}
+        self.pre_validated_agents_called = None
         self.tools = agents
         if self.tools:
             self.tools_message = "Available Agents: " + json.dumps([tool.to_dict() for tool in self.tools.values()],
@@ -302,7 +357,7 @@ class SuperAgent(Agent):
             self.tools_message = "Available Agents: None"
 
 
-    @track("super_agent.invoke_agent")
+    @trace("super_agent.invoke_agent")
     def invoke_agent(self, llm_response: dict, query: str, previous_agent_response: str) -> str:
         """
         Invoke an agent based on the LLM response.
@@ -316,6 +371,15 @@ class SuperAgent(Agent):
                 agent_to_run = self.tools.get(agent_name.lower(), None)
                 if agent_to_run is None:
                     return ""
+                pre_validator = self.pre_validators.get(agent_name.lower())
+                if pre_validator is not None:
+                    response = llm_response.get("response")
+                    pre_validation = pre_validator.validate(query, previous_agent_response, response)
+                    if pre_validation.is_rejected:
+                        logger.info(f"Deterministic checks failed, skipping agent: {agent_name}")
+                        return f"Agent Response: {pre_validation.to_agent_output()}"
+                    self.pre_validated_agents_called = True
+                    agent_to_run.context += f"Response to validate: {response}\n{pre_validation.to_context()}\n"
                 agent_to_run.context += f"Previous Agent Response: {previous_agent_response}\n"
                 if not agent_to_run:
                     return f"Agent '{agent_name}' not found in available agents."
@@ -327,7 +391,7 @@ class SuperAgent(Agent):
             logger.error(f"Error invoking agent: {e}")
             raise ValueError(f"Error invoking agent: {e}")
 
-    @track("super_agent.execute_with_context")
+    @trace("super_agent.execute_with_context")
     def execute_with_context(self, query:str, previous_agent_response: str = "") -> dict:
         """
         Execute the SuperAgent with a query and previous agent response
@@ -354,7 +418,7 @@ class SuperAgent(Agent):
             llm_response_json["agent_output"] = "No agent output."
         return llm_response_json
 
-    @track("super_agent.execute")
+    @trace("super_agent.execute")
     def execute(self, query: str, MAX_LOOPS: int = settings.MAX_LOOPS) -> str:
         """
         The method calls LLM and checks if response should be sent to LLM further based on flags.
@@ -368,8 +432,12 @@ class SuperAgent(Agent):
         logger.info(f"Executing super agent: {self.name}")
         query = "Query: " + query
         agent_output = ""
+        validation_requested = False
+        self.pre_validated_agents_called = False
         while MAX_LOOPS>0:
             llm_response_json = self.execute_with_context(query, agent_output)
+            if isinstance(llm_response_json, dict) and str(llm_response_json.get("agent")).lower() in self.pre_validators:
+                validation_requested = True
             try:
                 if llm_response_json["no_further_operations"] == True or llm_response_json[
                     "no_further_operations"] == "true":
@@ -380,6 +448,8 @@ class SuperAgent(Agent):
                 self.context += "User Message: Error checking for no_further_operations in LLM response.\n"
             agent_output = llm_response_json.get("agent_output", "")
             MAX_LOOPS -= 1
+        if validation_requested:
+            get_pre_validation_stats().record_query(llm_validator_called=self.pre_validated_agents_called)
 
         # Final improvement on response
         # llm_response_json = self.execute_with_context(query, agent_output)
@@ -1,13 +1,25 @@
+import json
+
 import requests
-from opik import track
 
 from app.services.agent_service.tool import Tool, ToolParameter
+from app.services.cache import Cache, get_cache
+from app.services.citation_graph import get_citation_graph_store
+from app.services.corpus_snapshot import AGGREGATES, SNAPSHOT_COLUMNS, get_corpus_snapshot_store
+from app.services.table_store import get_table_store
+from app.services.tracing import trace
+from app.settings import get_settings
+
+settings = get_settings()
 
 class UrlFetchTool(Tool):
     """
     Generic tool to fetch data from any url
     """
-    def __init__(self,):
+    def __init__(self, cache: Cache = None):
+        """
+        :param cache: Cache of the fetched content by URL. Defaults to the process-wide "url_fetch" cache.
+        """
         super().__init__(
             name="url_fetch",
             description="Fetch data from a provided URL",
@@ -20,16 +32,21 @@ class UrlFetchTool(Tool):
                 )
             }
         )
+        self.cache = cache or get_cache("url_fetch", ttl_seconds=settings.URL_FETCH_CACHE_TTL_SECONDS)
 
-    @track("url_fetch_tool.execute")
+    @trace("url_fetch_tool.execute")
     def execute(self, url: str) -> str:
         """
         Fetches content from the given URL.
         Returns the text content if successful, otherwise returns an error message.
         """
+        cached_text = self.cache.get(url)
+        if cached_text is not None:
+            return cached_text
         try:
             response = requests.get(url)
             response.raise_for_status()
+            self.cache.set(url, response.text)
             return response.text  # Limit output for safety
         except Exception as e:
             return f"Error fetching URL: {e}"
@@ -39,18 +56,247 @@ class UrlFetchFirebaseDBPythonExamplesTool(UrlFetchTool):
     Specialized tool that fetches Python code examples for Firebase Firestore DB
     from a hardcoded GitHub URL.
     """
-    def __init__(self):
-        super().__init__()
+    def __init__(self, cache: Cache = None):
+        super().__init__(cache)
         self.name = "fetch_firebase_db_python_examples"
         self.description = "Fetch examples to interact with Firebase DB using Python"
         self.parameters = None
 
-    @track("firebase_db_python_api_examples_tool.execute")
+    @trace("firebase_db_python_api_examples_tool.execute")
     def execute(self, **args) -> str:
         return super().execute(
             "https://github.com/GoogleCloudPlatform/python-docs-samples/blob/b535a5f23cbc4d261547002db8f246eb388bd8e8/firestore/cloud-client/snippets.py#L457-L461"
         )
 
+class CorpusStatsTool(Tool):
+    """
+    Tool answering aggregate questions over the whole corpus (counts, papers per author, papers after a year)
+    from the local columnar snapshot, without querying the database.
+    """
+    def __init__(self):
+        super().__init__(
+            name="corpus_stats",
+            description="Filter, count and aggregate all papers of the corpus by their top level fields. "
+                        "Columns: title, authors, publication_date, abstract (text), publication_year and the number of "
+                        "sections, references, tables and figures (numbers). Use it for aggregate questions like "
+                        "'how many papers per author' or 'papers published after 2022'.",
+            function=CorpusStatsTool.execute,
+            parameters={
+                "filters": ToolParameter(
+                    description="List of [column, operator, value] filters combined with AND. Operators: eq, ne, gt, gte, "
+                                "lt, lte on numbers, eq, ne, contains on text, eq, contains on authors. "
+                                "Example: [[\"publication_year\", \"gt\", 2022], [\"authors\", \"contains\", \"Smith\"]]",
+                    type="array",
+                    required=False
+                ),
+                "group_by": ToolParameter(
+                    description="Column to group the papers by, a paper is counted once per author when grouping by authors.",
+                    type="string",
+                    required=False,
+                    allowed_values=list(SNAPSHOT_COLUMNS)
+                ),
+                "aggregate": ToolParameter(
+                    description="Aggregate of the papers (or of each group). Defaults to count.",
+                    type="string",
+                    required=False,
+                    allowed_values=list(AGGREGATES)
+                ),
+                "column": ToolParameter(
+                    description="Numeric column aggregated by sum, avg, min and max.",
+                    type="string",
+                    required=False
+                ),
+                "columns": ToolParameter(
+                    description="Columns of the matching papers to return when not aggregating.",
+                    type="array",
+                    required=False
+                ),
+                "limit": ToolParameter(
+                    description="Maximum number of groups or papers returned. Defaults to 20.",
+                    type="integer",
+                    required=False
+                ),
+            }
+        )
+
+    @trace("corpus_stats_tool.execute")
+    def execute(self, filters: list = None, group_by: str = None, aggregate: str = "count",
+                column: str = None, columns: list[str] = None, limit: int = 20) -> str:
+        """
+        Runs the query on the latest corpus snapshot.
+        Returns the result as JSON, otherwise returns an error message.
+        """
+        try:
+            snapshot = get_corpus_snapshot_store().current()
+            if snapshot is None:
+                return "Error querying corpus: the corpus snapshot is not available yet, query the database instead."
+            result = snapshot.query(filters=filters, group_by=group_by, aggregate=aggregate or "count",
+                                    column=column, columns=columns, limit=int(limit or 20))
+            return json.dumps(result, ensure_ascii=False)
+        except Exception as e:
+            return f"Error querying corpus: {e}"
+
+class CitationGraphTool(Tool):
+    """
+    Tool answering citation questions from the citation graph built at ingest time, without reading the references
+    of every document.
+    """
+    def __init__(self):
+        super().__init__(
+            name="citation_graph",
+            description="Citation links between the papers of the corpus and the works they cite, titles are matched "
+                        "ignoring case, punctuation and small typos. Operations: cited_by (papers of the corpus citing "
+                        "a work), references (works cited by a paper of the corpus), shared_references (papers of the "
+                        "corpus sharing references with a paper, most shared first), most_cited (most cited works). Only the papers whose references were "
+                        "extracted are in the graph, their number is returned as papers_with_references.",
+            function=CitationGraphTool.execute,
+            parameters={
+                "operation": ToolParameter(
+                    description="The citation question to answer.",
+                    type="string",
+                    required=True,
+                    allowed_values=["cited_by", "references", "shared_references", "most_cited"]
+                ),
+                "title": ToolParameter(
+                    description="Title of the work or paper, not needed by most_cited.",
+                    type="string",
+                    required=False
+                ),
+                "limit": ToolParameter(
+                    description="Maximum number of works returned. Defaults to 20.",
+                    type="integer",
+                    required=False
+                ),
+            }
+        )
+
+    @trace("citation_graph_tool.execute")
+    def execute(self, operation: str, title: str = None, limit: int = 20) -> str:
+        """
+        Runs the lookup on the citation graph.
+        Returns the result as JSON, otherwise returns an error message.
+        """
+        try:
+            result = get_citation_graph_store().lookup(operation, title=title, limit=int(limit or 20))
+            return json.dumps(result, ensure_ascii=False)
+        except Exception as e:
+            return f"Error querying the citation graph: {e}"
+
+class TableStatsTool(Tool):
+    """
+    Tool answering numeric questions across papers (best reported accuracy on a dataset, latencies, model sizes)
+    from the tables parsed at ingest time, without reading the tables of every document.
+    """
+    def __init__(self):
+        super().__init__(
+            name="table_stats",
+            description="Query the numbers reported in the tables of all papers. Every number is stored with its paper, "
+                        "table caption, row label and normalised column name (e.g. accuracy, top_1_accuracy, f1, bleu, "
+                        "latency, parameters) and unit (% , ms, x or none). Operations: metrics (available columns), "
+                        "top (values of a metric, best first), best_per_paper (best value of a metric in every paper), "
+                        "summary (count, min, max, average of a metric).",
+            function=TableStatsTool.execute,
+            parameters={
+                "operation": ToolParameter(
+                    description="The query to run, use metrics first to find the column names.",
+                    type="string",
+                    required=True,
+                    allowed_values=["metrics", "top", "best_per_paper", "summary"]
+                ),
+                "metric": ToolParameter(
+                    description="Column of the values, e.g. accuracy. Columns containing the words match.",
+                    type="string",
+                    required=False
+                ),
+                "context": ToolParameter(
+                    description="Text the caption, column or row of the value must contain, e.g. a dataset name.",
+                    type="string",
+                    required=False
+                ),
+                "paper": ToolParameter(
+                    description="Text the paper title must contain.",
+                    type="string",
+                    required=False
+                ),
+                "unit": ToolParameter(
+                    description="Unit of the values: %, ms, x or an empty string. Required if the values of the "
+                                "metric have several units, see metrics.",
+                    type="string",
+                    required=False
+                ),
+                "order": ToolParameter(
+                    description="desc if higher is better (default), asc if lower is better (latency, error rate).",
+                    type="string",
+                    required=False,
+                    allowed_values=["desc", "asc"]
+                ),
+                "limit": ToolParameter(
+                    description="Maximum number of values, papers or metrics returned. Defaults to 20.",
+                    type="integer",
+                    required=False
+                ),
+            }
+        )
+
+    @trace("table_stats_tool.execute")
+    def execute(self, operation: str, metric: str = None, context: str = None, paper: str = None,
+                unit: str = None, order: str = "desc", limit: int = 20) -> str:
+        """
+        Runs the query on the table store.
+        Returns the result as JSON, otherwise returns an error message.
+        """
+        try:
+            result = get_table_store().query(operation, metric=metric, context=context, paper=paper, unit=unit,
+                                             order=order or "desc", limit=int(limit or 20))
+            return json.dumps(result, ensure_ascii=False)
+        except Exception as e:
+            return f"Error querying the table store: {e}"
+
+class PaperDigestTool(Tool):
+    """
+    Tool returning the precomputed digests of papers, for comparison and summary queries.
+    """
+    def __init__(self):
+        super().__init__(
+            name="paper_digests",
+            description="Get the digests of papers by title: summary, key contributions, methods, datasets and metrics. "
+                        "Use it to compare or summarize papers instead of retrieving the full documents.",
+            function=PaperDigestTool.execute,
+            parameters={
+                "titles": ToolParameter(
+                    description="Exact titles of the papers.",
+                    type="array",
+                    required=True
+                )
+            }
+        )
+
+    @trace("paper_digest_tool.execute")
+    def execute(self, titles: list[str]) -> str:
+        """
+        Fetches the digests of the given papers from the database.
+        Returns the digests as JSON, papers without digest are listed separately.
+        """
+        try:
+            from app.services.service_factory import get_database_service
+
+            db_service = get_database_service()
+            digests = {}
+            missing = []
+            for title in titles:
+                document = db_service.get_document(title)
+                if document is None or document.digest is None:
+                    missing.append(title)
+                else:
+                    digests[title] = {"authors": document.authors, "publication_date": document.publication_date,
+                                      **document.digest}
+            result = {"digests": digests}
+            if missing:
+                result["papers_without_digest"] = missing
+            return json.dumps(result, ensure_ascii=False)
+        except Exception as e:
+            return f"Error fetching paper digests: {e}"
+
 if __name__ == "__main__":
     tool = UrlFetchFirebaseDBPythonExamplesTool()
     print(tool.execute())
\ No newline at end of file
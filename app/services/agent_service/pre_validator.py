@@ -0,0 +1,194 @@
+import logging
+import re
+import threading
+from functools import lru_cache
+
+from app.services.corpus_snapshot import get_corpus_snapshot_store
+from app.services.metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+PASSED = "passed"
+FAILED = "failed"
+UNDECIDED = "undecided"
+
+# Markers of a failed retrieval in the output of the db_agent
+ERROR_MARKERS = (
+    "Error parsing/executing code snippet",
+    "Error executing tool",
+    "Error querying corpus",
+    "Error fetching",
+    "Traceback (most recent call last)",
+)
+# Numbers of a text: integers, decimals and thousands separated by commas, e.g. "85.3", "2019", "1,200"
+NUMBER_PATTERN = re.compile(r"(?<![\w.])\d{1,3}(?:,\d{3})+(?:\.\d+)?(?![\w])|(?<![\w.])\d+(?:\.\d+)?(?![\w])")
+# Integers up to this value are not checked: list numbering, counts and ranks are not taken from the documents
+MAX_UNCHECKED_INTEGER = 10
+
+
+class PreValidationResult:
+    """
+    Outcome of the deterministic checks of a response.
+    Only a failed check is conclusive: passing checks do not prove that a response is correct,
+    the validation agent still decides.
+    """
+    def __init__(self, decision: str, reasons: list[str], checked_claims: int = 0):
+        self.decision = decision
+        self.reasons = reasons
+        self.checked_claims = checked_claims
+
+    @property
+    def is_rejected(self) -> bool:
+        return self.decision == FAILED
+
+    def to_agent_output(self) -> str:
+        """
+        :return str: A rejection in the output format of the validation agent.
+        """
+        response = ("The response is not grounded in the retrieved information, retrieve the missing information "
+                    "or correct the response: " + " ".join(self.reasons))
+        return str({"response": response, "no_further_operations": False, "validated_by": "deterministic_checks"})
+
+    def to_context(self) -> str:
+        """
+        :return str: Summary of the checks for the validation agent.
+        """
+        if self.decision == PASSED:
+            return (f"Deterministic checks: the {self.checked_claims} title(s) and number(s) of the response "
+                    f"were found in the retrieved information.")
+        return "Deterministic checks: " + " ".join(self.reasons)
+
+
+class PreValidationStats:
+    """
+    Counts of the deterministic checks, and of the queries that did not call the LLM validator.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {PASSED: 0, FAILED: 0, UNDECIDED: 0, "queries_validated": 0, "queries_skipping_llm_validator": 0}
+
+    def record_check(self, decision: str):
+        with self._lock:
+            self._stats[decision] += 1
+
+    def record_query(self, llm_validator_called: bool):
+        with self._lock:
+            self._stats["queries_validated"] += 1
+            if not llm_validator_called:
+                self._stats["queries_skipping_llm_validator"] += 1
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            queries = self._stats["queries_validated"]
+            return {
+                **self._stats,
+                "skipped_share": round(self._stats["queries_skipping_llm_validator"] / queries, 4) if queries else 0.0,
+            }
+
+
+class DeterministicValidator:
+    """
+    Local checks of the response of the super agent against the information retrieved by the db_agent,
+    run before the LLM validation agent:
+        - the retrieval did not fail (code or tool errors),
+        - every paper of the corpus named in the query was retrieved,
+        - every paper of the corpus cited in the response was retrieved,
+        - every number of the response (values, years) is found in the retrieved information, as is or as a
+          percentage of a fraction, up to the rounding of the response.
+    A failed retrieval or an uncited paper sends the response back with the reasons without calling the validation
+    agent. Numbers not found may be derived (differences, averages), so they are only reported to the validation
+    agent, which decides in all the other cases with the outcome of the checks in its context.
+    """
+    def __init__(self, snapshot_store=None):
+        """
+        :param snapshot_store: CorpusSnapshotStore of the stored documents, used to find the papers named in
+                               the query and the response. Defaults to the process-wide store.
+        """
+        self.snapshot_store = snapshot_store or get_corpus_snapshot_store()
+        self.stats = get_pre_validation_stats()
+
+    @staticmethod
+    def extract_numbers(text: str) -> list[str]:
+        """
+        :return list[str]: Numbers of a text, without thousands separators.
+        """
+        return [match.group().replace(",", "") for match in NUMBER_PATTERN.finditer(text)]
+
+    @staticmethod
+    def is_number_grounded(number: str, retrieved_values: list[float]) -> bool:
+        """
+        Check that a number of a response is one of the retrieved values, rounded to the decimals of the response.
+        Fractions of the retrieved information match their percentage and the other way around.
+        """
+        decimals = len(number.split(".")[1]) if "." in number else 0
+        value = float(number)
+        tolerance = 0.5 * 10 ** -decimals + 1e-9
+        return any(abs(retrieved_value * scale - value) <= tolerance
+                   for retrieved_value in retrieved_values for scale in (1, 100, 0.01))
+
+    def validate(self, query: str, retrieved_information: str, response: str = None) -> PreValidationResult:
+        """
+        Run the deterministic checks on the response to a query.
+
+        :param query: The user query.
+        :param retrieved_information: Output of the previous agent, the information the response must be based on.
+        :param response: Response of the super agent to validate.
+        :return PreValidationResult: Passed, failed or undecided, with the reasons of a failure.
+        """
+        result = self._validate(query, retrieved_information or "", response or "")
+        self.stats.record_check(result.decision)
+        logger.info(f"Deterministic validation {result.decision}: {result.reasons}")
+        return result
+
+    def _validate(self, query: str, retrieved_information: str, response: str) -> PreValidationResult:
+        errors = [marker for marker in ERROR_MARKERS if marker in retrieved_information]
+        if errors:
+            return PreValidationResult(FAILED, [f"The retrieval failed ({', '.join(errors)})."])
+        if not retrieved_information.strip():
+            return PreValidationResult(UNDECIDED, ["No retrieved information to check the response against."])
+
+        reasons = []
+        checked_claims = 0
+        casefolded_information = retrieved_information.casefold()
+        snapshot = self.snapshot_store.current()
+        if snapshot is not None:
+            titles = snapshot.column("title")
+            for row in snapshot.mentioned_titles(query):
+                if titles.value(row).casefold() not in casefolded_information:
+                    reasons.append(f"The query mentions '{titles.value(row)}', which was not retrieved.")
+            for row in snapshot.mentioned_titles(response):
+                checked_claims += 1
+                if titles.value(row).casefold() not in casefolded_information:
+                    reasons.append(f"The response cites '{titles.value(row)}', which was not retrieved.")
+
+        if reasons:
+            return PreValidationResult(FAILED, reasons, checked_claims)
+
+        # A number missing from the retrieved information may be derived from it (a difference, an average),
+        # so it is left to the validation agent instead of rejecting the response
+        ungrounded_numbers = []
+        retrieved_values = [float(number) for number in set(self.extract_numbers(retrieved_information))]
+        query_numbers = set(self.extract_numbers(query))
+        for number in dict.fromkeys(self.extract_numbers(response)):
+            if number in query_numbers or ("." not in number and int(number) <= MAX_UNCHECKED_INTEGER):
+                continue
+            checked_claims += 1
+            if not self.is_number_grounded(number, retrieved_values):
+                ungrounded_numbers.append(number)
+        if ungrounded_numbers:
+            return PreValidationResult(UNDECIDED, [
+                f"The response states {', '.join(ungrounded_numbers)}, not found in the retrieved information: "
+                f"check that they are computed correctly from it."], checked_claims)
+        if not checked_claims:
+            return PreValidationResult(UNDECIDED, ["The response has no title or number to check."])
+        return PreValidationResult(PASSED, [], checked_claims)
+
+
+@lru_cache
+def get_pre_validation_stats() -> PreValidationStats:
+    """
+    Get the process-wide pre-validation statistics.
+    """
+    stats = PreValidationStats()
+    metrics_registry.register("pre_validation", stats.to_dict)
+    return stats
@@ -0,0 +1,406 @@
+import fcntl
+import json
+import logging
+import os
+import tempfile
+import time
+import uuid
+from abc import ABC, abstractmethod
+from pathlib import Path
+from pydantic import TypeAdapter
+
+from app.settings import get_settings
+from app.services.blob_store import BlobStore
+from app.services.checkpoint_service import FailedFile, IngestionReport
+from app.services.citation_graph import get_citation_graph_store
+from app.services.table_store import get_table_store
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+BATCH_RUNNING = "running"
+# The batch job has completed and one poller is storing its documents
+BATCH_COLLECTING = "collecting"
+BATCH_SUCCEEDED = "succeeded"
+BATCH_FAILED = "failed"
+
+
+class BatchBackend(ABC):
+    """
+    Backend running batches of extraction requests.
+    A request is a dict with a unique `key`, the `file_path` of the PDF and the `recipe` model to extract.
+    """
+
+    @abstractmethod
+    def submit(self, requests: list[dict]) -> str:
+        """
+        Submit a batch of requests.
+        :return str: Name of the batch job in the backend.
+        """
+        pass
+
+    @abstractmethod
+    def get_state(self, job_name: str) -> str:
+        """
+        :return str: BATCH_RUNNING, BATCH_SUCCEEDED or BATCH_FAILED.
+        """
+        pass
+
+    @abstractmethod
+    def get_results(self, job_name: str) -> dict:
+        """
+        :return dict: Response text, or error message wrapped in an Exception, by request key.
+        """
+        pass
+
+
+class GeminiBatchBackend(BatchBackend):
+    """
+    Gemini batch prediction API backend.
+    Requests are written to a JSONL file uploaded with the Files API, the batch job writes its responses
+    to a result file. Batch jobs are not rate limited like interactive calls and are billed at a lower price.
+    """
+    FINAL_STATES = {
+        "JOB_STATE_SUCCEEDED": BATCH_SUCCEEDED,
+        "JOB_STATE_PARTIALLY_SUCCEEDED": BATCH_SUCCEEDED,
+        "JOB_STATE_FAILED": BATCH_FAILED,
+        "JOB_STATE_CANCELLED": BATCH_FAILED,
+        "JOB_STATE_EXPIRED": BATCH_FAILED,
+    }
+
+    def __init__(self, model_service=None):
+        """
+        :param model_service: Information extraction model service providing the client and the prompts.
+        """
+        if model_service is None:
+            from app.services.model_service import InformationExtractionModelService
+            model_service = InformationExtractionModelService()
+        self.model_service = model_service
+        self.client = model_service.client
+
+    def _build_request_line(self, request: dict, file_uri: str) -> dict:
+        return {
+            "key": request["key"],
+            "request": {
+                "contents": [{
+                    "role": "user",
+                    "parts": [
+                        {"text": self.model_service.system_prompt},
+                        {"text": self.model_service.user_prompt},
+                        {"file_data": {"file_uri": file_uri, "mime_type": "application/pdf"}},
+                    ],
+                }],
+                "generation_config": {
+                    "response_mime_type": "application/json",
+                    "response_json_schema": TypeAdapter(list[request["recipe"]]).json_schema(),
+                    "max_output_tokens": 8192,
+                },
+            },
+        }
+
+    def submit(self, requests: list[dict]) -> str:
+        # Each PDF is uploaded once and shared by all its recipe requests
+        file_uris = {}
+        for request in requests:
+            if request["file_path"] not in file_uris:
+                file_uris[request["file_path"]] = self.model_service.upload_file(request["file_path"]).uri
+
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as requests_file:
+            for request in requests:
+                requests_file.write(json.dumps(self._build_request_line(request, file_uris[request["file_path"]])) + "\n")
+        try:
+            uploaded_requests = self.client.files.upload(
+                file=requests_file.name,
+                config={"display_name": Path(requests_file.name).name, "mime_type": "jsonl"},
+            )
+        finally:
+            os.remove(requests_file.name)
+        batch_job = self.client.batches.create(
+            model=self.model_service.model_name,
+            src=uploaded_requests.name,
+            config={"display_name": f"ingest-{uuid.uuid4().hex[:8]}"},
+        )
+        logger.info(f"Submitted Gemini batch job {batch_job.name} with {len(requests)} request(s).")
+        return batch_job.name
+
+    def get_state(self, job_name: str) -> str:
+        batch_job = self.client.batches.get(name=job_name)
+        return self.FINAL_STATES.get(batch_job.state.name, BATCH_RUNNING)
+
+    def get_results(self, job_name: str) -> dict:
+        batch_job = self.client.batches.get(name=job_name)
+        content = self.client.files.download(file=batch_job.dest.file_name).decode("utf-8")
+        results = {}
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            try:
+                if "error" in result:
+                    raise ValueError(result["error"])
+                results[result["key"]] = result["response"]["candidates"][0]["content"]["parts"][0]["text"]
+            except Exception as e:
+                results[result.get("key")] = Exception(f"Invalid batch response: {e}")
+        return results
+
+
+class FakeBatchBackend(BatchBackend):
+    """
+    Local in-memory batch backend for tests and local development.
+    Responses are produced by a responder function when the job is submitted, and the job reports
+    itself as running for a configurable number of polls.
+    """
+
+    def __init__(self, responder, polls_until_done: int = 1):
+        """
+        :param responder: Function called with a request, returning the response text. Raised exceptions are
+                          reported as failed requests.
+        :param polls_until_done: Number of get_state calls reporting the job as running.
+        """
+        self.responder = responder
+        self.polls_until_done = polls_until_done
+        self.jobs = {}
+
+    def submit(self, requests: list[dict]) -> str:
+        job_name = f"fake-batches/{uuid.uuid4().hex}"
+        results = {}
+        for request in requests:
+            try:
+                results[request["key"]] = self.responder(request)
+            except Exception as e:
+                results[request["key"]] = e
+        self.jobs[job_name] = {"remaining_polls": self.polls_until_done, "results": results}
+        return job_name
+
+    def get_state(self, job_name: str) -> str:
+        job = self.jobs[job_name]
+        if job["remaining_polls"] > 0:
+            job["remaining_polls"] -= 1
+            return BATCH_RUNNING
+        return BATCH_SUCCEEDED
+
+    def get_results(self, job_name: str) -> dict:
+        return self.jobs[job_name]["results"]
+
+
+class BatchIngestionService:
+    """
+    Offline ingestion of many PDFs through a batch backend.
+    One request is built for every (file, recipe) pair and all requests are submitted as a single batch job.
+    When the job completes, the responses go through the validation and merge logic of
+    PdfInformationExtractionService and the documents are written with DatabaseService.
+    Jobs are persisted in settings.BATCH_JOBS_DIR so they can be polled from another request or process.
+    """
+
+    def __init__(self, backend: BatchBackend = None, extraction_service=None, db_service=None):
+        """
+        :param backend: Batch backend, defaults to the Gemini batch API.
+        :param extraction_service: Service providing the recipes and the validation/merge logic.
+        :param db_service: Service storing the documents, created on first use if not provided.
+        """
+        if extraction_service is None:
+            from app.services.pdf_information_extraction_service import PdfInformationExtractionService
+            extraction_service = PdfInformationExtractionService()
+        self.extraction_service = extraction_service
+        self.backend = backend or GeminiBatchBackend(extraction_service.pdf_reader)
+        self.db_service = db_service
+        self.jobs_dir = Path(settings.BATCH_JOBS_DIR)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+
+    def _job_path(self, job_id: str) -> Path:
+        return self.jobs_dir / f"{job_id}.json"
+
+    def _save_job(self, job: dict):
+        job_path = self._job_path(job["job_id"])
+        temp_path = job_path.with_suffix(".json.tmp")
+        with open(temp_path, 'w') as file:
+            json.dump(job, file, indent=2)
+        os.replace(temp_path, job_path)
+
+    def _with_job_lock(self, job_id: str, function):
+        """
+        Run a function under the exclusive file lock of a job, shared by the threads and processes polling it.
+        """
+        with open(self.jobs_dir / f"{job_id}.lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                return function()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _claim_collection(self, job_id: str) -> dict | None:
+        """
+        Move a completed job to BATCH_COLLECTING, unless another poller is collecting it.
+
+        :return dict: The claimed job, None if the job was already claimed or completed.
+        """
+        def claim():
+            job = self.load_job(job_id)
+            stale = (job["status"] == BATCH_COLLECTING
+                     and time.time() - job.get("collecting_at", 0) > settings.BATCH_COLLECT_LEASE_SECONDS)
+            if job["status"] != BATCH_RUNNING and not stale:
+                return None
+            job["status"] = BATCH_COLLECTING
+            job["collecting_at"] = time.time()
+            self._save_job(job)
+            return job
+
+        return self._with_job_lock(job_id, claim)
+
+    def _set_status(self, job_id: str, status: str, expected_status: str, **fields) -> dict:
+        """
+        Set the status (and other fields) of a job if it still has the expected status.
+
+        :return dict: The job after the update.
+        """
+        def update():
+            job = self.load_job(job_id)
+            if job["status"] == expected_status:
+                job.update(status=status, **fields)
+                self._save_job(job)
+            return job
+
+        return self._with_job_lock(job_id, update)
+
+    def load_job(self, job_id: str) -> dict | None:
+        job_path = self._job_path(job_id)
+        if not job_path.exists():
+            return None
+        with open(job_path, 'r') as file:
+            return json.load(file)
+
+    def build_requests(self, file_paths: list[Path]) -> list[dict]:
+        """
+        Build one request per (file, recipe) pair.
+        """
+        return [
+            {"key": f"{file_index}:{recipe_name}", "file_path": str(file_path), "recipe": recipe}
+            for file_index, file_path in enumerate(file_paths)
+            for recipe_name, recipe in self.extraction_service.recipes.items()
+        ]
+
+    def submit(self, file_paths: list[Path]) -> str:
+        """
+        Submit the extraction of files as one batch job.
+
+        :param file_paths: Paths of the PDF files.
+        :return str: The job id.
+        """
+        if not file_paths:
+            raise ValueError("No files provided for batch ingestion.")
+        job_id = uuid.uuid4().hex
+        backend_job_name = self.backend.submit(self.build_requests(file_paths))
+        self._save_job({
+            "job_id": job_id,
+            "backend_job_name": backend_job_name,
+            "files": [str(file_path) for file_path in file_paths],
+            "status": BATCH_RUNNING,
+            "submitted_at": time.time(),
+            "report": None,
+        })
+        return job_id
+
+    def collect(self, job: dict) -> IngestionReport:
+        """
+        Build the documents of a completed batch job, file by file.
+        """
+        results = self.backend.get_results(job["backend_job_name"])
+        documents = []
+        failed_files = []
+        for file_index, file_path in enumerate(job["files"]):
+            recipe_data = {}
+            errors = []
+            for recipe_name, recipe in self.extraction_service.recipes.items():
+                result = results.get(f"{file_index}:{recipe_name}", Exception("Missing response"))
+                try:
+                    if isinstance(result, Exception):
+                        raise result
+                    recipe_data[recipe_name] = self.extraction_service.parse_recipe_response(recipe, result)
+                except Exception as e:
+                    logger.error(f"Error extracting {recipe_name} for {file_path} in batch job {job['job_id']}: {e}")
+                    errors.append(f"{recipe_name}: {e}")
+            try:
+                documents.append(self.extraction_service.build_document(recipe_data,
+                                                                        source_hash=BlobStore.hash_of(file_path)))
+            except Exception as e:
+                failed_files.append(FailedFile(file=file_path, error="; ".join(errors) or str(e), attempts=1))
+        return IngestionReport(job_id=job["job_id"], documents=documents, failed_files=failed_files)
+
+    def poll(self, job_id: str) -> dict:
+        """
+        Check a batch job. When it has completed, its documents are stored in the database once: the first poller
+        moves the job to BATCH_COLLECTING under the job lock and stores the documents, concurrent polls return
+        the collecting job until it has succeeded.
+
+        :param job_id: The job id.
+        :return dict: The job record, with the ingestion report once completed.
+        """
+        job = self.load_job(job_id)
+        if job is None:
+            raise ValueError(f"Batch job '{job_id}' not found.")
+        if job["status"] == BATCH_COLLECTING:
+            if time.time() - job.get("collecting_at", 0) <= settings.BATCH_COLLECT_LEASE_SECONDS:
+                return job
+        elif job["status"] != BATCH_RUNNING:
+            return job
+        else:
+            state = self.backend.get_state(job["backend_job_name"])
+            if state == BATCH_RUNNING:
+                return job
+            if state == BATCH_FAILED:
+                return self._set_status(job_id, BATCH_FAILED, expected_status=BATCH_RUNNING, completed_at=time.time())
+
+        job = self._claim_collection(job_id)
+        if job is None:
+            return self.load_job(job_id)
+        try:
+            report = self.collect(job)
+            if report.documents:
+                if self.db_service is None:
+                    from app.services.db_service import DatabaseService
+                    self.db_service = DatabaseService()
+                from app.services.paper_digest_service import PaperDigestService
+                report.documents = PaperDigestService(db_service=self.db_service).add_digests(report.documents)
+                self.db_service.add_documents(report.documents)
+                get_citation_graph_store().add_papers(report.documents)
+                get_table_store().add_documents(report.documents)
+        except Exception:
+            # The next poll collects the job again
+            self._set_status(job_id, BATCH_RUNNING, expected_status=BATCH_COLLECTING)
+            raise
+        job["status"] = BATCH_SUCCEEDED
+        job["completed_at"] = time.time()
+        job["report"] = {
+            "documents": [document.title for document in report.documents],
+            "failed_files": [failed_file.model_dump() for failed_file in report.failed_files],
+        }
+        self._with_job_lock(job_id, lambda: self._save_job(job))
+        return job
+
+    def run(self, file_paths: list[Path], poll_interval_seconds: float = None) -> dict:
+        """
+        Submit a batch job and wait for its completion.
+
+        :param file_paths: Paths of the PDF files.
+        :param poll_interval_seconds: Seconds between polls, defaults to settings.BATCH_POLL_INTERVAL_SECONDS.
+        :return dict: The completed job record.
+        """
+        poll_interval_seconds = settings.BATCH_POLL_INTERVAL_SECONDS if poll_interval_seconds is None else poll_interval_seconds
+        job_id = self.submit(file_paths)
+        while True:
+            job = self.poll(job_id)
+            if job["status"] not in (BATCH_RUNNING, BATCH_COLLECTING):
+                return job
+            time.sleep(poll_interval_seconds)
+
+
+if __name__ == "__main__":
+    import argparse
+    logging.basicConfig(level=logging.INFO, format="%(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Backfill PDFs through the Gemini batch prediction API.")
+    parser.add_argument("paths", nargs="+", help="PDF files or directories containing PDF files.")
+    args = parser.parse_args()
+    pdf_paths = []
+    for path in map(Path, args.paths):
+        pdf_paths.extend(sorted(path.rglob("*.pdf")) if path.is_dir() else [path])
+    print(json.dumps(BatchIngestionService().run(pdf_paths), indent=2))
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import re
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from app.settings import get_settings
+from app.services.admission_control import AdmissionRejected, get_admission_controller
+from app.services.corpus_snapshot import get_corpus_snapshot_store
+from app.services.hedging import request_deadline
+from app.services.session_store import ChatSession, use_document_cache
+from app.services.tracing import trace
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Admission class of the queries of a batch, see settings.ADMISSION_CLASSES
+BATCH_ADMISSION_CLASS = "batch"
+
+
+def normalize_query(query: str) -> str:
+    """
+    Normalize a chatbot query, ignoring case and whitespace, so that identical questions are answered once.
+    """
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+
+class BatchQueryService:
+    """
+    Answers a batch of chatbot queries with shared retrieval.
+
+    The retrieval is planned across the batch: duplicate queries are answered once, and the papers of the corpus
+    named in the queries are fetched once, before the agents run, into a document cache shared by all the queries.
+    Documents fetched by the agents are added to the same cache, and concurrent fetches of the same document
+    are coalesced, so overlapping queries do not read a paper twice.
+
+    Queries run concurrently, at most settings.CHATBOT_BATCH_MAX_CONCURRENCY at a time, and each one holds a slot
+    of the admission controller (`batch` class), so a batch shares the global model budget with the interactive
+    requests, with a lower priority.
+    """
+    def __init__(self, db_service=None, chatbot_service_factory=None, snapshot_store=None,
+                 admission_controller=None, max_concurrency: int = None):
+        """
+        :param db_service: DatabaseService reading the documents.
+        :param chatbot_service_factory: Function creating the ChatbotService answering a query, one per query
+                                        as agents keep per-query state. Defaults to the service factory.
+        :param snapshot_store: CorpusSnapshotStore used to find the papers named in the queries.
+                               Defaults to the process-wide store.
+        :param admission_controller: Controller granting the model budget. Defaults to the process-wide controller
+                                     when admission control is enabled.
+        :param max_concurrency: Queries answered at once. Defaults to settings.CHATBOT_BATCH_MAX_CONCURRENCY.
+        """
+        if chatbot_service_factory is None:
+            from app.services.service_factory import get_chatbot_service
+            chatbot_service_factory = get_chatbot_service
+        if admission_controller is None and settings.ADMISSION_CONTROL_ENABLED:
+            admission_controller = get_admission_controller()
+        if admission_controller is not None and BATCH_ADMISSION_CLASS not in admission_controller.classes:
+            admission_controller = None
+        self.db_service = db_service
+        self.chatbot_service_factory = chatbot_service_factory
+        self.snapshot_store = snapshot_store or get_corpus_snapshot_store()
+        self.admission_controller = admission_controller
+        self.max_concurrency = max_concurrency or settings.CHATBOT_BATCH_MAX_CONCURRENCY
+
+    def plan(self, queries: list[str]) -> dict:
+        """
+        Plan the retrieval of a batch.
+
+        :param queries: The queries of the batch.
+        :return dict: Indexes of every distinct query, and titles of the papers named in the queries.
+        """
+        query_indexes = {}
+        for index, query in enumerate(queries):
+            query_indexes.setdefault(normalize_query(query), []).append(index)
+
+        titles = []
+        snapshot = self.snapshot_store.current()
+        if snapshot is not None:
+            rows = {row for query in query_indexes for row in snapshot.mentioned_titles(query)}
+            titles = sorted(snapshot.column("title").value(row) for row in rows)
+        return {"query_indexes": query_indexes, "titles": titles}
+
+    @trace("batch_query_service.prefetch", capture_output=False)
+    def prefetch(self, titles: list[str], cache: ChatSession) -> int:
+        """
+        Fetch the planned documents into the shared cache, in parallel.
+
+        :return int: Number of documents found.
+        """
+        if not titles or self.db_service is None:
+            return 0
+
+        def fetch(title: str):
+            with use_document_cache(cache):
+                return self.db_service.get_document(title)
+
+        with ThreadPoolExecutor(max_workers=min(len(titles), self.max_concurrency)) as executor:
+            return sum(document is not None for document in executor.map(fetch, titles))
+
+    def answer(self, query: str, cache: ChatSession) -> str:
+        with request_deadline(settings.CHATBOT_REQUEST_DEADLINE_SECONDS), use_document_cache(cache):
+            return self.chatbot_service_factory().get_response(query=query, db_service=self.db_service,
+                                                               shared_documents=cache)
+
+    async def _answer_with_budget(self, query: str, cache: ChatSession, semaphore: asyncio.Semaphore,
+                                  client: str) -> tuple[str, dict]:
+        async with semaphore:
+            ticket = None
+            succeeded = False
+            start_time = time.monotonic()
+            try:
+                if self.admission_controller is not None:
+                    ticket = await self.admission_controller.acquire(BATCH_ADMISSION_CLASS, client)
+                result = {"response": await asyncio.to_thread(self.answer, query, cache)}
+                succeeded = True
+            except AdmissionRejected as e:
+                result = {"error": e.reason, "retry_after": e.retry_after}
+            except Exception as e:
+                logger.error(f"Error answering batch query '{query}': {e}")
+                result = {"error": str(e)}
+            finally:
+                if ticket is not None:
+                    self.admission_controller.release(ticket, succeeded=succeeded)
+            result["latency_ms"] = round((time.monotonic() - start_time) * 1000, 1)
+            return query, result
+
+    async def astream(self, queries: list[str]):
+        """
+        Answer a batch of queries, yielding the results as soon as they are available.
+
+        Yields a `plan` record, one record per query (in completion order, with the `index` of the query
+        in the batch), and a `summary` record.
+
+        :param queries: The queries of the batch.
+        """
+        start_time = time.monotonic()
+        plan = self.plan(queries)
+        query_indexes = plan["query_indexes"]
+        cache = ChatSession(f"batch-{uuid.uuid4().hex}")
+        prefetched = await asyncio.to_thread(self.prefetch, plan["titles"], cache)
+        yield {"plan": {"queries": len(queries), "distinct_queries": len(query_indexes),
+                        "planned_documents": plan["titles"], "prefetched_documents": prefetched}}
+
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+        # Distinct queries are answered once, with the text of their first occurrence
+        tasks = [asyncio.create_task(self._answer_with_budget(queries[indexes[0]], cache, semaphore, cache.session_id))
+                 for indexes in query_indexes.values()]
+        failed = 0
+        try:
+            for task in asyncio.as_completed(tasks):
+                query, result = await task
+                failed += "error" in result
+                for index in query_indexes[normalize_query(query)]:
+                    yield {"index": index, "query": queries[index], **result}
+        finally:
+            # The client went away or the batch failed: the queries not started yet are dropped
+            for task in tasks:
+                task.cancel()
+
+        yield {"summary": {
+            "queries": len(queries),
+            "distinct_queries": len(query_indexes),
+            "failed_queries": failed,
+            "document_cache": {**cache.stats, "cached_documents": len(cache.documents)},
+            "elapsed_ms": round((time.monotonic() - start_time) * 1000, 1),
+        }}
@@ -0,0 +1,319 @@
+"""
+Content-addressed store of the uploaded PDF files.
+
+Files are stored once per content, named by their SHA-256, and referenced by the ingestion jobs using them:
+
+    <EXTRACTED_FILES_DIR>/blobs/<sha256[:2]>/<sha256>.pdf   the files, never modified once written
+    <EXTRACTED_FILES_DIR>/tmp/                              files being written
+    <EXTRACTED_FILES_DIR>/index.sqlite3                     size and last use of every blob, references by job
+
+A blob is written to a temporary file while it is hashed, then hard linked to its final name, so readers never see
+a partial file and identical uploads share one file. Referenced blobs are never deleted. Unreferenced blobs are
+kept for settings.BLOB_GC_MIN_AGE_SECONDS, so re-uploads are deduplicated, and evicted least recently used first
+when the store exceeds settings.BLOB_STORE_MAX_BYTES. References of jobs that never released them (e.g. a crashed
+process) expire after settings.BLOB_REF_TTL_SECONDS.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+import uuid
+from functools import lru_cache
+from pathlib import Path
+
+from app.settings import get_settings
+from app.services.metrics import metrics_registry
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+BLOB_SUFFIX = ".pdf"
+COPY_BLOCK_SIZE = 1024 * 1024
+
+
+def is_blob_hash(value: str) -> bool:
+    return len(value) == 64 and all(character in "0123456789abcdef" for character in value)
+
+
+class BlobStore:
+    """
+    Content-addressed, reference counted store of files, shared by the API and the worker processes.
+    SQLite serialises the writers, and blobs are linked and deleted while holding its write lock,
+    so a blob is never deleted between its reference by a job and its use.
+    """
+
+    def __init__(self, root_dir: str = None):
+        """
+        :param root_dir: Directory of the store. Defaults to settings.EXTRACTED_FILES_DIR.
+        """
+        self.root_dir = Path(root_dir or settings.EXTRACTED_FILES_DIR)
+        self.blobs_dir = self.root_dir / "blobs"
+        self.temp_dir = self.root_dir / "tmp"
+        self.blobs_dir.mkdir(parents=True, exist_ok=True)
+        self.temp_dir.mkdir(parents=True, exist_ok=True)
+        self.db_path = self.root_dir / "index.sqlite3"
+        self._last_gc = 0.0
+        with self._connect() as connection:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS blobs (
+                    hash TEXT PRIMARY KEY,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_used_at REAL NOT NULL
+                )
+                """
+            )
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS blob_refs (
+                    job_id TEXT NOT NULL,
+                    hash TEXT NOT NULL,
+                    name TEXT,
+                    created_at REAL NOT NULL,
+                    PRIMARY KEY (job_id, hash)
+                )
+                """
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS idx_blob_refs_hash ON blob_refs (hash)")
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def path(self, blob_hash: str) -> Path:
+        """
+        :return Path: Path of a blob, it may not exist.
+        """
+        if not is_blob_hash(blob_hash):
+            raise ValueError(f"Invalid blob hash: {blob_hash}")
+        return self.blobs_dir / blob_hash[:2] / f"{blob_hash}{BLOB_SUFFIX}"
+
+    @staticmethod
+    def hash_of(path: Path) -> str | None:
+        """
+        :return str: Hash of a blob from its path, None if the path is not the path of a blob.
+        """
+        path = Path(path)
+        if path.suffix == BLOB_SUFFIX and is_blob_hash(path.stem) and path.parent.name == path.stem[:2]:
+            return path.stem
+        return None
+
+    def exists(self, blob_hash: str) -> bool:
+        return self.path(blob_hash).exists()
+
+    def _commit(self, temp_path: Path, blob_hash: str, size: int, job_id: str, name: str = None) -> Path:
+        """
+        Publish a file written to the temporary directory as a blob, referenced by a job.
+        The temporary file is removed, the blob is kept if it already exists.
+        """
+        blob_path = self.path(blob_hash)
+        blob_path.parent.mkdir(exist_ok=True)
+        now = time.time()
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                # A hard link never replaces an existing blob, which may be read by extraction
+                os.link(temp_path, blob_path)
+            except FileExistsError:
+                pass
+            connection.execute(
+                "INSERT INTO blobs (hash, size, created_at, last_used_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (hash) DO UPDATE SET last_used_at = excluded.last_used_at",
+                (blob_hash, size, now, now),
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO blob_refs (job_id, hash, name, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, blob_hash, name, now),
+            )
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+            temp_path.unlink(missing_ok=True)
+        return blob_path
+
+    def put_stream(self, stream, job_id: str, name: str = None) -> str:
+        """
+        Store the content of a binary stream, without loading it in memory.
+
+        :param stream: Readable binary file object, e.g. an uploaded file or a ZIP member.
+        :param job_id: Job referencing the blob.
+        :param name: Original name of the file, kept with the reference for troubleshooting.
+        :return str: Hash of the blob.
+        """
+        temp_path = self.temp_dir / f"{uuid.uuid4().hex}.tmp"
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with open(temp_path, "wb") as temp_file:
+                for block in iter(lambda: stream.read(COPY_BLOCK_SIZE), b""):
+                    digest.update(block)
+                    temp_file.write(block)
+                    size += len(block)
+        except Exception:
+            temp_path.unlink(missing_ok=True)
+            raise
+        blob_hash = digest.hexdigest()
+        self._commit(temp_path, blob_hash, size, job_id, name)
+        return blob_hash
+
+    def put_file(self, path: Path, job_id: str, name: str = None) -> str:
+        """
+        Store a local file. The file is copied, so later changes of the file do not change the blob.
+
+        :param path: Path of the file.
+        :param job_id: Job referencing the blob.
+        :param name: Original name of the file. Defaults to the file name.
+        :return str: Hash of the blob.
+        """
+        path = Path(path)
+        with open(path, "rb") as file:
+            return self.put_stream(file, job_id, name or path.name)
+
+    def add_ref(self, blob_hash: str, job_id: str, name: str = None):
+        """
+        Reference an existing blob by a job.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            if connection.execute("UPDATE blobs SET last_used_at = ? WHERE hash = ?", (now, blob_hash)).rowcount == 0:
+                raise ValueError(f"Blob {blob_hash} does not exist.")
+            connection.execute(
+                "INSERT OR REPLACE INTO blob_refs (job_id, hash, name, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, blob_hash, name, now),
+            )
+
+    def release(self, job_id: str) -> int:
+        """
+        Release the references of a job. Its blobs are deleted by the next garbage collection if
+        no other job references them.
+
+        :return int: Number of released references.
+        """
+        now = time.time()
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE blobs SET last_used_at = ? WHERE hash IN (SELECT hash FROM blob_refs WHERE job_id = ?)",
+                (now, job_id),
+            )
+            return connection.execute("DELETE FROM blob_refs WHERE job_id = ?", (job_id,)).rowcount
+
+    def refs(self, job_id: str) -> list[dict]:
+        """
+        :return list[dict]: Hash and original name of the blobs referenced by a job.
+        """
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT hash, name, created_at FROM blob_refs WHERE job_id = ? ORDER BY created_at", (job_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def gc(self, max_bytes: int = None, min_age_seconds: float = None, ref_ttl_seconds: float = None) -> dict:
+        """
+        Delete the expired references, the unreferenced blobs unused for min_age_seconds, then the least
+        recently used unreferenced blobs until the store is under max_bytes.
+
+        :param max_bytes: Size of the store. Defaults to settings.BLOB_STORE_MAX_BYTES.
+        :param min_age_seconds: Time unreferenced blobs are kept. Defaults to settings.BLOB_GC_MIN_AGE_SECONDS.
+        :param ref_ttl_seconds: Age of expired references. Defaults to settings.BLOB_REF_TTL_SECONDS.
+        :return dict: Counts of the deleted references and blobs, and freed bytes.
+        """
+        max_bytes = settings.BLOB_STORE_MAX_BYTES if max_bytes is None else max_bytes
+        min_age_seconds = settings.BLOB_GC_MIN_AGE_SECONDS if min_age_seconds is None else min_age_seconds
+        ref_ttl_seconds = settings.BLOB_REF_TTL_SECONDS if ref_ttl_seconds is None else ref_ttl_seconds
+        now = time.time()
+        deleted = []
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            expired_refs = connection.execute(
+                "DELETE FROM blob_refs WHERE created_at < ?", (now - ref_ttl_seconds,)).rowcount
+            total_bytes = connection.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            candidates = connection.execute(
+                """
+                SELECT hash, size, last_used_at FROM blobs
+                WHERE NOT EXISTS (SELECT 1 FROM blob_refs WHERE blob_refs.hash = blobs.hash)
+                ORDER BY last_used_at
+                """
+            ).fetchall()
+            for candidate in candidates:
+                if candidate["last_used_at"] >= now - min_age_seconds and total_bytes <= max_bytes:
+                    break
+                deleted.append(candidate)
+                total_bytes -= candidate["size"]
+            connection.executemany("DELETE FROM blobs WHERE hash = ?", [(blob["hash"],) for blob in deleted])
+            # Files are deleted under the write lock, so a concurrent upload of the same content links a new blob
+            for blob in deleted:
+                self.path(blob["hash"]).unlink(missing_ok=True)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+        # Files left by interrupted writes
+        for temp_path in self.temp_dir.iterdir():
+            try:
+                if temp_path.stat().st_mtime < now - settings.BLOB_TEMP_MAX_AGE_SECONDS:
+                    temp_path.unlink(missing_ok=True)
+            except FileNotFoundError:
+                pass
+        self._last_gc = time.monotonic()
+        result = {"expired_refs": expired_refs, "deleted_blobs": len(deleted),
+                  "freed_bytes": sum(blob["size"] for blob in deleted), "total_bytes": total_bytes}
+        if deleted or expired_refs:
+            logger.info(f"Blob store garbage collection: {result}")
+        return result
+
+    def maybe_gc(self):
+        """
+        Run the garbage collection if it did not run in this process for settings.BLOB_GC_INTERVAL_SECONDS.
+        """
+        if time.monotonic() - self._last_gc < settings.BLOB_GC_INTERVAL_SECONDS:
+            return
+        try:
+            self.gc()
+        except Exception as e:
+            logger.error(f"Error collecting the blob store: {e}")
+
+    def to_dict(self) -> dict:
+        with self._connect() as connection:
+            blobs, total_bytes = connection.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM blobs").fetchone()
+            refs, referenced_blobs = connection.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT hash) FROM blob_refs").fetchone()
+        return {"blobs": blobs, "total_bytes": total_bytes, "refs": refs, "referenced_blobs": referenced_blobs,
+                "max_bytes": settings.BLOB_STORE_MAX_BYTES}
+
+
+@lru_cache
+def get_blob_store() -> BlobStore:
+    """
+    Get the process-wide blob store.
+    """
+    store = BlobStore()
+    metrics_registry.register("blob_store", store.to_dict)
+    return store
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Inspect or collect the blob store of the uploaded files.")
+    parser.add_argument("--gc", action="store_true", help="Run the garbage collection.")
+    parser.add_argument("--max-bytes", type=int, help="Size of the store, defaults to BLOB_STORE_MAX_BYTES.")
+    parser.add_argument("--min-age-seconds", type=float, help="Time unreferenced blobs are kept.")
+    args = parser.parse_args()
+
+    store = get_blob_store()
+    if args.gc:
+        print(json.dumps(store.gc(max_bytes=args.max_bytes, min_age_seconds=args.min_age_seconds)))
+    print(json.dumps(store.to_dict()))
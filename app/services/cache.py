@@ -0,0 +1,593 @@
+"""
+Cache shared by the processes and the nodes of the service.
+
+Backends, selected with settings.CACHE_BACKEND:
+
+    memory  LRU dict of the process, lost on restart
+    sqlite  file shared by the processes of a node (CACHE_PATH), kept across restarts
+    redis   server speaking the Redis protocol (CACHE_URL), shared by the nodes. `python -m app.services.cache --serve`
+            runs a local stand-in server for development and tests
+
+Backends store bytes with a TTL and evict the least recently used entries above CACHE_MAX_BYTES (the redis backend
+relies on the `maxmemory` policy of the server). Services take a `Cache`, a namespace of the backend versioned by
+what produced the cached values, e.g. the prompt and the model of an extraction, so a new prompt or model never
+serves the results of the previous one. Values, including pydantic recipes, are serialised with msgpack and
+compressed with zlib above CACHE_COMPRESS_MIN_BYTES. Cache errors are logged and treated as misses.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import socket
+import socketserver
+import sqlite3
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from functools import lru_cache
+from pathlib import Path
+from urllib.parse import urlparse
+
+import msgpack
+from pydantic import BaseModel
+
+from app.settings import get_settings
+from app.services.metrics import metrics_registry
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+CACHE_BACKENDS = ("memory", "sqlite", "redis")
+# Access times of the SQLite backend are only written when older than this, so reads rarely write
+SQLITE_ACCESS_RESOLUTION_SECONDS = 60.0
+# After a failed connection the server is not tried again for this long, so an unreachable cache does not
+# add a connection timeout to every request
+RESP_RETRY_AFTER_SECONDS = 5.0
+
+
+class CacheBackend(ABC):
+    """
+    Storage of a cache: bytes by key, with an optional TTL.
+    """
+    # Whether calls block on I/O, async callers then run them in a thread
+    blocking = True
+
+    @abstractmethod
+    def get(self, key: str) -> bytes | None:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: bytes, ttl_seconds: float = None):
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    def to_dict(self) -> dict:
+        return {"backend": type(self).__name__}
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    LRU cache of the process, bounded by the size of the keys and values.
+    """
+    blocking = False
+
+    def __init__(self, max_bytes: int = None):
+        """
+        :param max_bytes: Size of the cache. Defaults to settings.CACHE_MAX_BYTES.
+        """
+        self.max_bytes = settings.CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def _remove(self, key: str):
+        value, _ = self._entries.pop(key)
+        self._bytes -= len(key) + len(value)
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl_seconds: float = None):
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        expires_at = time.time() + ttl_seconds if ttl_seconds else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, expires_at)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def delete(self, key: str):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def to_dict(self) -> dict:
+        return {"backend": "memory", "entries": len(self._entries), "bytes": self._bytes,
+                "max_bytes": self.max_bytes, "evictions": self.evictions}
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """
+    Cache in a SQLite file shared by the processes of a node. The total size is maintained by triggers,
+    and the least recently used entries are evicted when a write exceeds max_bytes.
+    """
+
+    def __init__(self, db_path: str = None, max_bytes: int = None):
+        """
+        :param db_path: Path to the SQLite database file. Defaults to settings.CACHE_PATH.
+        :param max_bytes: Size of the cache. Defaults to settings.CACHE_MAX_BYTES.
+        """
+        self.db_path = db_path or settings.CACHE_PATH
+        self.max_bytes = settings.CACHE_MAX_BYTES if max_bytes is None else max_bytes
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self.evictions = 0
+        self._connection().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                accessed_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_cache_entries_accessed ON cache_entries (accessed_at);
+            CREATE TABLE IF NOT EXISTS cache_size (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                total_bytes INTEGER NOT NULL
+            );
+            INSERT OR IGNORE INTO cache_size (id, total_bytes) VALUES (0, 0);
+            CREATE TRIGGER IF NOT EXISTS cache_entries_insert AFTER INSERT ON cache_entries
+            BEGIN UPDATE cache_size SET total_bytes = total_bytes + NEW.size WHERE id = 0; END;
+            CREATE TRIGGER IF NOT EXISTS cache_entries_delete AFTER DELETE ON cache_entries
+            BEGIN UPDATE cache_size SET total_bytes = total_bytes - OLD.size WHERE id = 0; END;
+            """
+        )
+
+    def _connection(self) -> sqlite3.Connection:
+        """
+        Connection of the current thread, connections are not shared between threads.
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key: str) -> bytes | None:
+        connection = self._connection()
+        row = connection.execute(
+            "SELECT value, expires_at, accessed_at FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires_at, accessed_at = row
+        now = time.time()
+        if expires_at is not None and expires_at <= now:
+            return None
+        if accessed_at < now - SQLITE_ACCESS_RESOLUTION_SECONDS:
+            connection.execute("UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key))
+        return value
+
+    def set(self, key: str, value: bytes, ttl_seconds: float = None):
+        size = len(key) + len(value)
+        if size > self.max_bytes:
+            return
+        now = time.time()
+        connection = self._connection()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            # Deleted then inserted, REPLACE would not fire the size trigger of the replaced entry
+            connection.execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+            connection.execute(
+                "INSERT INTO cache_entries (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now + ttl_seconds if ttl_seconds else None, now),
+            )
+            total_bytes, = connection.execute("SELECT total_bytes FROM cache_size WHERE id = 0").fetchone()
+            if total_bytes > self.max_bytes:
+                self._evict(connection, total_bytes, now)
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+
+    def _evict(self, connection: sqlite3.Connection, total_bytes: int, now: float):
+        """
+        Delete the expired entries, then the least recently used ones until the cache is at 90% of max_bytes,
+        so evictions are batched over several writes.
+        """
+        evicted = connection.execute(
+            "DELETE FROM cache_entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,)).rowcount
+        target_bytes = int(self.max_bytes * 0.9)
+        total_bytes, = connection.execute("SELECT total_bytes FROM cache_size WHERE id = 0").fetchone()
+        while total_bytes > target_bytes:
+            rows = connection.execute(
+                "SELECT key, size FROM cache_entries ORDER BY accessed_at LIMIT 64").fetchall()
+            if not rows:
+                break
+            keys = []
+            for key, size in rows:
+                keys.append((key,))
+                total_bytes -= size
+                if total_bytes <= target_bytes:
+                    break
+            connection.executemany("DELETE FROM cache_entries WHERE key = ?", keys)
+            evicted += len(keys)
+        self.evictions += evicted
+
+    def delete(self, key: str):
+        self._connection().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+
+    def to_dict(self) -> dict:
+        connection = self._connection()
+        entries, = connection.execute("SELECT COUNT(*) FROM cache_entries").fetchone()
+        total_bytes, = connection.execute("SELECT total_bytes FROM cache_size WHERE id = 0").fetchone()
+        return {"backend": "sqlite", "entries": entries, "bytes": total_bytes, "max_bytes": self.max_bytes,
+                "evictions": self.evictions}
+
+
+def _encode_command(*args) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+def _read_reply(reader):
+    """
+    Read a RESP reply. Error replies are returned as ValueError instances, so a pipeline can be read entirely.
+    """
+    line = reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("Connection closed by the cache server.")
+    prefix, payload = line[:1], line[1:-2]
+    if prefix == b"+":
+        return payload.decode("utf-8")
+    if prefix == b"-":
+        return ValueError(f"Cache server error: {payload.decode('utf-8')}")
+    if prefix == b":":
+        return int(payload)
+    if prefix == b"$":
+        length = int(payload)
+        if length < 0:
+            return None
+        data = reader.read(length + 2)
+        if len(data) != length + 2:
+            raise ConnectionError("Connection closed by the cache server.")
+        return data[:-2]
+    if prefix == b"*":
+        length = int(payload)
+        return None if length < 0 else [_read_reply(reader) for _ in range(length)]
+    raise ConnectionError(f"Invalid reply from the cache server: {line!r}")
+
+
+class RespCacheBackend(CacheBackend):
+    """
+    Client of a server speaking the Redis protocol (RESP), e.g. Redis, Valkey or the stand-in server of this
+    module. Each thread keeps its own connection. Size-bounded eviction is the server's, e.g.
+    `maxmemory 512mb` and `maxmemory-policy allkeys-lru`.
+    """
+
+    def __init__(self, url: str = None, timeout_seconds: float = None):
+        """
+        :param url: URL of the server, redis://[:password@]host[:port][/db]. Defaults to settings.CACHE_URL.
+        :param timeout_seconds: Connection and command timeout. Defaults to settings.CACHE_TIMEOUT_SECONDS.
+        """
+        parsed_url = urlparse(url or settings.CACHE_URL)
+        self.host = parsed_url.hostname or "localhost"
+        self.port = parsed_url.port or 6379
+        self.password = parsed_url.password
+        self.db = int(parsed_url.path.lstrip("/") or 0)
+        self.timeout_seconds = settings.CACHE_TIMEOUT_SECONDS if timeout_seconds is None else timeout_seconds
+        self._local = threading.local()
+        self._unavailable_until = 0.0
+
+    def _connect(self):
+        if time.monotonic() < self._unavailable_until:
+            raise ConnectionError(f"Cache server {self.host}:{self.port} is unavailable.")
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.timeout_seconds)
+        except OSError:
+            self._unavailable_until = time.monotonic() + RESP_RETRY_AFTER_SECONDS
+            raise
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        connection = (sock, sock.makefile("rb"))
+        setup = []
+        if self.password:
+            setup.append(("AUTH", self.password))
+        if self.db:
+            setup.append(("SELECT", self.db))
+        for command in setup:
+            sock.sendall(_encode_command(*command))
+            reply = _read_reply(connection[1])
+            if isinstance(reply, ValueError):
+                sock.close()
+                raise reply
+        return connection
+
+    def _close(self):
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is not None:
+            try:
+                connection[0].close()
+            except OSError:
+                pass
+
+    def execute(self, *args):
+        """
+        Run a command, reconnecting once if the connection of the thread was closed.
+        """
+        for attempt in range(2):
+            connection = getattr(self._local, "connection", None)
+            try:
+                if connection is None:
+                    connection = self._local.connection = self._connect()
+                connection[0].sendall(_encode_command(*args))
+                reply = _read_reply(connection[1])
+                break
+            except (OSError, ConnectionError):
+                self._close()
+                if attempt == 1:
+                    raise
+        if isinstance(reply, ValueError):
+            raise reply
+        return reply
+
+    def get(self, key: str) -> bytes | None:
+        return self.execute("GET", key)
+
+    def set(self, key: str, value: bytes, ttl_seconds: float = None):
+        if ttl_seconds:
+            self.execute("SET", key, value, "PX", max(int(ttl_seconds * 1000), 1))
+        else:
+            self.execute("SET", key, value)
+
+    def delete(self, key: str):
+        self.execute("DEL", key)
+
+    def to_dict(self) -> dict:
+        return {"backend": "redis", "host": self.host, "port": self.port, "db": self.db}
+
+
+def encode_value(value) -> bytes:
+    """
+    Serialise a cached value: a pydantic model or msgpack-compatible data, compressed above
+    settings.CACHE_COMPRESS_MIN_BYTES.
+    """
+    if isinstance(value, BaseModel):
+        value = value.model_dump()
+    payload = msgpack.packb(value, use_bin_type=True, default=str)
+    if len(payload) >= settings.CACHE_COMPRESS_MIN_BYTES:
+        return b"z" + zlib.compress(payload, 1)
+    return b"m" + payload
+
+
+def decode_value(data: bytes, model: type[BaseModel] = None):
+    """
+    Deserialise a cached value, validated as `model` if provided.
+    """
+    marker, payload = data[:1], data[1:]
+    if marker == b"z":
+        payload = zlib.decompress(payload)
+    elif marker != b"m":
+        raise ValueError(f"Unknown cache value format {marker!r}.")
+    value = msgpack.unpackb(payload, raw=False)
+    return model.model_validate(value) if model is not None else value
+
+
+def fingerprint(*parts) -> str:
+    """
+    Short fingerprint of what produces the values of a namespace, e.g. a prompt and a model name.
+    """
+    return hashlib.sha256(json.dumps(parts, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+class Cache:
+    """
+    Namespace of a cache backend. Keys are built from any JSON-serialisable parts, prefixed by the namespace
+    and its version. Backend and deserialisation errors are logged and counted as misses, so the cache never
+    fails a request.
+    """
+
+    def __init__(self, backend: CacheBackend, namespace: str, version: str = "", ttl_seconds: float = None):
+        """
+        :param backend: Storage of the cache.
+        :param namespace: Name of the cached values, e.g. "extraction".
+        :param version: Version of the cached values, e.g. the fingerprint of the prompt and model producing them.
+        :param ttl_seconds: Default TTL of the entries. Defaults to settings.CACHE_DEFAULT_TTL_SECONDS.
+        """
+        self.backend = backend
+        self.namespace = namespace
+        self.version = version
+        self.ttl_seconds = settings.CACHE_DEFAULT_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.stats = {"hits": 0, "misses": 0, "sets": 0, "errors": 0}
+
+    def key(self, key_parts) -> str:
+        digest = hashlib.sha256(json.dumps(key_parts, default=str, sort_keys=True).encode("utf-8")).hexdigest()
+        return f"{self.namespace}:{self.version}:{digest[:32]}"
+
+    def get(self, key_parts, model: type[BaseModel] = None):
+        """
+        :param key_parts: Parts of the key, e.g. (file checksum, recipe name).
+        :param model: Pydantic model of the value, validated on read.
+        :return: The cached value, None on a miss.
+        """
+        try:
+            data = self.backend.get(self.key(key_parts))
+            value = None if data is None else decode_value(data, model)
+        except Exception as e:
+            logger.warning(f"Error reading the {self.namespace} cache: {e}")
+            self.stats["errors"] += 1
+            value = None
+        self.stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    def set(self, key_parts, value, ttl_seconds: float = None):
+        """
+        :param key_parts: Parts of the key, e.g. (file checksum, recipe name).
+        :param value: A pydantic model or msgpack-compatible data.
+        :param ttl_seconds: TTL of the entry. Defaults to the TTL of the namespace.
+        """
+        try:
+            self.backend.set(self.key(key_parts), encode_value(value), ttl_seconds or self.ttl_seconds)
+            self.stats["sets"] += 1
+        except Exception as e:
+            logger.warning(f"Error writing the {self.namespace} cache: {e}")
+            self.stats["errors"] += 1
+
+    async def aget(self, key_parts, model: type[BaseModel] = None):
+        if self.backend.blocking:
+            return await asyncio.to_thread(self.get, key_parts, model)
+        return self.get(key_parts, model)
+
+    async def aset(self, key_parts, value, ttl_seconds: float = None):
+        if self.backend.blocking:
+            await asyncio.to_thread(self.set, key_parts, value, ttl_seconds)
+        else:
+            self.set(key_parts, value, ttl_seconds)
+
+    def to_dict(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {"version": self.version, **self.stats,
+                "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else None}
+
+
+def create_cache_backend(backend: str = None) -> CacheBackend:
+    """
+    :param backend: One of CACHE_BACKENDS. Defaults to settings.CACHE_BACKEND.
+    """
+    backend = backend or settings.CACHE_BACKEND
+    if backend == "memory":
+        return MemoryCacheBackend()
+    if backend == "sqlite":
+        return SQLiteCacheBackend()
+    if backend == "redis":
+        return RespCacheBackend()
+    raise ValueError(f"Unknown cache backend '{backend}'. Available backends: {list(CACHE_BACKENDS)}")
+
+
+@lru_cache
+def get_cache_backend() -> CacheBackend:
+    """
+    Get the process-wide cache backend.
+    """
+    backend = create_cache_backend()
+    metrics_registry.register("cache", backend.to_dict)
+    return backend
+
+
+@lru_cache
+def get_cache(namespace: str, version: str = "", ttl_seconds: float = None) -> Cache:
+    """
+    Get the process-wide cache of a namespace, on the process-wide backend.
+    """
+    cache = Cache(get_cache_backend(), namespace, version, ttl_seconds)
+    metrics_registry.register(f"cache.{namespace}", cache.to_dict)
+    return cache
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    """
+    Stand-in server of the Redis protocol for development and tests, backed by a MemoryCacheBackend.
+    Supports the commands used by RespCacheBackend (GET, SET with EX/PX, DEL), PING, AUTH, SELECT, DBSIZE
+    and FLUSHDB.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: tuple[str, int], max_bytes: int = None):
+        self.backend = MemoryCacheBackend(max_bytes)
+        super().__init__(address, RespRequestHandler)
+
+
+class RespRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        backend = self.server.backend
+        while True:
+            try:
+                command = _read_reply(self.rfile)
+            except (ConnectionError, OSError, ValueError):
+                return
+            if not isinstance(command, list) or not command:
+                self.wfile.write(b"-ERR invalid command\r\n")
+                continue
+            name, args = command[0].upper(), command[1:]
+            if name == b"GET" and len(args) == 1:
+                value = backend.get(args[0].decode("utf-8"))
+                reply = b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+            elif name == b"SET" and len(args) in (2, 4):
+                ttl_seconds = None
+                if len(args) == 4:
+                    unit = args[2].upper()
+                    ttl_seconds = int(args[3]) / (1000 if unit == b"PX" else 1)
+                backend.set(args[0].decode("utf-8"), args[1], ttl_seconds)
+                reply = b"+OK\r\n"
+            elif name == b"DEL":
+                deleted = 0
+                for key in args:
+                    deleted += backend.get(key.decode("utf-8")) is not None
+                    backend.delete(key.decode("utf-8"))
+                reply = b":%d\r\n" % deleted
+            elif name == b"PING":
+                reply = b"+PONG\r\n"
+            elif name in (b"AUTH", b"SELECT"):
+                reply = b"+OK\r\n"
+            elif name == b"DBSIZE":
+                reply = b":%d\r\n" % len(backend)
+            elif name == b"FLUSHDB":
+                backend.clear()
+                reply = b"+OK\r\n"
+            else:
+                reply = b"-ERR unknown command '%s'\r\n" % name
+            self.wfile.write(reply)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Cache statistics, or a stand-in Redis protocol server.")
+    parser.add_argument("--serve", action="store_true", help="Run a stand-in Redis protocol server.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6379)
+    parser.add_argument("--max-bytes", type=int, help="Size of the stand-in server. Defaults to CACHE_MAX_BYTES.")
+    args = parser.parse_args()
+
+    if args.serve:
+        with RespServer((args.host, args.port), args.max_bytes) as server:
+            print(f"Serving the Redis protocol on {args.host}:{server.server_address[1]}")
+            server.serve_forever()
+    else:
+        print(json.dumps(get_cache_backend().to_dict()))
@@ -1,19 +1,32 @@
 import yaml
 import json
 import logging
-from opik import track
 from app.services.agent_service.agent import Agent, SuperAgent
+from app.services.agent_service.pre_validator import DeterministicValidator
+from app.services.cache import Cache
+from app.services.citation_graph import get_citation_graph_store
 from app.settings import get_settings
-from app.services.recipe import PdfInformationRecipe
-from app.services.agent_service.agent_tools import UrlFetchFirebaseDBPythonExamplesTool
+from app.services.recipe import PdfIndexRecipe
+from app.services.session_store import ChatSession
+from app.services.tracing import trace
+from app.services.agent_service.agent_tools import (
+    CitationGraphTool,
+    CorpusStatsTool,
+    PaperDigestTool,
+    TableStatsTool,
+    UrlFetchFirebaseDBPythonExamplesTool,
+)
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
 
 class ChatbotService:
-    def __init__(self):
-
+    def __init__(self, cache: Cache = None):
+        """
+        :param cache: Cache of the tools fetching external content. Defaults to the process-wide caches of the tools.
+        """
+        self.cache = cache
         self.agent = None
 
     def load_prompt_from_file(self, file_path: str) -> dict:
@@ -30,7 +43,7 @@ class ChatbotService:
         except Exception as e:
             raise ValueError(f"Error loading prompt from file: {e}")
 
-    def load_agents(self, db_schema: PdfInformationRecipe = None):
+    def load_agents(self, db_schema: type[PdfIndexRecipe] = PdfIndexRecipe):
 
         db_prompt = self.load_prompt_from_file(settings.DB_AGENT_PROMPT_FILE_PATH)
         try:
@@ -38,20 +51,29 @@ class ChatbotService:
                 db_prompt["firestore_db_schema"] = json.dumps(db_schema.model_json_schema())
         except Exception as e:
             logger.info(f"Error loading firestore db schema: {e}")
+        tools = {
+            "fetch_firebase_db_python_examples": UrlFetchFirebaseDBPythonExamplesTool(cache=self.cache),
+            "corpus_stats": CorpusStatsTool(),
+            "paper_digests": PaperDigestTool(),
+            "table_stats": TableStatsTool(),
+        }
+        # Citations are only known once references are extracted (content_data recipe), an empty graph is not offered
+        if settings.CITATION_GRAPH_ENABLED and get_citation_graph_store().is_populated():
+            tools["citation_graph"] = CitationGraphTool()
         self.db_agent = Agent(
             name="db_agent",
             description="An agent that can make complicated queries to look for papers in the database and retrieve research papers and their relevant information.",
             model_name=settings.DB_AGENT_MODEL,  # Replace with actual model name
             prompt=db_prompt,  # Load prompt from file
-            tools={
-                "fetch_firebase_db_python_examples": UrlFetchFirebaseDBPythonExamplesTool()
-            }
+            tools=tools,
+            step_type="code_generation",
         )
         self.information_validation_agent = Agent(
             name="information_and_response_validation_agent",
             description="An agent to validate if information is correct and to validate the response generated by the chatbot.",
             model_name=settings.INFORMATION_VALIDATION_AGENT_MODEL,
             prompt=self.load_prompt_from_file(settings.INFORMATION_VALIDATION_AGENT_PROMPT_FILE_PATH),
+            step_type="validation",
         )
         self.super_agent = SuperAgent(
             name = "Super Agent",
@@ -61,21 +83,41 @@ class ChatbotService:
             agents = {
                 "db_agent": self.db_agent,
                 "information_and_response_validation_agent": self.information_validation_agent
-            }
+            },
+            step_type="routing",
+            # Mechanical checks of the retrieved information run locally, the validation agent only when they cannot decide
+            pre_validators={
+                "information_and_response_validation_agent": DeterministicValidator()
+            },
         )
 
 
-    @track("chatbot_service.get_response")
-    def get_response(self, query: str, db_service=None):
+    @trace("chatbot_service.get_response")
+    def get_response(self, query: str, db_service=None, session: ChatSession = None,
+                     shared_documents: ChatSession = None):
         """
         Get a response from the chatbot for a given message.
+
+        :param query: The user query.
+        :param db_service: The database service.
+        :param session: Chat session of a multi-turn conversation. Its history is given to the agents
+                        and the turn is recorded in it.
+        :param shared_documents: Document cache shared by the queries of a batch, its documents are listed
+                                 to the db_agent. Its history is not used.
         """
         if not query:
             raise ValueError("Query cannot be empty.")
 
         try:
-            self.load_agents(PdfInformationRecipe)
+            self.load_agents(PdfIndexRecipe)
+            if session is not None:
+                self.super_agent.context += session.history_message()
+                self.db_agent.context += session.history_message() + session.documents_message()
+            elif shared_documents is not None:
+                self.db_agent.context += shared_documents.documents_message()
             response = self.super_agent.execute(query)
+            if session is not None:
+                session.add_turn(query, response)
             return response
         except Exception as e:
             logger.error(f"Error executing super agent: {e}")
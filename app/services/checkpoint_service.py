@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import uuid
+from pathlib import Path
+from pydantic import BaseModel
+
+from app.settings import get_settings
+from app.services.blob_store import BlobStore
+from app.services.recipe import PdfInformationRecipe
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Job identifiers are generated as uuid4 hex strings. A client resuming a job sends its identifier back, so it is
+# only accepted as a hex string or a UUID, never as a path
+JOB_ID_PATTERN = re.compile(r"[0-9a-f]{8,64}|[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", re.IGNORECASE)
+
+
+def is_valid_job_id(job_id: str) -> bool:
+    """
+    Check that a job identifier is a hex string or a UUID, so it can be used in paths and blob references.
+    """
+    return isinstance(job_id, str) and JOB_ID_PATTERN.fullmatch(job_id) is not None
+
+
+class FailedFile(BaseModel):
+    file: str
+    error: str
+    attempts: int
+
+
+class IngestionReport(BaseModel):
+    job_id: str
+    documents: list[PdfInformationRecipe]
+    failed_files: list[FailedFile]
+
+
+class IngestionCheckpointStore:
+    """
+    Local checkpoints of an ingestion job.
+    Every successfully extracted document is written to disk as soon as it is available, keyed by
+    the checksum of the PDF content, so an interrupted or partially failed job can be resumed
+    without calling the model again for the files that are already extracted.
+
+    Layout:
+        <CHECKPOINT_DIR>/<job_id>/manifest.json          status of every file of the job
+        <CHECKPOINT_DIR>/<job_id>/documents/<sha256>.json extracted documents
+    """
+
+    def __init__(self, job_id: str = None, root_dir: str = None):
+        """
+        :param job_id: Identifier of the job to resume, a new job is created if not provided.
+        :param root_dir: Directory of the checkpoints. Defaults to settings.CHECKPOINT_DIR.
+        """
+        if job_id and not is_valid_job_id(job_id):
+            raise ValueError(f"Invalid job id '{job_id}', expected a hex string or a UUID.")
+        self.job_id = job_id or uuid.uuid4().hex
+        self.job_dir = Path(root_dir or settings.CHECKPOINT_DIR) / self.job_id
+        self.documents_dir = self.job_dir / "documents"
+        self.documents_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.job_dir / "manifest.json"
+        self._lock = threading.Lock()
+        self._manifest = self._load_manifest()
+
+    def _load_manifest(self) -> dict:
+        if self.manifest_path.exists():
+            with open(self.manifest_path, 'r') as file:
+                return json.load(file)
+        return {"job_id": self.job_id, "files": {}}
+
+    def _save_manifest(self):
+        self._atomic_write(self.manifest_path, json.dumps(self._manifest, indent=2))
+
+    @staticmethod
+    def _atomic_write(path: Path, content: str):
+        """
+        Write to a temporary file and rename it, so a crash never leaves a partially written checkpoint.
+        """
+        temp_path = path.with_suffix(path.suffix + ".tmp")
+        with open(temp_path, 'w') as file:
+            file.write(content)
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def checksum(file_path: Path) -> str:
+        """
+        Compute the sha256 checksum of a file. Files of the blob store are named by their checksum.
+        """
+        blob_hash = BlobStore.hash_of(file_path)
+        if blob_hash is not None:
+            return blob_hash
+        sha256 = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            for block in iter(lambda: file.read(1024 * 1024), b""):
+                sha256.update(block)
+        return sha256.hexdigest()
+
+    def load_document(self, file_path: Path) -> PdfInformationRecipe | None:
+        """
+        Load the checkpointed document of a file.
+
+        :param file_path: Path of the PDF file.
+        :return PdfInformationRecipe: The extracted document, None if the file has no checkpoint.
+        """
+        document_path = self.documents_dir / f"{self.checksum(file_path)}.json"
+        if not document_path.exists():
+            return None
+        try:
+            with open(document_path, 'r') as file:
+                return PdfInformationRecipe.model_validate_json(file.read())
+        except Exception as e:
+            logger.error(f"Ignoring invalid checkpoint {document_path}: {e}")
+            return None
+
+    def save_document(self, file_path: Path, document: PdfInformationRecipe, attempts: int):
+        """
+        Checkpoint an extracted document.
+
+        :param file_path: Path of the PDF file.
+        :param document: The extracted document.
+        :param attempts: Number of extraction attempts.
+        """
+        checksum = self.checksum(file_path)
+        with self._lock:
+            self._atomic_write(self.documents_dir / f"{checksum}.json", document.model_dump_json())
+            self._manifest["files"][str(file_path)] = {
+                "checksum": checksum, "status": "done", "attempts": attempts, "error": None,
+            }
+            self._save_manifest()
+
+    def record_failure(self, file_path: Path, error: str, attempts: int):
+        """
+        Record a file whose extraction failed after all attempts.
+
+        :param file_path: Path of the PDF file.
+        :param error: The last error message.
+        :param attempts: Number of extraction attempts.
+        """
+        with self._lock:
+            self._manifest["files"][str(file_path)] = {
+                "checksum": None, "status": "failed", "attempts": attempts, "error": error,
+            }
+            self._save_manifest()
@@ -0,0 +1,528 @@
+"""
+Citation graph of the corpus, built at ingest time from the extracted references.
+
+Nodes are works: the papers of the corpus and the works they cite, identified by their normalised title.
+Reference titles extracted by the model vary (case, punctuation, accents, small typos), so a title that does not
+match a known work exactly is matched to the most similar known title above settings.CITATION_MATCH_THRESHOLD.
+
+Edges are stored as compressed sparse rows: an offsets array and a targets array of int32 node ids, in both
+directions (references of a paper, papers citing a work). Papers ingested since the last compaction are kept in
+small per-node overrides, merged into the rows when there are more than settings.CITATION_GRAPH_COMPACT_RECORDS.
+
+The graph is shared by the processes through two files:
+
+    <CITATION_GRAPH_PATH>       compacted graph, replaced atomically
+    <CITATION_GRAPH_PATH>.log   JSON lines of the papers ingested since, appended under an exclusive file lock
+
+Every process loads the graph and applies the new lines of the log before answering a lookup.
+"""
+import array
+import difflib
+import fcntl
+import json
+import logging
+import os
+import re
+import struct
+import threading
+import unicodedata
+from functools import lru_cache
+from pathlib import Path
+
+from app.settings import get_settings
+from app.services.metrics import metrics_registry
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+GRAPH_MAGIC = b"SCBCIT01"
+GRAPH_FORMAT_VERSION = 1
+# Tokens used to find the candidates of a fuzzy match, the rarest ones are the most selective
+FUZZY_CANDIDATE_TOKENS = 2
+FUZZY_MAX_CANDIDATES = 200
+NON_ALPHANUMERIC_PATTERN = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_title(title: str | None) -> str:
+    """
+    Normalise a title for matching: accents removed, case folded, punctuation and whitespace collapsed.
+    """
+    if not title:
+        return ""
+    text = unicodedata.normalize("NFKD", title)
+    text = "".join(character for character in text if not unicodedata.combining(character)).casefold()
+    return NON_ALPHANUMERIC_PATTERN.sub(" ", text).strip()
+
+
+def _document_references(document) -> tuple[str, list[str] | None]:
+    """
+    :return tuple: Title of a document and titles of its references, None if the references of the document were
+                   not extracted (content_data recipe disabled). Accepts PdfInformationRecipe, dicts and the lazy
+                   documents of the database service.
+    """
+    if isinstance(document, dict):
+        if "content_data" in document:
+            content_data = document["content_data"]
+            references = None if content_data is None else content_data.get("references") or []
+        else:
+            references = document.get("references")
+        title = document.get("title")
+    elif hasattr(document, "load_part"):
+        # Only the references part of a lazy document is read, if the document was extracted with its recipe
+        references = (document.references or []) if "content_data" in document.recipe_versions else None
+        title = document.title
+    else:
+        references = document.content_data.references if document.content_data else None
+        title = document.title
+    if references is None:
+        return title, None
+    return title, [reference["title"] if isinstance(reference, dict) else reference.title
+                   for reference in references]
+
+
+class CitationGraph:
+    """
+    In-memory citation graph. Lookups are dictionary accesses and array slices.
+    Not thread-safe, the CitationGraphStore serialises the updates and the lookups.
+    """
+
+    def __init__(self, match_threshold: float = None):
+        self.match_threshold = settings.CITATION_MATCH_THRESHOLD if match_threshold is None else match_threshold
+        self.titles = []
+        self.keys = []
+        self.in_corpus = bytearray()
+        # Node of every normalised title, fuzzy matched titles included
+        self.key_index = {}
+        self.token_index = {}
+        # Compressed sparse rows of the nodes that existed at the last compaction
+        self._out_offsets = array.array("q", [0])
+        self._out_targets = array.array("i")
+        self._in_offsets = array.array("q", [0])
+        self._in_targets = array.array("i")
+        # Rows changed since the last compaction
+        self._out_overrides = {}
+        self._in_overrides = {}
+
+    @property
+    def node_count(self) -> int:
+        return len(self.titles)
+
+    @property
+    def paper_count(self) -> int:
+        """
+        Number of papers of the corpus in the graph, the papers whose references were extracted.
+        """
+        return self.in_corpus.count(1)
+
+    @property
+    def edge_count(self) -> int:
+        base_rows = len(self._out_offsets) - 1
+        overridden = sum(self._out_offsets[node + 1] - self._out_offsets[node]
+                         for node in self._out_overrides if node < base_rows)
+        return len(self._out_targets) - overridden + sum(map(len, self._out_overrides.values()))
+
+    def _add_node(self, title: str, key: str) -> int:
+        node = len(self.titles)
+        self.titles.append(title)
+        self.keys.append(key)
+        self.in_corpus.append(0)
+        self.key_index[key] = node
+        for token in set(key.split()):
+            self.token_index.setdefault(token, []).append(node)
+        return node
+
+    def _fuzzy_match(self, key: str) -> int | None:
+        tokens = [token for token in set(key.split()) if token in self.token_index]
+        if not tokens:
+            return None
+        tokens.sort(key=lambda token: len(self.token_index[token]))
+        candidates = set()
+        for token in tokens[:FUZZY_CANDIDATE_TOKENS]:
+            candidates.update(self.token_index[token][:FUZZY_MAX_CANDIDATES])
+        best_node, best_score = None, self.match_threshold
+        matcher = difflib.SequenceMatcher(autojunk=False)
+        matcher.set_seq2(key)
+        for node in candidates:
+            matcher.set_seq1(self.keys[node])
+            if matcher.real_quick_ratio() < best_score or matcher.quick_ratio() < best_score:
+                continue
+            score = matcher.ratio()
+            if score >= best_score:
+                best_node, best_score = node, score
+        return best_node
+
+    def resolve(self, title: str, create: bool = False) -> int | None:
+        """
+        Find the node of a title, exactly or by fuzzy matching.
+
+        :param title: Title of a work.
+        :param create: Add a node if the title matches no known work.
+        :return int: Node of the work, None if it is unknown and not created.
+        """
+        key = normalize_title(title)
+        if not key:
+            return None
+        node = self.key_index.get(key)
+        if node is None:
+            node = self._fuzzy_match(key)
+            if node is not None:
+                self.key_index[key] = node
+            elif create:
+                node = self._add_node(title.strip(), key)
+        return node
+
+    @staticmethod
+    def _row(offsets: array.array, targets: array.array, overrides: dict, node: int):
+        if node in overrides:
+            return overrides[node]
+        if node + 1 >= len(offsets):
+            return ()
+        return targets[offsets[node]:offsets[node + 1]]
+
+    def references_of(self, node: int):
+        return self._row(self._out_offsets, self._out_targets, self._out_overrides, node)
+
+    def cited_by_nodes(self, node: int):
+        return self._row(self._in_offsets, self._in_targets, self._in_overrides, node)
+
+    def add_paper(self, title: str, reference_titles: list[str]):
+        """
+        Add a paper of the corpus with its references, replacing the references of a paper ingested again.
+        """
+        paper = self.resolve(title, create=True)
+        if paper is None:
+            return
+        self.in_corpus[paper] = 1
+        targets = []
+        for reference_title in reference_titles:
+            target = self.resolve(reference_title, create=True)
+            if target is not None and target != paper and target not in targets:
+                targets.append(target)
+
+        previous = set(self.references_of(paper))
+        self._out_overrides[paper] = array.array("i", targets)
+        for target in previous.symmetric_difference(targets):
+            citing = self._in_overrides.get(target)
+            if citing is None:
+                citing = self._in_overrides[target] = array.array("i", self.cited_by_nodes(target))
+            if target in previous:
+                citing.remove(paper)
+            else:
+                citing.append(paper)
+
+    @property
+    def pending_rows(self) -> int:
+        return len(self._out_overrides)
+
+    def compact(self):
+        """
+        Merge the changed rows into the compressed sparse rows.
+        """
+        out_offsets = array.array("q", [0])
+        out_targets = array.array("i")
+        in_degrees = [0] * self.node_count
+        for node in range(self.node_count):
+            row = self.references_of(node)
+            out_targets.extend(row)
+            out_offsets.append(len(out_targets))
+            for target in row:
+                in_degrees[target] += 1
+        self._out_offsets, self._out_targets = out_offsets, out_targets
+        self._build_in_rows(in_degrees)
+        self._out_overrides = {}
+        self._in_overrides = {}
+
+    def _build_in_rows(self, in_degrees: list[int]):
+        in_offsets = array.array("q", [0])
+        for degree in in_degrees:
+            in_offsets.append(in_offsets[-1] + degree)
+        in_targets = array.array("i", bytes(4 * in_offsets[-1]))
+        positions = list(in_offsets[:-1])
+        for node in range(self.node_count):
+            for target in self._out_targets[self._out_offsets[node]:self._out_offsets[node + 1]]:
+                in_targets[positions[target]] = node
+                positions[target] += 1
+        self._in_offsets, self._in_targets = in_offsets, in_targets
+
+    def to_bytes(self) -> bytes:
+        """
+        Serialise the compacted graph: magic, header length (uint64), JSON header, then the buffers.
+        """
+        self.compact()
+        title_data = "\n".join(title.replace("\n", " ") for title in self.titles).encode("utf-8")
+        aliases = {key: node for key, node in self.key_index.items() if self.keys[node] != key}
+        buffers = [title_data, bytes(self.in_corpus), self._out_offsets.tobytes(), self._out_targets.tobytes()]
+        header = json.dumps({
+            "version": GRAPH_FORMAT_VERSION,
+            "node_count": self.node_count,
+            "buffer_lengths": [len(buffer) for buffer in buffers],
+            "aliases": aliases,
+        }).encode("utf-8")
+        return b"".join([GRAPH_MAGIC, struct.pack("<Q", len(header)), header, *buffers])
+
+    @classmethod
+    def from_bytes(cls, data: bytes, match_threshold: float = None) -> "CitationGraph":
+        if data[:len(GRAPH_MAGIC)] != GRAPH_MAGIC:
+            raise ValueError("Not a citation graph file.")
+        header_length, = struct.unpack_from("<Q", data, len(GRAPH_MAGIC))
+        position = len(GRAPH_MAGIC) + 8
+        header = json.loads(data[position:position + header_length])
+        if header["version"] != GRAPH_FORMAT_VERSION:
+            raise ValueError(f"Unsupported citation graph version {header['version']}.")
+        position += header_length
+        buffers = []
+        for length in header["buffer_lengths"]:
+            buffers.append(data[position:position + length])
+            position += length
+        title_data, in_corpus, out_offsets, out_targets = buffers
+
+        graph = cls(match_threshold)
+        for title in (title_data.decode("utf-8").split("\n") if header["node_count"] else []):
+            graph._add_node(title, normalize_title(title))
+        graph.in_corpus = bytearray(in_corpus)
+        graph.key_index.update(header["aliases"])
+        graph._out_offsets = array.array("q")
+        graph._out_offsets.frombytes(out_offsets)
+        graph._out_targets = array.array("i")
+        graph._out_targets.frombytes(out_targets)
+        in_degrees = [0] * graph.node_count
+        for target in graph._out_targets:
+            in_degrees[target] += 1
+        graph._build_in_rows(in_degrees)
+        return graph
+
+    def _work(self, node: int) -> dict:
+        return {"title": self.titles[node], "in_corpus": bool(self.in_corpus[node])}
+
+    def lookup(self, operation: str, title: str = None, limit: int = 20) -> dict:
+        """
+        Answer a citation question.
+
+        :param operation: `cited_by`: papers of the corpus citing a work,
+                          `references`: works cited by a paper of the corpus,
+                          `shared_references`: papers of the corpus sharing references with a paper, most shared first,
+                          `most_cited`: most cited works.
+        :param title: Title of the work or paper, not needed by `most_cited`.
+        :param limit: Maximum number of works returned.
+        :return dict: The matched work and the resulting works, with the number of papers of the corpus whose
+                      references are in the graph: citations of the other papers are unknown.
+        """
+        if operation not in ("cited_by", "references", "shared_references", "most_cited"):
+            raise ValueError(f"Unknown operation '{operation}', use cited_by, references, shared_references or most_cited.")
+        paper_count = self.paper_count
+        if not paper_count:
+            return {"populated": False, "papers_with_references": 0,
+                    "message": "The citation graph is empty: the references of the papers were not extracted, "
+                               "so the citations of the corpus are unknown."}
+        if operation == "most_cited":
+            ranked = sorted(((len(self.cited_by_nodes(node)), node) for node in range(self.node_count)), reverse=True)
+            return {"papers_with_references": paper_count,
+                    "works": [{**self._work(node), "cited_by": count} for count, node in ranked[:limit] if count]}
+        node = self.resolve(title)
+        if node is None:
+            return {"papers_with_references": paper_count, "matched": None, "works": []}
+        result = {"papers_with_references": paper_count, "matched": self._work(node)}
+        if operation == "cited_by":
+            citing = self.cited_by_nodes(node)
+            result["count"] = len(citing)
+            result["works"] = [self._work(paper) for paper in citing[:limit]]
+        elif operation == "references":
+            references = self.references_of(node)
+            result["count"] = len(references)
+            result["works"] = [self._work(work) for work in references[:limit]]
+        else:
+            shared = {}
+            for work in self.references_of(node):
+                for paper in self.cited_by_nodes(work):
+                    if paper != node:
+                        shared[paper] = shared.get(paper, 0) + 1
+            ranked = sorted(shared.items(), key=lambda item: -item[1])
+            result["count"] = len(ranked)
+            result["works"] = [{**self._work(paper), "shared_references": count} for paper, count in ranked[:limit]]
+        return result
+
+
+class CitationGraphStore:
+    """
+    Process-side handle of the citation graph files shared by the API and the worker processes.
+    """
+
+    def __init__(self, path: Path = None, compact_records: int = None):
+        """
+        :param path: Path of the compacted graph. Defaults to settings.CITATION_GRAPH_PATH.
+        :param compact_records: Log lines merged into the compacted graph. Defaults to settings.CITATION_GRAPH_COMPACT_RECORDS.
+        """
+        self.path = Path(path or settings.CITATION_GRAPH_PATH)
+        self.log_path = self.path.with_name(f"{self.path.name}.log")
+        self.lock_path = self.path.with_name(f"{self.path.name}.lock")
+        self.compact_records = compact_records or settings.CITATION_GRAPH_COMPACT_RECORDS
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._graph = CitationGraph()
+        self._file_id = None
+        self._log_offset = 0
+        self._log_records = 0
+
+    @staticmethod
+    def _stat(path: Path):
+        try:
+            stat = os.stat(path)
+            return stat.st_ino, stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def _sync_locked(self):
+        """
+        Load the compacted graph if it was replaced, and apply the new lines of the log. Requires the file lock.
+        """
+        file_id = self._stat(self.path)
+        if file_id != self._file_id:
+            self._graph = CitationGraph.from_bytes(self.path.read_bytes()) if file_id else CitationGraph()
+            self._file_id = file_id
+            self._log_offset = 0
+            self._log_records = 0
+        log_stat = self._stat(self.log_path)
+        if log_stat is None or log_stat[2] == self._log_offset:
+            return
+        if log_stat[2] < self._log_offset:
+            # The log was truncated by a rebuild without replacing the graph
+            self._graph = CitationGraph.from_bytes(self.path.read_bytes()) if file_id else CitationGraph()
+            self._log_offset = 0
+            self._log_records = 0
+        with open(self.log_path, "rb") as log_file:
+            log_file.seek(self._log_offset)
+            for line in log_file:
+                if not line.endswith(b"\n"):
+                    break
+                record = json.loads(line)
+                self._graph.add_paper(record["title"], record["references"])
+                self._log_offset += len(line)
+                self._log_records += 1
+
+    def _with_file_lock(self, exclusive: bool, function):
+        with self._lock, open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                return function()
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _write_locked(self):
+        temporary_path = self.path.with_name(f"{self.path.name}.{os.getpid()}.tmp")
+        temporary_path.write_bytes(self._graph.to_bytes())
+        os.replace(temporary_path, self.path)
+        open(self.log_path, "wb").close()
+        self._file_id = self._stat(self.path)
+        self._log_offset = 0
+        self._log_records = 0
+
+    def current(self) -> CitationGraph:
+        """
+        :return CitationGraph: The graph, with the papers ingested by every process so far.
+        """
+        with self._lock:
+            log_stat = self._stat(self.log_path)
+            if self._stat(self.path) == self._file_id and (log_stat is None or log_stat[2] == self._log_offset):
+                return self._graph
+            self._with_file_lock(False, self._sync_locked)
+            return self._graph
+
+    def lookup(self, operation: str, title: str = None, limit: int = 20) -> dict:
+        with self._lock:
+            return self.current().lookup(operation, title, limit)
+
+    def is_populated(self) -> bool:
+        """
+        :return bool: True if the graph has papers, i.e. references were extracted for some of the stored papers.
+        """
+        with self._lock:
+            return self.current().paper_count > 0
+
+    def add_papers(self, documents: list):
+        """
+        Add ingested papers to the graph. Errors are logged, the documents are stored anyway.
+        Papers whose references were not extracted are not added: they would be papers citing nothing.
+
+        :param documents: PdfInformationRecipe or dicts of the ingested papers.
+        """
+        if not settings.CITATION_GRAPH_ENABLED or not documents:
+            return
+        try:
+            records = [{"title": title, "references": references}
+                       for title, references in map(_document_references, documents)
+                       if title and references is not None]
+            if not records:
+                return
+
+            def append():
+                self._sync_locked()
+                with open(self.log_path, "ab") as log_file:
+                    log_file.write(b"".join(json.dumps(record, ensure_ascii=False).encode("utf-8") + b"\n"
+                                            for record in records))
+                self._sync_locked()
+                if self._log_records >= self.compact_records:
+                    self._write_locked()
+
+            self._with_file_lock(True, append)
+        except Exception as e:
+            logger.error(f"Error adding {len(documents)} paper(s) to the citation graph: {e}")
+
+    def rebuild(self, db_service) -> int:
+        """
+        Rebuild the graph from the references of every document of the database, e.g. to backfill a corpus
+        ingested before the graph existed. Documents whose references were not extracted are left out.
+
+        :return int: Number of papers with references.
+        """
+        def build():
+            graph = CitationGraph()
+            count = 0
+            for document in db_service.get_documents():
+                title, references = _document_references(document)
+                if title and references is not None:
+                    graph.add_paper(title, references)
+                    count += 1
+            self._graph = graph
+            self._write_locked()
+            return count
+
+        count = self._with_file_lock(True, build)
+        logger.info(f"Citation graph of {count} papers rebuilt.")
+        return count
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            graph = self._graph
+            return {"works": graph.node_count, "papers": graph.paper_count, "citations": graph.edge_count,
+                    "pending_log_records": self._log_records}
+
+
+@lru_cache
+def get_citation_graph_store() -> CitationGraphStore:
+    """
+    Get the process-wide citation graph store.
+    """
+    store = CitationGraphStore()
+    metrics_registry.register("citation_graph", store.to_dict)
+    return store
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build or query the citation graph.")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild the graph from the database.")
+    parser.add_argument("--operation", choices=["cited_by", "references", "shared_references", "most_cited"])
+    parser.add_argument("--title", help="Title of the work or paper.")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    store = get_citation_graph_store()
+    if args.rebuild:
+        from app.services.service_factory import get_database_service
+
+        store.rebuild(get_database_service())
+    if args.operation:
+        print(json.dumps(store.lookup(args.operation, args.title, args.limit), indent=2, ensure_ascii=False))
+    else:
+        print(json.dumps(store.to_dict()))
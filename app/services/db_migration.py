@@ -0,0 +1,42 @@
+import argparse
+import logging
+
+from app.services.db_service import DatabaseService, SPLIT_STORAGE_LAYOUT
+
+logger = logging.getLogger(__name__)
+
+
+def migrate_to_split_layout(db_service: DatabaseService, dry_run: bool = False) -> dict:
+    """
+    Migrate all documents stored in the legacy single-document layout to the split layout
+    (index document + chunked sub-collections). Already migrated documents are skipped,
+    so the migration can be re-run safely after an interruption.
+
+    :param db_service: Database service of the collection to migrate.
+    :param dry_run: Only count the documents to migrate, without writing.
+    :return dict: Number of migrated, skipped and failed documents.
+    """
+    summary = {"migrated": 0, "skipped": 0, "failed": 0}
+    for snapshot in db_service.db.collection(db_service.collection_name).stream():
+        if snapshot.to_dict().get("storage_layout") == SPLIT_STORAGE_LAYOUT:
+            summary["skipped"] += 1
+            continue
+        if dry_run:
+            summary["migrated"] += 1
+            continue
+        try:
+            db_service.migrate_document(snapshot)
+            summary["migrated"] += 1
+            logger.info(f"Migrated document: {snapshot.id}")
+        except Exception as e:
+            summary["failed"] += 1
+            logger.error(f"Error migrating document {snapshot.id}: {e}")
+    return summary
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(name)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="Migrate Firestore documents to the split storage layout.")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the documents to migrate.")
+    args = parser.parse_args()
+    print(migrate_to_split_layout(DatabaseService(), dry_run=args.dry_run))
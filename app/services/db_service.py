@@ -1,8 +1,12 @@
+import json
 import logging
 import firebase_admin
 from firebase_admin import credentials, firestore
 
 from app.settings import get_settings
+from app.services.session_store import ALL_DOCUMENTS_KEY, get_active_session
+from app.services.single_flight import get_single_flight
+from app.services.tracing import trace
 from app.services.recipe import (
     PdfInformationRecipe,
 )
@@ -10,36 +14,464 @@ from app.services.recipe import (
 settings = get_settings()
 logger = logging.getLogger(__name__)
 
+# Heavy parts of a document are stored in sub-collections of the index document.
+# Maps sub-collection name -> (recipe field, nested field) in PdfInformationRecipe.
+DOCUMENT_PARTS = {
+    "sections": ("content_data", "sections"),
+    "references": ("content_data", "references"),
+    "tables": ("tables_and_figures", "tables"),
+    "figures": ("tables_and_figures", "figures"),
+}
+INDEX_FIELDS = ("title", "authors", "publication_date", "abstract", "digest")
+# Key of the fragments of an item larger than a chunk, whose longest text field is split across chunks
+ITEM_FRAGMENT_KEY = "_fragment"
+SPLIT_STORAGE_LAYOUT = "split_v1"
+
+
+def stored_recipe_versions(index_data: dict) -> dict[str, int]:
+    """
+    Versions of the recipes a stored document was extracted with, by recipe name.
+    Documents stored before the recipes were versioned are assumed to be extracted with version 1
+    of the recipes whose parts they have.
+    """
+    versions = index_data.get("recipe_versions")
+    if versions is not None:
+        return versions
+    versions = {"metadata": 1}
+    part_counts = index_data.get("part_counts") or {}
+    for part, (recipe_field, nested_field) in DOCUMENT_PARTS.items():
+        if part_counts.get(part) or (index_data.get(recipe_field) or {}).get(nested_field):
+            versions[recipe_field] = 1
+    return versions
+
+
+class LazyPdfDocument:
+    """
+    Read-only proxy over a stored document.
+    Index fields are available immediately, heavy parts (sections, references, tables, figures)
+    are fetched from their sub-collections on first access and cached on the proxy.
+    Documents stored in the legacy single-document layout are served from the index document.
+    """
+    def __init__(self, doc_ref, index_data: dict):
+        """
+        :param doc_ref: Firestore reference of the index document.
+        :param index_data: Data of the index document.
+        """
+        self._doc_ref = doc_ref
+        self._index_data = index_data
+        self._loaded_parts = {}
+        self._size = None
+
+    def __repr__(self):
+        return f"LazyPdfDocument(title={self.title}, loaded_parts={list(self._loaded_parts)})"
+
+    @property
+    def title(self) -> str:
+        return self._index_data.get("title")
+
+    @property
+    def authors(self) -> list[str]:
+        return self._index_data.get("authors", [])
+
+    @property
+    def publication_date(self) -> str:
+        return self._index_data.get("publication_date")
+
+    @property
+    def abstract(self) -> str:
+        return self._index_data.get("abstract")
+
+    @property
+    def digest(self) -> dict | None:
+        return self._index_data.get("digest")
+
+    @property
+    def digest_fingerprint(self) -> str | None:
+        return self._index_data.get("digest_fingerprint")
+
+    @property
+    def source_hash(self) -> str | None:
+        return self._index_data.get("source_hash")
+
+    @property
+    def recipe_versions(self) -> dict[str, int]:
+        return stored_recipe_versions(self._index_data)
+
+    @property
+    def is_split(self) -> bool:
+        return self._index_data.get("storage_layout") == SPLIT_STORAGE_LAYOUT
+
+    @property
+    def sections(self) -> list[dict]:
+        return self.load_part("sections")
+
+    @property
+    def references(self) -> list[dict]:
+        return self.load_part("references")
+
+    @property
+    def tables(self) -> list[dict]:
+        return self.load_part("tables")
+
+    @property
+    def figures(self) -> list[dict]:
+        return self.load_part("figures")
+
+    @property
+    def content_data(self) -> dict:
+        return {"sections": self.sections, "references": self.references}
+
+    @property
+    def tables_and_figures(self) -> dict:
+        return {"tables": self.tables, "figures": self.figures}
+
+    @trace("db_service.load_part", capture_output=False)
+    def load_part(self, part: str) -> list[dict]:
+        """
+        Load a heavy part of the document, fetching it only once.
+
+        :param part: One of DOCUMENT_PARTS.
+        :return list[dict]: Items of the requested part.
+        """
+        if part not in DOCUMENT_PARTS:
+            raise ValueError(f"Unknown document part '{part}'. Available parts: {list(DOCUMENT_PARTS)}")
+        if part in self._loaded_parts:
+            return self._loaded_parts[part]
+
+        if self.is_split:
+            items = []
+            chunk_count = self._index_data.get("part_chunks", {}).get(part, 0)
+            for chunk_index in range(chunk_count):
+                chunk = self._doc_ref.collection(part).document(_chunk_id(chunk_index)).get()
+                if chunk.exists:
+                    items.extend(chunk.to_dict().get("items", []))
+            items = _join_fragments(items)
+        else:
+            recipe_field, nested_field = DOCUMENT_PARTS[part]
+            items = (self._index_data.get(recipe_field) or {}).get(nested_field, [])
+        self._loaded_parts[part] = items
+        return items
+
+    def estimated_size(self) -> int:
+        """
+        Estimated size in bytes of the index data and the loaded parts, recomputed when a part is loaded.
+        """
+        if self._size is None or self._size[0] != len(self._loaded_parts):
+            size = len(json.dumps(self._index_data, ensure_ascii=False, default=str))
+            size += sum(len(json.dumps(items, ensure_ascii=False, default=str)) for items in self._loaded_parts.values())
+            self._size = (len(self._loaded_parts), size)
+        return self._size[1]
+
+    def to_dict(self, parts: list[str] = None) -> dict:
+        """
+        Convert the document to a dictionary with the PdfInformationRecipe structure.
+
+        :param parts: Heavy parts to include. Only index fields are returned if not provided.
+        :return dict: Document data.
+        """
+        data = {field: self._index_data.get(field) for field in INDEX_FIELDS}
+        data["part_counts"] = self._index_data.get("part_counts", {})
+        for part in parts or []:
+            recipe_field, nested_field = DOCUMENT_PARTS[part]
+            data.setdefault(recipe_field, {})[nested_field] = self.load_part(part)
+        return data
+
 
 class DatabaseService:
 
     def __init__(self):
+        settings.validate_subsystem("database")
         self.db = get_firebase_db()
         self.collection_name = settings.FIREBASE_COLLECTION_NAME
 
 
-    def add_documents(self, documents: list[PdfInformationRecipe]):
+    @trace("db_service.add_documents", capture_output=False)
+    def add_documents(self, documents: list[PdfInformationRecipe | dict]):
         """
         Add multiple documents to the Firestore collection.
+        Each document is stored as a lightweight index document with its heavy parts
+        chunked into sub-collections.
 
-        :param documents: List of dictionaries representing the documents to be added.
+        :param documents: Documents to be added, as PdfInformationRecipe or as dicts already dumped
+                          (e.g. reused for the API response) so they are not dumped again.
         """
         try:
 
             if not documents:
                 raise ValueError("No documents provided to add to the database.")
 
-            batch = self.db.batch()
             collection_ref = self.db.collection(self.collection_name)
+            writes = []
             for document in documents:
-                doc_ref = collection_ref.document(document.title)
-                batch.set(doc_ref, document.model_dump())
-            batch.commit()
+                data = document if isinstance(document, dict) else document.model_dump()
+                doc_ref = collection_ref.document(data["title"])
+                writes.extend(self._split_document_writes(doc_ref, data))
+            self._commit_writes(writes)
 
             logger.info(f"Successfully added {len(documents)} documents to the database.")
         except Exception as e:
             raise ValueError(f"Error adding documents to the database: {e}")
 
+    @trace("db_service.get_document", capture_output=False)
+    def get_document(self, title: str) -> LazyPdfDocument | None:
+        """
+        Get a document by title. Heavy parts are loaded lazily.
+
+        :param title: Title of the document.
+        :return LazyPdfDocument: Lazy proxy of the document, None if the document does not exist.
+        """
+        session = get_active_session()
+        if session is not None:
+            document = session.get_document(title)
+            if document is not None:
+                return document
+        # Concurrent fetches of the same document, e.g. by the queries of a batch, share one read
+        document = get_single_flight("document_fetch").do((self.collection_name, title), self._fetch_document, title)
+        if document is not None and session is not None:
+            session.put_documents([document])
+        return document
+
+    def _fetch_document(self, title: str) -> LazyPdfDocument | None:
+        doc_ref = self.db.collection(self.collection_name).document(title)
+        snapshot = doc_ref.get()
+        if not snapshot.exists:
+            return None
+        return LazyPdfDocument(doc_ref, snapshot.to_dict())
+
+    @trace("db_service.get_documents", capture_output=False)
+    def get_documents(self, query=None) -> list[LazyPdfDocument]:
+        """
+        Get documents of the collection, or of a query built on the collection.
+        Only index documents are fetched, heavy parts are loaded lazily.
+
+        :param query: Optional Firestore query on the collection, e.g. with a `where` filter.
+        :return list[LazyPdfDocument]: Lazy proxies of the matching documents.
+        """
+        session = get_active_session()
+        if session is not None and query is None:
+            # Scans of the whole collection are reused within a chat session
+            documents = session.get_scan(ALL_DOCUMENTS_KEY)
+            if documents is not None:
+                return documents
+        scanned_query = query if query is not None else self.db.collection(self.collection_name)
+        documents = [LazyPdfDocument(snapshot.reference, snapshot.to_dict()) for snapshot in scanned_query.stream()]
+        if session is not None:
+            if query is None:
+                session.put_scan(ALL_DOCUMENTS_KEY, documents)
+            else:
+                session.put_documents(documents)
+        return documents
+
+    @trace("db_service.update_digest", capture_output=False)
+    def update_digest(self, title: str, digest: dict, fingerprint: str):
+        """
+        Store the digest of a document on its index document.
+
+        :param title: Title of the document.
+        :param digest: Digest with the PaperDigestRecipe structure.
+        :param fingerprint: Fingerprint of the document content the digest was generated from.
+        """
+        doc_ref = self.db.collection(self.collection_name).document(title)
+        doc_ref.update({"digest": digest, "digest_fingerprint": fingerprint})
+
+    @trace("db_service.set_source_hash", capture_output=False)
+    def set_source_hash(self, title: str, source_hash: str):
+        """
+        Record the SHA-256 of the PDF file of a document stored before its source was recorded.
+
+        :param title: Title of the document.
+        :param source_hash: SHA-256 of the PDF file.
+        """
+        doc_ref = self.db.collection(self.collection_name).document(title)
+        doc_ref.update({"source_hash": source_hash})
+
+    @trace("db_service.patch_recipe", capture_input=False, capture_output=False)
+    def patch_recipe(self, title: str, recipe_name: str, data: dict, version: int):
+        """
+        Replace the fields of one recipe of a stored document, e.g. its content data extracted again with a new
+        version of the recipe. The parts of the recipe are rewritten and the index document is patched with a merge
+        write, so the other fields of the document (metadata, other recipes, digest) are left untouched.
+
+        :param title: Title of the document.
+        :param recipe_name: Recipe field of PdfInformationRecipe stored in parts, e.g. "content_data".
+        :param data: Recipe data, e.g. {"sections": [...], "references": [...]}.
+        :param version: Version of the recipe the data was extracted with.
+        """
+        parts = {part: nested_field for part, (recipe_field, nested_field) in DOCUMENT_PARTS.items()
+                 if recipe_field == recipe_name}
+        if not parts:
+            raise ValueError(f"Recipe '{recipe_name}' is not stored in document parts.")
+        doc_ref = self.db.collection(self.collection_name).document(title)
+        snapshot = doc_ref.get()
+        if not snapshot.exists:
+            raise ValueError(f"Document '{title}' does not exist.")
+        if self.migrate_document(snapshot):
+            snapshot = doc_ref.get()
+        index_data = snapshot.to_dict()
+
+        writes = []
+        stale_chunks = []
+        # Versions of legacy documents are written in full, the merge would otherwise drop the inferred ones
+        index_patch = {"recipe_versions": {**stored_recipe_versions(index_data), recipe_name: version},
+                       "part_chunks": {}, "part_counts": {}}
+        for part, nested_field in parts.items():
+            items = data.get(nested_field) or []
+            chunks = _chunk_items(items, settings.DB_CHUNK_MAX_BYTES)
+            for chunk_index, chunk in enumerate(chunks):
+                writes.append((doc_ref.collection(part).document(_chunk_id(chunk_index)),
+                               {"index": chunk_index, "items": chunk}))
+            stored_chunk_count = (index_data.get("part_chunks") or {}).get(part, 0)
+            stale_chunks.extend(doc_ref.collection(part).document(_chunk_id(chunk_index))
+                                for chunk_index in range(len(chunks), stored_chunk_count))
+            index_patch["part_chunks"][part] = len(chunks)
+            index_patch["part_counts"][part] = len(items)
+        self._commit_writes(writes)
+        # Index document after the chunks, and chunks beyond the new counts deleted once readers no longer use them
+        doc_ref.set(index_patch, merge=True)
+        for start in range(0, len(stale_chunks), settings.DB_BATCH_MAX_WRITES):
+            batch = self.db.batch()
+            for chunk_ref in stale_chunks[start:start + settings.DB_BATCH_MAX_WRITES]:
+                batch.delete(chunk_ref)
+            batch.commit()
+
+    def migrate_document(self, snapshot) -> bool:
+        """
+        Rewrite a document stored in the legacy single-document layout into the split layout.
+
+        :param snapshot: Firestore snapshot of the document.
+        :return bool: True if the document was migrated, False if it already uses the split layout.
+        """
+        data = snapshot.to_dict()
+        if data.get("storage_layout") == SPLIT_STORAGE_LAYOUT:
+            return False
+        self._commit_writes(self._split_document_writes(snapshot.reference, data))
+        return True
+
+    def _split_document_writes(self, doc_ref, data: dict) -> list[tuple]:
+        """
+        Build the writes storing a document in the split layout.
+        The index document is written with `set` so heavy fields of the legacy layout are dropped.
+
+        :param doc_ref: Firestore reference of the index document.
+        :param data: Document data with the PdfInformationRecipe structure.
+        :return list[tuple]: List of (document reference, data) writes.
+        """
+        writes = []
+        index_data = {field: data.get(field) for field in INDEX_FIELDS}
+        index_data["digest_fingerprint"] = data.get("digest_fingerprint")
+        index_data["source_hash"] = data.get("source_hash")
+        index_data["recipe_versions"] = data.get("recipe_versions") or stored_recipe_versions(data)
+        index_data["storage_layout"] = SPLIT_STORAGE_LAYOUT
+        index_data["part_chunks"] = {}
+        index_data["part_counts"] = {}
+        for part, (recipe_field, nested_field) in DOCUMENT_PARTS.items():
+            items = (data.get(recipe_field) or {}).get(nested_field) or []
+            chunks = _chunk_items(items, settings.DB_CHUNK_MAX_BYTES)
+            for chunk_index, chunk in enumerate(chunks):
+                writes.append((doc_ref.collection(part).document(_chunk_id(chunk_index)),
+                               {"index": chunk_index, "items": chunk}))
+            index_data["part_chunks"][part] = len(chunks)
+            index_data["part_counts"][part] = len(items)
+        # Index document last so readers never see chunk counts for chunks that are not written yet
+        writes.append((doc_ref, index_data))
+        return writes
+
+    def _commit_writes(self, writes: list[tuple]):
+        """
+        Commit writes in batches within the Firestore batch size limit.
+        """
+        for start in range(0, len(writes), settings.DB_BATCH_MAX_WRITES):
+            batch = self.db.batch()
+            for doc_ref, data in writes[start:start + settings.DB_BATCH_MAX_WRITES]:
+                batch.set(doc_ref, data)
+            batch.commit()
+
+
+def _chunk_id(chunk_index: int) -> str:
+    return f"chunk_{chunk_index:05d}"
+
+
+def _json_size(value) -> int:
+    return len(json.dumps(value, ensure_ascii=False, default=str).encode("utf-8"))
+
+
+def _chunk_items(items: list, max_bytes: int) -> list[list]:
+    """
+    Split items into chunks whose estimated serialized size stays below max_bytes.
+    An item larger than max_bytes, e.g. a very long section, is split into fragments stored in consecutive chunks.
+
+    :raises ValueError: If an item cannot be split below max_bytes, before anything is written.
+    """
+    chunks = []
+    current_chunk = []
+    current_size = 0
+    for item in items:
+        item_size = _json_size(item)
+        fragments = _split_item(item, max_bytes) if item_size > max_bytes else [item]
+        for fragment in fragments:
+            fragment_size = item_size if len(fragments) == 1 else _json_size(fragment)
+            if current_chunk and current_size + fragment_size > max_bytes:
+                chunks.append(current_chunk)
+                current_chunk = []
+                current_size = 0
+            current_chunk.append(fragment)
+            current_size += fragment_size
+    if current_chunk:
+        chunks.append(current_chunk)
+    return chunks
+
+
+def _split_item(item, max_bytes: int) -> list[dict]:
+    """
+    Split the longest text field of an item into fragments of at most max_bytes UTF-8 bytes.
+    The first fragment holds the other fields, the next ones only their piece of the text.
+
+    :return list[dict]: Fragments of the item, joined again by _join_fragments.
+    """
+    text_fields = [field for field, value in item.items() if isinstance(value, str)] if isinstance(item, dict) else []
+    if not text_fields:
+        raise ValueError(f"An item of {_json_size(item)} bytes exceeds the chunk size of {max_bytes} bytes "
+                         f"and has no text field to split.")
+    field = max(text_fields, key=lambda name: len(item[name]))
+    first_fragment = {**item, field: "", ITEM_FRAGMENT_KEY: {"field": field, "index": 0}}
+    budget = max_bytes - _json_size(first_fragment)
+    if budget < max_bytes // 2:
+        raise ValueError(f"An item of {_json_size(item)} bytes exceeds the chunk size of {max_bytes} bytes "
+                         f"even without its '{field}' field.")
+
+    encoded = item[field].encode("utf-8")
+    pieces = []
+    start = 0
+    while start < len(encoded):
+        end = min(start + budget, len(encoded))
+        # Pieces end on a character boundary: UTF-8 continuation bytes are 0b10xxxxxx
+        while end < len(encoded) and encoded[end] & 0xC0 == 0x80:
+            end -= 1
+        pieces.append(encoded[start:end].decode("utf-8"))
+        start = end
+    fragments = [{**first_fragment, field: pieces[0]}]
+    fragments.extend({field: piece, ITEM_FRAGMENT_KEY: {"field": field, "index": index}}
+                     for index, piece in enumerate(pieces[1:], start=1))
+    return fragments
+
+
+def _join_fragments(items: list) -> list:
+    """
+    Join the fragments of the items split by _chunk_items. Items without fragments are returned as is.
+    """
+    if not any(isinstance(item, dict) and ITEM_FRAGMENT_KEY in item for item in items):
+        return items
+    joined_items = []
+    for item in items:
+        fragment = item.get(ITEM_FRAGMENT_KEY) if isinstance(item, dict) else None
+        if fragment is None:
+            joined_items.append(item)
+        elif fragment["index"] == 0:
+            joined_items.append({key: value for key, value in item.items() if key != ITEM_FRAGMENT_KEY})
+        else:
+            joined_items[-1][fragment["field"]] += item[fragment["field"]]
+    return joined_items
+
 
 def get_firebase_db():
     """
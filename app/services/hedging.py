@@ -0,0 +1,202 @@
+import contextvars
+import logging
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from functools import lru_cache
+
+from app.settings import get_settings
+from app.services.metrics import metrics_registry
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Absolute deadline (time.monotonic) of the request being processed, None if the request has no deadline.
+# Context variables are copied to asyncio tasks and to_thread calls, so the deadline follows the request.
+_request_deadline = contextvars.ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+@contextmanager
+def request_deadline(seconds: float):
+    """
+    Set the deadline of the current request. Nested deadlines can only shorten the current one.
+
+    :param seconds: Time budget of the request in seconds.
+    """
+    deadline = time.monotonic() + seconds
+    current_deadline = _request_deadline.get()
+    if current_deadline is not None:
+        deadline = min(deadline, current_deadline)
+    token = _request_deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _request_deadline.reset(token)
+
+
+def remaining_time() -> float | None:
+    """
+    :return float: Seconds left before the deadline of the current request, None if it has no deadline.
+    """
+    deadline = _request_deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class HedgedCaller:
+    """
+    Runs blocking model calls with a per-call timeout derived from the request deadline, and optionally hedges them:
+    if a call has not returned after the recent p95 latency, a duplicate call is sent and the first response wins.
+
+    Threads cannot be interrupted, so the losing call is not killed: its result is discarded, and it is bounded
+    by the per-call timeout passed to the call function. Hedges are capped to a fraction of the calls so that
+    a global slowdown does not double the load on the model API.
+    """
+    def __init__(self, name: str, hedging_enabled: bool = None, max_hedge_rate: float = None,
+                 min_samples: int = None, max_workers: int = None):
+        """
+        :param name: Name of the caller, used for the metrics.
+        :param hedging_enabled: Send hedged requests. Defaults to settings.HEDGING_ENABLED.
+        :param max_hedge_rate: Maximum ratio of hedged calls. Defaults to settings.HEDGING_MAX_RATE.
+        :param min_samples: Latency samples required before hedging. Defaults to settings.HEDGING_MIN_SAMPLES.
+        :param max_workers: Threads running the calls. Defaults to settings.HEDGING_MAX_WORKERS.
+        """
+        self.name = name
+        self.hedging_enabled = settings.HEDGING_ENABLED if hedging_enabled is None else hedging_enabled
+        self.max_hedge_rate = settings.HEDGING_MAX_RATE if max_hedge_rate is None else max_hedge_rate
+        self.min_samples = settings.HEDGING_MIN_SAMPLES if min_samples is None else min_samples
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or settings.HEDGING_MAX_WORKERS,
+                                            thread_name_prefix=f"hedged-{name}")
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=settings.HEDGING_LATENCY_WINDOW)
+        self._stats = {"calls": 0, "hedged": 0, "hedge_wins": 0, "hedges_without_slot": 0, "deadline_exceeded": 0,
+                       "errors": 0}
+
+    def hedge_delay(self) -> float | None:
+        """
+        :return float: Delay before hedging, the recent p95 latency. None until enough latencies are recorded.
+        """
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            latencies = sorted(self._latencies)
+        return latencies[min(len(latencies) - 1, math.ceil(settings.HEDGING_PERCENTILE * len(latencies)) - 1)]
+
+    def _allow_hedge(self) -> bool:
+        with self._lock:
+            if (self._stats["hedged"] + 1) > self.max_hedge_rate * self._stats["calls"]:
+                return False
+            self._stats["hedged"] += 1
+            return True
+
+    def _count(self, stat: str):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def _submit(self, function, timeout_seconds: float, limiter=None):
+        context = contextvars.copy_context()
+        future = self._executor.submit(context.run, function, timeout_seconds)
+        if limiter is not None:
+            # The slot is held until the request is finished, even when its response is discarded
+            future.add_done_callback(lambda _: limiter.release_slot())
+        return future
+
+    def _take_hedge_slot(self, limiter) -> bool:
+        """
+        Take a request slot for a hedge without waiting: a saturated limiter means the model is slow because of
+        the load, and a hedge would only add to it.
+        """
+        if limiter is None or limiter.acquire_slot(blocking=False):
+            return True
+        self._count("hedges_without_slot")
+        return False
+
+    def call(self, function, limiter=None):
+        """
+        Run a call within the deadline of the current request.
+
+        :param function: Blocking function taking the per-call timeout in seconds and returning the response.
+        :param limiter: Request limiter of the calls (ModelRequestLimiter). The call waits for a request slot
+                        before it is timed, so the time queued at the limiter is not counted in the latencies
+                        the hedge delay is computed from. A hedge is only sent if a slot is available right away.
+        :return: The first successful response.
+        :raises DeadlineExceeded: If no response arrives before the deadline.
+        """
+        self._count("calls")
+        remaining = remaining_time()
+        timeout_seconds = settings.MODEL_CALL_TIMEOUT_SECONDS if remaining is None else min(remaining, settings.MODEL_CALL_TIMEOUT_SECONDS)
+        if timeout_seconds <= 0:
+            self._count("deadline_exceeded")
+            raise DeadlineExceeded(f"Request deadline exceeded before calling {self.name}.")
+        call_deadline = time.monotonic() + timeout_seconds
+        if limiter is not None and not limiter.acquire_slot(timeout=timeout_seconds):
+            self._count("deadline_exceeded")
+            raise DeadlineExceeded(f"No model request slot for {self.name} within {timeout_seconds:.1f}s.")
+
+        start_time = time.monotonic()
+        timeout_seconds = call_deadline - start_time
+        primary = self._submit(function, timeout_seconds, limiter)
+        futures = {primary}
+        hedge = None
+
+        hedge_delay = self.hedge_delay() if self.hedging_enabled else None
+        if hedge_delay is not None and hedge_delay < timeout_seconds:
+            done, _ = wait(futures, timeout=hedge_delay)
+            if not done and self._take_hedge_slot(limiter):
+                if self._allow_hedge():
+                    logger.info(f"{self.name} call slower than p95 ({hedge_delay:.2f}s), sending a hedged request.")
+                    hedge = self._submit(function, call_deadline - time.monotonic(), limiter)
+                    futures.add(hedge)
+                elif limiter is not None:
+                    limiter.release_slot()
+
+        last_error = None
+        while futures:
+            done, futures = wait(futures, timeout=max(0.0, call_deadline - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    for loser in futures:
+                        loser.cancel()
+                    with self._lock:
+                        self._latencies.append(time.monotonic() - start_time)
+                        if future is hedge:
+                            self._stats["hedge_wins"] += 1
+                    return future.result()
+                last_error = future.exception()
+
+        for future in futures:
+            future.cancel()
+        if last_error is not None and not futures:
+            self._count("errors")
+            raise last_error
+        self._count("deadline_exceeded")
+        raise DeadlineExceeded(f"{self.name} call did not complete within {timeout_seconds:.1f}s.")
+
+    def to_dict(self) -> dict:
+        hedge_delay = self.hedge_delay()
+        with self._lock:
+            return {
+                **self._stats,
+                "hedge_rate": round(self._stats["hedged"] / self._stats["calls"], 4) if self._stats["calls"] else 0.0,
+                "hedge_delay_ms": round(hedge_delay * 1000, 1) if hedge_delay is not None else None,
+            }
+
+
+@lru_cache
+def get_hedged_caller(name: str) -> HedgedCaller:
+    """
+    Get the process-wide hedged caller of a kind of model call, e.g. "agent" or "extraction".
+    Each kind keeps its own latency distribution.
+    """
+    hedged_caller = HedgedCaller(name)
+    metrics_registry.register(f"hedging_{name}", hedged_caller.to_dict)
+    return hedged_caller
@@ -0,0 +1,42 @@
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsRegistry:
+    """
+    Registry of in-process metrics providers exposed by the `/metrics` endpoint.
+    A provider is a function returning a JSON serialisable snapshot of its metrics.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._providers = {}
+
+    def register(self, name: str, provider):
+        """
+        Register a metrics provider, replacing any provider registered with the same name.
+
+        :param name: Name of the metrics group.
+        :param provider: Function returning a dict of metrics.
+        """
+        with self._lock:
+            self._providers[name] = provider
+
+    def collect(self) -> dict:
+        """
+        Collect the metrics of all providers. A failing provider does not hide the others.
+        """
+        with self._lock:
+            providers = dict(self._providers)
+        metrics = {}
+        for name, provider in providers.items():
+            try:
+                metrics[name] = provider()
+            except Exception as e:
+                logger.error(f"Error collecting {name} metrics: {e}")
+                metrics[name] = {"error": str(e)}
+        return metrics
+
+
+metrics_registry = MetricsRegistry()
@@ -0,0 +1,172 @@
+import logging
+import threading
+import time
+from functools import lru_cache
+
+from app.settings import get_settings
+from app.services.hedging import DeadlineExceeded
+from app.services.metrics import metrics_registry
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+class ModelRoutingStats:
+    """
+    Latency statistics of routed model calls, per tier.
+    The latency saved by a tier is estimated against the average latency of the baseline tier:
+    (baseline average - tier average) for every accepted response, minus the latency of the calls
+    that had to be escalated from that tier.
+    """
+    def __init__(self, baseline_tier: str):
+        self.baseline_tier = baseline_tier
+        self._lock = threading.Lock()
+        self._tiers = {}
+
+    def record(self, tier: str, latency_seconds: float, accepted: bool, low_confidence: bool = False):
+        with self._lock:
+            tier_stats = self._tiers.setdefault(
+                tier, {"calls": 0, "accepted": 0, "escalated": 0, "low_confidence": 0, "accepted_latency": 0.0,
+                       "escalated_latency": 0.0}
+            )
+            tier_stats["calls"] += 1
+            if accepted:
+                tier_stats["accepted"] += 1
+                tier_stats["accepted_latency"] += latency_seconds
+            else:
+                tier_stats["escalated"] += 1
+                tier_stats["escalated_latency"] += latency_seconds
+                if low_confidence:
+                    tier_stats["low_confidence"] += 1
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            baseline_stats = self._tiers.get(self.baseline_tier)
+            baseline_average = (baseline_stats["accepted_latency"] / baseline_stats["accepted"]
+                                if baseline_stats and baseline_stats["accepted"] else None)
+            report = {"baseline_tier": self.baseline_tier, "tiers": {}}
+            for tier, tier_stats in self._tiers.items():
+                average = tier_stats["accepted_latency"] / tier_stats["accepted"] if tier_stats["accepted"] else None
+                latency_saved = None
+                if baseline_average is not None and average is not None:
+                    latency_saved = tier_stats["accepted"] * (baseline_average - average) - tier_stats["escalated_latency"]
+                report["tiers"][tier] = {
+                    "calls": tier_stats["calls"],
+                    "accepted": tier_stats["accepted"],
+                    "escalated": tier_stats["escalated"],
+                    "low_confidence": tier_stats["low_confidence"],
+                    "average_latency_ms": round(average * 1000, 1) if average is not None else None,
+                    "latency_saved_ms": round(latency_saved * 1000, 1) if latency_saved is not None else None,
+                }
+            return report
+
+
+class ModelRouter:
+    """
+    Routes a model call to a model tier from the step type and the prompt size, and escalates
+    to the next tier when the response fails validation or reports a low confidence.
+
+    Policies are configured in settings.MODEL_ROUTING_POLICIES by step type:
+        tier: tier tried first.
+        max_prompt_chars: prompts larger than this start one tier higher (optional).
+        max_tier: highest tier to escalate to (optional, defaults to the highest tier).
+        min_confidence: responses with a lower confidence are escalated (optional,
+                        defaults to settings.MODEL_ROUTING_MIN_CONFIDENCE).
+    Steps without a policy, or all steps when routing is disabled, use the caller's default model only.
+    """
+    def __init__(self, tiers: dict[str, str] = None, tier_order: list[str] = None,
+                 policies: dict[str, dict] = None, enabled: bool = None):
+        self.tiers = tiers or settings.MODEL_TIERS
+        self.tier_order = tier_order or settings.MODEL_TIER_ORDER
+        self.policies = settings.MODEL_ROUTING_POLICIES if policies is None else policies
+        self.enabled = settings.MODEL_ROUTING_ENABLED if enabled is None else enabled
+        self.stats = ModelRoutingStats(settings.MODEL_ROUTING_BASELINE_TIER)
+
+    def plan(self, step: str, prompt_chars: int, default_model: str) -> list[tuple[str, str]]:
+        """
+        Build the cascade of models to try for a call.
+
+        :param step: Step type of the call.
+        :param prompt_chars: Size of the prompt in characters.
+        :param default_model: Model used when the step is not routed.
+        :return list[tuple[str, str]]: (tier, model name) pairs in escalation order.
+        """
+        policy = self.policies.get(step) if self.enabled and step else None
+        if not policy:
+            return [("default", default_model)]
+        start_index = self.tier_order.index(policy["tier"])
+        if policy.get("max_prompt_chars") and prompt_chars > policy["max_prompt_chars"]:
+            start_index = min(start_index + 1, len(self.tier_order) - 1)
+        end_index = self.tier_order.index(policy.get("max_tier", self.tier_order[-1]))
+        tiers = self.tier_order[start_index:max(start_index, end_index) + 1]
+        return [(tier, self.tiers[tier]) for tier in tiers]
+
+    def run(self, step: str, prompt_chars: int, call, validate, default_model: str, confidence=None):
+        """
+        Call the models of the cascade until a response passes validation with a sufficient confidence.
+
+        :param step: Step type of the call.
+        :param prompt_chars: Size of the prompt in characters.
+        :param call: Function calling the model, takes the model name and returns the response.
+        :param validate: Function returning True if a response is acceptable.
+        :param default_model: Model used when the step is not routed.
+        :param confidence: Function returning the confidence (0 to 1) the model reported in a response,
+                           None if it reported none. Responses below the minimum confidence of the step are escalated.
+        :return: The first accepted response. If no response is accepted, the response of the last model
+                 is returned (or its exception raised) so the caller keeps its own error handling.
+        """
+        cascade = self.plan(step, prompt_chars, default_model)
+        min_confidence = (self.policies.get(step) or {}).get("min_confidence", settings.MODEL_ROUTING_MIN_CONFIDENCE)
+        for attempt, (tier, model_name) in enumerate(cascade, start=1):
+            is_last_attempt = attempt == len(cascade)
+            start_time = time.monotonic()
+            try:
+                response = call(model_name)
+                accepted = self._is_valid(validate, response)
+            except DeadlineExceeded:
+                # No time left for a stronger model
+                self.stats.record(tier, time.monotonic() - start_time, accepted=False)
+                raise
+            except Exception as e:
+                self.stats.record(tier, time.monotonic() - start_time, accepted=False)
+                if is_last_attempt:
+                    raise
+                logger.warning(f"Model {model_name} failed for step {step}, escalating: {e}")
+                continue
+            low_confidence = False
+            if accepted and confidence is not None:
+                response_confidence = self._confidence(confidence, response)
+                low_confidence = response_confidence is not None and response_confidence < min_confidence
+                accepted = not low_confidence
+            self.stats.record(tier, time.monotonic() - start_time, accepted=accepted or is_last_attempt,
+                              low_confidence=low_confidence and not is_last_attempt)
+            if accepted or is_last_attempt:
+                return response
+            if low_confidence:
+                logger.info(f"Response of model {model_name} has a low confidence for step {step}, escalating.")
+            else:
+                logger.info(f"Response of model {model_name} failed validation for step {step}, escalating.")
+
+    @staticmethod
+    def _confidence(confidence, response) -> float | None:
+        try:
+            return confidence(response)
+        except Exception:
+            return None
+
+    @staticmethod
+    def _is_valid(validate, response) -> bool:
+        try:
+            return bool(validate(response))
+        except Exception:
+            return False
+
+
+@lru_cache
+def get_model_router() -> ModelRouter:
+    """
+    Get the process-wide model router.
+    """
+    model_router = ModelRouter()
+    metrics_registry.register("model_routing", model_router.stats.to_dict)
+    return model_router
@@ -1,16 +1,97 @@
 import asyncio
+import threading
+import time
 import yaml
 from abc import ABC
+from collections import deque
+from contextlib import contextmanager
+from functools import lru_cache
 from google import genai
 from pydantic import BaseModel
-from opik import track
-
 
 from app.settings import get_settings
+from app.services.hedging import get_hedged_caller
+from app.services.model_router import get_model_router
+from app.services.recipe import get_recipe_list_adapter
+from app.services.tracing import record_model_response, start_span, trace
 
 settings = get_settings()
 
 
+class ModelRequestLimiter:
+    """
+    Process-wide limiter for model requests.
+    Bounds the number of concurrent requests and the number of requests started per minute.
+    Model calls run in worker threads (and in different event loops for concurrent API requests),
+    so the limiter relies on thread primitives instead of asyncio ones.
+    """
+    def __init__(self, max_concurrent_requests: int, requests_per_minute: int):
+        """
+        :param max_concurrent_requests: Maximum number of requests running at the same time.
+        :param requests_per_minute: Maximum number of requests started in any 60 seconds window, 0 for no limit.
+        """
+        self.requests_per_minute = requests_per_minute
+        self._semaphore = threading.BoundedSemaphore(max_concurrent_requests)
+        self._lock = threading.Lock()
+        self._request_start_times = deque()
+
+    def _wait_for_rate_limit(self, deadline: float = None) -> bool:
+        if self.requests_per_minute <= 0:
+            return True
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                while self._request_start_times and now - self._request_start_times[0] >= 60:
+                    self._request_start_times.popleft()
+                if len(self._request_start_times) < self.requests_per_minute:
+                    self._request_start_times.append(now)
+                    return True
+                wait_seconds = 60 - (now - self._request_start_times[0])
+            if deadline is not None and now + wait_seconds > deadline:
+                return False
+            time.sleep(wait_seconds)
+
+    def acquire_slot(self, timeout: float = None, blocking: bool = True) -> bool:
+        """
+        Take a request slot, released with `release_slot` once the request is finished.
+
+        :param timeout: Maximum time to wait for a slot in seconds, None to wait until a slot is available.
+        :param blocking: Wait for a slot, otherwise only take a slot that is available now.
+        :return bool: True if a slot was taken.
+        """
+        if not blocking:
+            timeout = 0.0
+        deadline = None if timeout is None else time.monotonic() + timeout
+        if not self._semaphore.acquire(blocking=blocking, timeout=timeout if blocking else None):
+            return False
+        if not self._wait_for_rate_limit(deadline):
+            self._semaphore.release()
+            return False
+        return True
+
+    def release_slot(self):
+        self._semaphore.release()
+
+    @contextmanager
+    def acquire(self):
+        """
+        Blocks until a request is allowed to start, releases the concurrency slot on exit.
+        """
+        self.acquire_slot()
+        try:
+            yield
+        finally:
+            self.release_slot()
+
+
+@lru_cache
+def get_model_request_limiter() -> ModelRequestLimiter:
+    """
+    Get the process-wide model request limiter.
+    """
+    return ModelRequestLimiter(settings.MODEL_MAX_CONCURRENT_REQUESTS, settings.MODEL_REQUESTS_PER_MINUTE)
+
+
 class ModelService(ABC):
 
     def __init__(self):
@@ -22,8 +103,12 @@ class InformationExtractionModelService(ModelService):
     """
     def __init__(self):
         super().__init__()
+        settings.validate_subsystem("model")
         self.client = genai.Client(api_key=settings.API_KEY)
         self.model_name = settings.INFORMATION_EXTRACTION_MODEL
+        self.request_limiter = get_model_request_limiter()
+        self.model_router = get_model_router()
+        self.hedged_caller = get_hedged_caller("extraction")
         self._load_prompt()
 
     def _load_prompt(self):
@@ -31,6 +116,7 @@ class InformationExtractionModelService(ModelService):
             prompt = yaml.safe_load(file)
         self.system_prompt = "System: " + prompt["system"]
         self.user_prompt = "User: " + prompt["user"]
+        self.page_range_prompt = "User: " + prompt["page_range"]
 
     def upload_file(self, file_path: str):
         """
@@ -42,24 +128,75 @@ class InformationExtractionModelService(ModelService):
         return self.client.files.upload(file=file_path)
 
 
-    @track(name="information_extraction_model_service.execute")
-    async def execute(self, content: str, recipe: BaseModel) -> str:
+    @trace("information_extraction_model_service.execute")
+    async def execute(self, content: str, recipe: BaseModel, page_range: tuple[int, int] = None,
+                      step: str = None, page_count: int = None) -> str:
         """
         Extract information using the model.
 
         :param prompt: The prompt to send to the model.
+        :param page_range: Optional (first page, last page) to restrict the extraction to, 1-indexed and inclusive.
+        :param step: Step type used by the model router to pick the model tier, e.g. "metadata_extraction".
+        :param page_count: Number of pages of an uploaded file, used to route the call by the size of the document
+                           when no page range is given.
         :return: The model's response.
         """
+        contents = [self.system_prompt, self.user_prompt]
+        if page_range:
+            contents.append(self.page_range_prompt.format(start_page=page_range[0], end_page=page_range[1]))
+        prompt_chars = sum(len(text) for text in contents)
+        # The model reads the whole document (or its page range), the routing counts it with the prompt
+        if isinstance(content, str):
+            prompt_chars += len(content)
+        else:
+            pages = page_range[1] - page_range[0] + 1 if page_range else page_count or 0
+            prompt_chars += pages * settings.MODEL_ROUTING_CHARS_PER_PAGE
+        contents.append(content)
+        response_adapter = get_recipe_list_adapter(recipe)
+
+        def generate(model_name: str):
+            def call(timeout_seconds: float):
+                with start_span("genai.generate_content", kind="llm", input=lambda: {"contents": contents},
+                                attributes={"model": model_name}) as span:
+                    response = self.client.models.generate_content(
+                        model=model_name,
+                        contents=contents,
+                        config={
+                            "response_mime_type": "application/json",
+                            "response_schema": list[recipe],
+                            "max_output_tokens": 8192,
+                            "http_options": {"timeout": int(timeout_seconds * 1000)},
+                        }
+                    )
+                    record_model_response(span, response)
+                    return response
+            # The call is bounded by the request deadline, and hedged if it is slower than usual.
+            # The request slot is taken before the call is timed, a hedge takes a slot of its own
+            return self.hedged_caller.call(call, limiter=self.request_limiter)
+
+        def is_valid(response) -> bool:
+            # Escalate to a stronger model if the output does not match the recipe schema
+            return len(response_adapter.validate_json(response.text)) > 0
+
         def call_model():
-            return self.client.models.generate_content(
-                model=self.model_name,
-                contents=[self.system_prompt, self.user_prompt, content],
-                config={
-                    "response_mime_type": "application/json",
-                    "response_schema": list[recipe],
-                    "max_output_tokens": 8192,
-                }
-            )
+            return self.model_router.run(step, prompt_chars, generate, is_valid, self.model_name)
         # Because Google's generate_content is I/O blocking it defeats parallel calls
         # This moves the blocking call to a separate thread, letting the event loop continue scheduling other tasks
-        return await asyncio.to_thread(call_model)
\ No newline at end of file
+        return await asyncio.to_thread(call_model)
+
+
+class PaperDigestModelService(InformationExtractionModelService):
+    """
+    Service for generating paper digests from extracted documents.
+    Uses the extraction model calls (limiter, routing and hedging) with the digest prompt.
+    """
+    def __init__(self):
+        super().__init__()
+        self.model_name = settings.PAPER_DIGEST_MODEL
+
+    def _load_prompt(self):
+        with open(settings.PAPER_DIGEST_PROMPT_FILE_PATH, 'r') as file:
+            prompt = yaml.safe_load(file)
+        self.system_prompt = "System: " + prompt["system"]
+        self.user_prompt = "User: " + prompt["user"]
+        self.page_range_prompt = None
@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+import json
+import logging
+
+from app.settings import get_settings
+from app.services.db_service import DOCUMENT_PARTS
+from app.services.model_service import PaperDigestModelService
+from app.services.recipe import PaperDigestRecipe, PdfInformationRecipe, get_recipe_list_adapter
+from app.services.tracing import trace
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+FINGERPRINT_FIELDS = ("title", "authors", "publication_date", "abstract")
+
+
+class PaperDigestService:
+    """
+    Ingest stage generating a compact digest of every extracted paper: summary, key contributions,
+    methods, datasets and metrics. Comparison and summary queries work on the digests instead of full documents.
+
+    A digest is generated from the extracted document and stored with the fingerprint of that document.
+    It is only generated again when the fingerprint changes, e.g. when the paper is extracted again with
+    a different result, so re-uploading an unchanged paper does not call the model.
+    """
+    def __init__(self, model_service: PaperDigestModelService = None, db_service=None):
+        """
+        :param model_service: Model service generating the digests. Created on first use if not provided.
+        :param db_service: DatabaseService used to reuse stored digests. Created on first use if not provided
+                           and the database is configured.
+        """
+        self.model_service = model_service
+        self.db_service = db_service
+
+    @staticmethod
+    def fingerprint(document: PdfInformationRecipe) -> str:
+        """
+        Fingerprint of the content of a document, the digest excluded.
+        The content is fingerprinted part by part, so an extracted document and the same document read back
+        from the database (where missing parts are empty) have the same fingerprint.
+        """
+        data = document.model_dump()
+        content = {field: data.get(field) for field in FINGERPRINT_FIELDS}
+        for part, (recipe_field, nested_field) in DOCUMENT_PARTS.items():
+            content[part] = (data.get(recipe_field) or {}).get(nested_field) or []
+        return hashlib.sha256(json.dumps(content, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def digest_input(document: PdfInformationRecipe) -> str:
+        """
+        Model input of a document: its content as JSON, truncated to settings.PAPER_DIGEST_MAX_INPUT_CHARS.
+        """
+        data = document.model_dump(exclude={"digest", "digest_fingerprint", "source_hash", "recipe_versions"})
+        return json.dumps(data, ensure_ascii=False, default=str)[:settings.PAPER_DIGEST_MAX_INPUT_CHARS]
+
+    def _get_db_service(self):
+        if self.db_service is None and settings.is_subsystem_configured("database"):
+            from app.services.db_service import DatabaseService
+            self.db_service = DatabaseService()
+        return self.db_service
+
+    def stored_digest(self, title: str, fingerprint: str) -> PaperDigestRecipe | None:
+        """
+        :return PaperDigestRecipe: The stored digest of the document, None if there is none or it was generated
+                                   from a different version of the document.
+        """
+        db_service = self._get_db_service()
+        if db_service is None:
+            return None
+        stored_document = db_service.get_document(title)
+        if stored_document is None or stored_document.digest is None or stored_document.digest_fingerprint != fingerprint:
+            return None
+        return PaperDigestRecipe(**stored_document.digest)
+
+    @trace("paper_digest_service.generate")
+    async def generate(self, document: PdfInformationRecipe) -> PaperDigestRecipe:
+        """
+        Generate the digest of a document with the model.
+        """
+        if self.model_service is None:
+            self.model_service = PaperDigestModelService()
+        response = await self.model_service.execute(self.digest_input(document), recipe=PaperDigestRecipe,
+                                                    step="paper_digest")
+        return get_recipe_list_adapter(PaperDigestRecipe).validate_json(response.text)[0]
+
+    async def aadd_digest(self, document: PdfInformationRecipe) -> PdfInformationRecipe:
+        """
+        Set the digest of a document, reusing the current digest or the stored one if the document has not changed.
+        A failed generation is logged and the document is returned without digest, so it can still be stored.
+
+        :param document: Extracted document.
+        :return PdfInformationRecipe: The document with its digest and digest fingerprint.
+        """
+        fingerprint = self.fingerprint(document)
+        if document.digest is not None and document.digest_fingerprint == fingerprint:
+            return document
+        try:
+            digest = await asyncio.to_thread(self.stored_digest, document.title, fingerprint)
+            if digest is None:
+                logger.info(f"Generating digest of '{document.title}'.")
+                digest = await self.generate(document)
+            else:
+                logger.info(f"Document '{document.title}' has not changed, reusing its digest.")
+        except Exception as e:
+            logger.error(f"Error generating digest of '{document.title}': {e}")
+            return document
+        return document.model_copy(update={"digest": digest, "digest_fingerprint": fingerprint})
+
+    async def aadd_digests(self, documents: list[PdfInformationRecipe]) -> list[PdfInformationRecipe]:
+        return list(await asyncio.gather(*(self.aadd_digest(document) for document in documents)))
+
+    def add_digests(self, documents: list[PdfInformationRecipe]) -> list[PdfInformationRecipe]:
+        """
+        Set the digests of extracted documents before they are stored.
+
+        :param documents: Extracted documents.
+        :return list[PdfInformationRecipe]: The documents with their digests.
+        """
+        if not settings.PAPER_DIGEST_ENABLED or not documents:
+            return documents
+        return asyncio.run(self.aadd_digests(documents))
+
+    def backfill(self, force: bool = False) -> dict:
+        """
+        Generate the digests of stored documents without digest, or whose content changed since their digest.
+
+        :param force: Regenerate every digest.
+        :return dict: Number of generated, unchanged and failed digests.
+        """
+        db_service = self._get_db_service()
+        if db_service is None:
+            raise ValueError("The database is not configured.")
+        counts = {"generated": 0, "unchanged": 0, "failed": 0}
+        for stored_document in db_service.get_documents():
+            try:
+                document = PdfInformationRecipe(**stored_document.to_dict(parts=list(DOCUMENT_PARTS)))
+                fingerprint = self.fingerprint(document)
+                if not force and stored_document.digest is not None and stored_document.digest_fingerprint == fingerprint:
+                    counts["unchanged"] += 1
+                    continue
+                digest = asyncio.run(self.generate(document))
+                db_service.update_digest(document.title, digest.model_dump(), fingerprint)
+                counts["generated"] += 1
+            except Exception as e:
+                logger.error(f"Error generating digest of '{stored_document.title}': {e}")
+                counts["failed"] += 1
+        return counts
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Generate the digests of the stored documents.")
+    parser.add_argument("--force", action="store_true", help="Regenerate every digest, even if the document has not changed.")
+    args = parser.parse_args()
+    print(PaperDigestService().backfill(force=args.force))
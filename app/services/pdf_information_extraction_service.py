@@ -1,19 +1,68 @@
 import asyncio
 import logging
-import json
+import re
+import time
+import zlib
 from pathlib import Path
-from opik import track
 
+from app.settings import get_settings
+from app.services.cache import Cache, fingerprint, get_cache
+from app.services.checkpoint_service import FailedFile, IngestionCheckpointStore, IngestionReport
+from app.services.hedging import remaining_time
+from app.services.single_flight import get_single_flight
+from app.services.tracing import trace
 from app.services.model_service import InformationExtractionModelService
 from app.services.recipe import (
     PdfInformationRecipe,
     PdfMetaDataRecipe,
     PdfContentDataRecipe,
     TablesAndFiguresRecipe,
+    DOCUMENT_RECIPES,
+    get_recipe_list_adapter,
 )
 
+settings = get_settings()
 logger = logging.getLogger(__name__)
 
+
+def _page_tree_count(content: bytes) -> int:
+    """
+    Largest `/Count` of the `/Pages` dictionaries of PDF data, the page count of the page tree root.
+    Stream data is skipped, nested dictionaries are matched with their own keys only.
+    """
+    content = re.sub(rb"(?<!end)stream\r?\n.*?endstream", b"", content, flags=re.DOTALL)
+    page_count = 0
+    starts = []
+    for delimiter in re.finditer(rb"<<|>>", content):
+        if delimiter.group() == b"<<":
+            starts.append((delimiter.end(), []))
+            continue
+        if not starts:
+            continue
+        start, nested = starts.pop()
+        # Keys of the dictionary itself, without its nested dictionaries
+        own_keys = content[start:delimiter.start()]
+        for nested_start, nested_end in reversed(nested):
+            own_keys = own_keys[:nested_start - start] + own_keys[nested_end - start:]
+        if starts:
+            starts[-1][1].append((start - 2, delimiter.end()))
+        if re.search(rb"/Type\s*/Pages(?![a-zA-Z])", own_keys):
+            count = re.search(rb"/Count\s+(\d+)", own_keys)
+            if count:
+                page_count = max(page_count, int(count.group(1)))
+    return page_count
+
+
+class ExtractionFailed(Exception):
+    """
+    Raised when the extraction of a file failed, with the number of attempts made before giving up:
+    fewer than settings.EXTRACTION_MAX_ATTEMPTS when the request deadline stopped the retries.
+    """
+    def __init__(self, error: str, attempts: int):
+        super().__init__(error)
+        self.attempts = attempts
+
+
 class PdfInformationExtractionService:
     """
     Service for extracting information from PDF files.
@@ -21,7 +70,13 @@ class PdfInformationExtractionService:
     from PDF documents using different recipes and a model service.
     """
 
-    def __init__(self):
+    def __init__(self, chunked: bool = None, cache: Cache = None):
+        """
+        :param chunked: Extract long papers chunk by chunk, including their full content.
+                        Defaults to settings.CHUNKED_EXTRACTION_ENABLED.
+        :param cache: Cache of the extracted recipes by file content. Defaults to the process-wide "extraction"
+                      cache, versioned by the extraction prompt and model.
+        """
         # self.pdf_reader = PdfReader()  # Assuming PdfReader is a class that handles PDF reading to extract text, images, etc.
         # Initialize the recipes to be used for information extraction.
         # Each recipe defines the structure of the data to be extracted.
@@ -30,8 +85,24 @@ class PdfInformationExtractionService:
             #"content_data": PdfContentDataRecipe,
             "tables_and_figures": TablesAndFiguresRecipe
         }
+        # In chunked mode, the metadata is extracted from the first chunk and these recipes from every chunk.
+        # The output of a chunk fits within the model output limit, so the full content can be extracted.
+        self.chunk_recipes = {
+            "content_data": PdfContentDataRecipe,
+            "tables_and_figures": TablesAndFiguresRecipe
+        }
+        self.chunked = settings.CHUNKED_EXTRACTION_ENABLED if chunked is None else chunked
         self.pdf_information_recipe = PdfInformationRecipe  # Using the recipe for structured information extraction
         self.pdf_reader = InformationExtractionModelService()  # Using the model service for extraction
+        # Concurrent uploads/extractions of the same file content share a single model call
+        self.extraction_flight = get_single_flight("extraction")
+        # Extractions of the same file content by any job, worker or node share a single model call
+        self.cache = cache or get_cache(
+            "extraction",
+            fingerprint(self.pdf_reader.model_name, self.pdf_reader.system_prompt, self.pdf_reader.user_prompt,
+                        self.pdf_reader.page_range_prompt),
+            settings.EXTRACTION_CACHE_TTL_SECONDS,
+        )
 
     def modify_recipe_format(self, recipe_data: dict) -> dict:
         """
@@ -45,7 +116,8 @@ class PdfInformationExtractionService:
             new_recipe_format = {}
             for key, value in recipe_data.items():
                 if key == "metadata":
-                    for metadata_key, metadata_value in value.model_dump().items():
+                    # The metadata fields are plain values, they are copied without dumping the model
+                    for metadata_key, metadata_value in value:
                             new_recipe_format[metadata_key] = metadata_value
                 else:
                     new_recipe_format[key] = value
@@ -54,15 +126,153 @@ class PdfInformationExtractionService:
             logger.error(f"Error modifying recipe format: {e}")
             raise ValueError("Invalid recipe data format. Please check the extracted data format.")
 
-    @track("pdf_information_extraction_service.extract_recipe")
-    async def extract_recipe(self, file, recipe_name, recipe):
+    @staticmethod
+    def get_page_count(file_path: Path) -> int:
+        """
+        Count the pages of a PDF file from the `/Count` of its page tree root, the largest count of the `/Pages`
+        nodes. The nodes are searched in the file, then in its compressed object streams (PDF 1.5+).
+        Falls back to counting the page objects, returns 0 if the page count cannot be read.
+        """
+        with open(file_path, 'rb') as file:
+            content = file.read()
+        page_count = _page_tree_count(content)
+        if not page_count:
+            for stream_start in re.finditer(rb"(?<!end)stream\r?\n", content):
+                # Dictionary of the stream, from the start of its object
+                header = content[max(0, stream_start.start() - 1024):stream_start.start()]
+                header = header[header.rfind(b" obj") + 1:]
+                if not re.search(rb"/Type\s*/ObjStm", header) or b"/FlateDecode" not in header:
+                    continue
+                try:
+                    objects = zlib.decompressobj().decompress(content[stream_start.end():])
+                except zlib.error:
+                    continue
+                page_count = max(page_count, _page_tree_count(objects))
+        if not page_count:
+            page_count = len(re.findall(rb"/Type\s*/Page(?![a-zA-Z])", content))
+        return page_count
+
+    def get_file_page_ranges(self, file_path: Path) -> list[tuple[int, int] | None]:
+        """
+        Page ranges of the chunks of a PDF file. Without a page count, the whole document is a single chunk.
+        """
+        page_count = self.get_page_count(file_path)
+        if not page_count:
+            logger.warning(f"Could not read the page count of {file_path}, extracting it as a single chunk.")
+            return [None]
+        return self.get_page_ranges(page_count, settings.EXTRACTION_CHUNK_PAGES)
+
+    @staticmethod
+    def get_page_ranges(page_count: int, pages_per_chunk: int) -> list[tuple[int, int]]:
+        """
+        Split the pages of a document into chunks.
+        :return list[tuple[int, int]]: List of (first page, last page) ranges, 1-indexed and inclusive.
+        """
+        return [
+            (start_page, min(start_page + pages_per_chunk - 1, page_count))
+            for start_page in range(1, page_count + 1, pages_per_chunk)
+        ]
+
+    @staticmethod
+    def _normalize_key(text: str) -> str:
+        return " ".join(re.sub(r"[^\w\s]", " ", (text or "").lower()).split())
+
+    def merge_chunk_recipes(self, recipe_name: str, chunk_results: list) -> PdfContentDataRecipe | TablesAndFiguresRecipe:
+        """
+        Merge the results of a recipe extracted chunk by chunk, in page order.
+        Sections split across chunks are joined, duplicated references, tables and figures are removed.
+
+        :param recipe_name: Name of the chunk recipe.
+        :param chunk_results: Recipe results of the chunks in page order.
+        :return: The merged recipe.
+        """
+        if recipe_name == "content_data":
+            sections = []
+            for chunk_result in chunk_results:
+                for section in chunk_result.sections:
+                    previous_section = sections[-1] if sections else None
+                    if previous_section and self._normalize_key(previous_section.section_title) == self._normalize_key(section.section_title):
+                        if section.section_content not in previous_section.section_content:
+                            previous_section.section_content = f"{previous_section.section_content}\n{section.section_content}"
+                    else:
+                        sections.append(section.model_copy())
+            references = self._dedupe([reference for chunk_result in chunk_results for reference in chunk_result.references],
+                                      key=lambda reference: reference.title)
+            return PdfContentDataRecipe(sections=sections, references=references)
+        if recipe_name == "tables_and_figures":
+            tables = self._dedupe([table for chunk_result in chunk_results for table in chunk_result.tables],
+                                  key=lambda table: table.table_caption)
+            figures = self._dedupe([figure for chunk_result in chunk_results for figure in chunk_result.figures],
+                                   key=lambda figure: figure.caption_of_figure)
+            return TablesAndFiguresRecipe(tables=tables, figures=figures)
+        raise ValueError(f"No merge strategy for recipe '{recipe_name}'.")
+
+    def _dedupe(self, items: list, key) -> list:
+        seen_keys = set()
+        unique_items = []
+        for item in items:
+            item_key = self._normalize_key(key(item))
+            if item_key and item_key in seen_keys:
+                continue
+            seen_keys.add(item_key)
+            unique_items.append(item)
+        return unique_items
+
+    @staticmethod
+    @trace("pdf_information_extraction_service.parse_recipe_response", capture_input=False)
+    def parse_recipe_response(recipe, response_text: str):
+        """
+        Parse and validate the model response of a recipe straight from JSON, without an intermediate dict.
+        The model is asked for a list of recipe objects, the first one is used.
+        :param recipe: The recipe model.
+        :param response_text: JSON text generated by the model.
+        :return: The validated recipe.
+        """
+        return get_recipe_list_adapter(recipe).validate_json(response_text)[0]
+
+    @trace("pdf_information_extraction_service.build_document", capture_input=False)
+    def build_document(self, recipe_data: dict, source_hash: str = None) -> PdfInformationRecipe:
+        """
+        Combine the extracted recipes of a PDF into a PdfInformationRecipe.
+        The recipes are validated when they are parsed, so they are combined without validating them again.
+        :param recipe_data: Extracted recipe data by recipe name.
+        :param source_hash: SHA-256 of the PDF file, used to extract recipes again for the stored document.
+        :return PdfInformationRecipe: Extracted information.
+        """
+        if not recipe_data:
+            raise Exception("No information extracted from the PDF file.")
+        if "metadata" not in recipe_data:
+            raise Exception("Metadata extraction failed. Please check the PDF file format or content.")
+        new_recipe_data = self.modify_recipe_format(recipe_data)
+        new_recipe_data["source_hash"] = source_hash
+        new_recipe_data["recipe_versions"] = {name: type(data).recipe_version for name, data in recipe_data.items()}
+        return PdfInformationRecipe.model_construct(**new_recipe_data)
+
+    @trace("pdf_information_extraction_service.extract_recipe")
+    async def extract_recipe(self, file, recipe_name, recipe, page_range: tuple[int, int] = None,
+                             file_checksum: str = None, page_count: int = None):
+        async def extract():
+            recipe_info = await self.pdf_reader.execute(file, recipe=recipe, page_range=page_range,
+                                                        step=f"{recipe_name}_extraction", page_count=page_count)
+            return self.parse_recipe_response(recipe, recipe_info.text)
+
+        async def extract_cached():
+            cache_key = (file_checksum, recipe_name, recipe.recipe_version, page_range)
+            recipe_result = await self.cache.aget(cache_key, model=recipe)
+            if recipe_result is None:
+                recipe_result = await extract()
+                await self.cache.aset(cache_key, recipe_result)
+            return recipe_result
         try:
-            recipe_info = await self.pdf_reader.execute(file, recipe=recipe)
-            return recipe_name, recipe(**json.loads(recipe_info.text)[0])
+            if file_checksum is None:
+                return recipe_name, await extract()
+            flight_key = ("recipe", file_checksum, recipe_name, page_range)
+            return recipe_name, await self.extraction_flight.ado(flight_key, extract_cached)
         except Exception as e:
             logger.error(f"Error extracting {recipe_name} for {file}: {e}")
+            return recipe_name, None
 
-    @track(name="pdf_information_extraction_service.execute")
+    @trace("pdf_information_extraction_service.execute")
     async def execute(self, file_path: Path) -> PdfInformationRecipe:
         """
         Extracts text/information from the specified PDF file.
@@ -75,48 +285,187 @@ class PdfInformationExtractionService:
         # In a real-world scenario, you might want to use different pre-processing steps, models, or configurations based on the type of PDF or the specific information you want to extract.
         # You can define your workflow here, such as pre-processing the PDF, extracting text, and then using the model to extract information.
         logger.info(f"Starting extraction for file: {file_path}")
-        cloud_uploaded_file = self.pdf_reader.upload_file(file_path)
-        tasks = [self.extract_recipe(cloud_uploaded_file, recipe_name, recipe) for recipe_name, recipe in self.recipes.items()]
-        results = await asyncio.gather(*tasks)
-        recipe_data = {name: data for name, data in results if data is not None}
-        if not recipe_data:
-            raise Exception("No information extracted from the PDF file.")
-        if "metadata" not in recipe_data:
-            raise Exception("Metadata extraction failed. Please check the PDF file format or content.")
-        new_recipe_data = self.modify_recipe_format(recipe_data)
-        extracted_pdf_information = PdfInformationRecipe.model_construct(**new_recipe_data)
+        file_checksum = await asyncio.to_thread(IngestionCheckpointStore.checksum, file_path)
+        cloud_uploaded_file = await self.extraction_flight.ado(
+            ("upload", file_checksum), asyncio.to_thread, self.pdf_reader.upload_file, file_path
+        )
+        if self.chunked:
+            recipe_data = await self.extract_chunked(cloud_uploaded_file, file_path, file_checksum)
+        else:
+            page_count = await asyncio.to_thread(self.get_page_count, file_path)
+            tasks = [self.extract_recipe(cloud_uploaded_file, recipe_name, recipe, file_checksum=file_checksum,
+                                         page_count=page_count)
+                     for recipe_name, recipe in self.recipes.items()]
+            results = await asyncio.gather(*tasks)
+            recipe_data = {name: data for name, data in results if data is not None}
+        extracted_pdf_information = self.build_document(recipe_data, source_hash=file_checksum)
         return extracted_pdf_information
 
-    async def aexecute(self, file_path: Path):
+    @trace("pdf_information_extraction_service.extract_recipes")
+    async def extract_recipes(self, file_path: Path, recipe_names: list[str]) -> dict:
+        """
+        Extract only some recipes of a PDF file, e.g. to backfill a recipe on a stored document.
+        In chunked mode the chunk recipes are extracted for every page range and merged.
+
+        :param file_path: The path to the PDF file.
+        :param recipe_names: Names of the recipes, see DOCUMENT_RECIPES.
+        :return dict: Extracted recipe by recipe name.
+        """
+        unknown_recipes = set(recipe_names) - set(DOCUMENT_RECIPES)
+        if unknown_recipes:
+            raise ValueError(f"Unknown recipe(s) {sorted(unknown_recipes)}. Available recipes: {list(DOCUMENT_RECIPES)}")
+        file_checksum = await asyncio.to_thread(IngestionCheckpointStore.checksum, file_path)
+        cloud_uploaded_file = await self.extraction_flight.ado(
+            ("upload", file_checksum), asyncio.to_thread, self.pdf_reader.upload_file, file_path
+        )
+        page_ranges = [None]
+        page_count = None
+        if self.chunked:
+            page_ranges = await asyncio.to_thread(self.get_file_page_ranges, file_path)
+        else:
+            page_count = await asyncio.to_thread(self.get_page_count, file_path)
+
+        async def extract(recipe_name: str):
+            recipe = DOCUMENT_RECIPES[recipe_name]
+            recipe_page_ranges = page_ranges if recipe_name in self.chunk_recipes else page_ranges[:1]
+            results = await asyncio.gather(*(
+                self.extract_recipe(cloud_uploaded_file, recipe_name, recipe, page_range, file_checksum, page_count)
+                for page_range in recipe_page_ranges
+            ))
+            chunk_results = [data for _, data in results]
+            if any(data is None for data in chunk_results):
+                raise Exception(f"Extraction of {recipe_name} failed for at least one chunk.")
+            if len(chunk_results) == 1:
+                return chunk_results[0]
+            return self.merge_chunk_recipes(recipe_name, chunk_results)
+
+        extracted_recipes = await asyncio.gather(*(extract(recipe_name) for recipe_name in recipe_names))
+        return dict(zip(recipe_names, extracted_recipes))
+
+    @trace("pdf_information_extraction_service.extract_chunked")
+    async def extract_chunked(self, cloud_uploaded_file, file_path: Path, file_checksum: str = None) -> dict:
+        """
+        Map-reduce extraction: the chunk recipes are extracted for every page range in parallel
+        (bounded by the model request limiter) and merged in page order.
+        :param cloud_uploaded_file: The file uploaded to the model service.
+        :param file_path: The path to the PDF file.
+        :param file_checksum: Checksum of the file, identical concurrent extractions are coalesced.
+        :return dict: Extracted recipe data by recipe name.
+        """
+        page_ranges = await asyncio.to_thread(self.get_file_page_ranges, file_path)
+        logger.info(f"Extracting {file_path} in {len(page_ranges)} chunk(s) of {settings.EXTRACTION_CHUNK_PAGES} page(s).")
+
+        tasks = [self.extract_recipe(cloud_uploaded_file, "metadata", self.recipes["metadata"], page_ranges[0],
+                                     file_checksum)]
+        for page_range in page_ranges:
+            tasks.extend(
+                self.extract_recipe(cloud_uploaded_file, recipe_name, recipe, page_range, file_checksum)
+                for recipe_name, recipe in self.chunk_recipes.items()
+            )
+        results = await asyncio.gather(*tasks)
+
+        recipe_data = {}
+        metadata_name, metadata = results[0]
+        if metadata is not None:
+            recipe_data[metadata_name] = metadata
+        for recipe_name in self.chunk_recipes:
+            chunk_results = [data for name, data in results[1:] if name == recipe_name]
+            if any(data is None for data in chunk_results):
+                # A missing chunk would silently drop content, fail the file so that it is retried
+                raise Exception(f"Extraction of {recipe_name} failed for at least one chunk.")
+            recipe_data[recipe_name] = self.merge_chunk_recipes(recipe_name, chunk_results)
+        return recipe_data
+
+    async def aexecute(self, file_path: Path, checkpoint_store: IngestionCheckpointStore) -> PdfInformationRecipe:
         """
         Asynchronously extracts information from the specified PDF file.
-        Wrapper around the execute method to allow for asynchronous execution.
+        Wrapper around the execute method that skips files checkpointed by a previous run,
+        retries failed extractions with exponential backoff and checkpoints the result.
 
         :param file_path: The path to the PDF file.
+        :param checkpoint_store: Checkpoints of the ingestion job.
+        :return PdfInformationRecipe: Extracted information.
+        :raises ExtractionFailed: If the last attempt failed, with the number of attempts.
         """
-        extracted_pdf_information = await self.execute(file_path)
-        return extracted_pdf_information
+        checkpointed_document = await asyncio.to_thread(checkpoint_store.load_document, file_path)
+        if checkpointed_document is not None:
+            logger.info(f"Using checkpointed extraction for file: {file_path}")
+            return checkpointed_document
+
+        for attempt in range(1, settings.EXTRACTION_MAX_ATTEMPTS + 1):
+            try:
+                extracted_pdf_information = await self.execute(file_path)
+                await asyncio.to_thread(checkpoint_store.save_document, file_path, extracted_pdf_information, attempt)
+                return extracted_pdf_information
+            except Exception as e:
+                backoff_seconds = settings.EXTRACTION_RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+                remaining = remaining_time()
+                # Do not retry when the request deadline would expire during the backoff
+                if attempt == settings.EXTRACTION_MAX_ATTEMPTS or (remaining is not None and remaining <= backoff_seconds):
+                    logger.error(f"Extraction failed for {file_path} after {attempt} attempt(s): {e}")
+                    await asyncio.to_thread(checkpoint_store.record_failure, file_path, str(e), attempt)
+                    raise ExtractionFailed(str(e), attempt) from e
+                logger.warning(f"Extraction attempt {attempt} failed for {file_path}, retrying in {backoff_seconds}s: {e}")
+                await asyncio.sleep(backoff_seconds)
+
+    async def _timed_aexecute(self, file_path: Path, checkpoint_store: IngestionCheckpointStore):
+        start_time = time.monotonic()
+        try:
+            result = await self.aexecute(file_path, checkpoint_store)
+        except ExtractionFailed as e:
+            result = e
+        except Exception as e:
+            # Failed before the first attempt, e.g. reading the checkpoint
+            result = ExtractionFailed(str(e), 0)
+        return file_path, result, round((time.monotonic() - start_time) * 1000, 1)
 
-    @track(name="pdf_information_extraction_service.arun")
-    async def arun(self, uploadedFiles: list[Path]) -> list[PdfInformationRecipe]:
+    async def astream(self, uploadedFiles: list[Path], checkpoint_store: IngestionCheckpointStore):
         """
-        Runs the extraction process asynchronously and in parallel for a list of uploaded files.
+        Extracts the uploaded files in parallel, yielding every file as soon as its extraction is finished.
+        A failing file does not affect the other files, its ExtractionFailed is yielded instead of the document.
+        The extractions not finished yet are cancelled when the consumer stops iterating.
+
         :param uploadedFiles: A list of paths to the uploaded PDF files.
-        :return list[PdfInformationRecipe]: A list of extracted information from the PDF files.
+        :param checkpoint_store: Checkpoints of the ingestion job.
+        :return: Async iterator of (file path, PdfInformationRecipe or ExtractionFailed, extraction time in ms),
+                 in completion order.
         """
         logger.info(f"Starting asynchronous extraction for {uploadedFiles}")
-        tasks = [self.aexecute(file) for file in uploadedFiles]
-        results = await asyncio.gather(*tasks, return_exceptions=True)
+        tasks = [asyncio.create_task(self._timed_aexecute(file, checkpoint_store)) for file in uploadedFiles]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
         logger.info("Completed parallel execution for all files.")
-        return results
 
-    @track(name="pdf_information_extraction_service.run")
-    def run(self, uploadedFiles: list[Path])-> list[PdfInformationRecipe]:
+    @trace("pdf_information_extraction_service.arun")
+    async def arun(self, uploadedFiles: list[Path], job_id: str = None) -> IngestionReport:
+        """
+        Runs the extraction process asynchronously and in parallel for a list of uploaded files.
+        A failing file does not affect the other files, it is reported in the failed files of the report.
+        :param uploadedFiles: A list of paths to the uploaded PDF files.
+        :param job_id: Identifier of an interrupted job to resume.
+        :return IngestionReport: Extracted documents, in completion order, and failed files of the job.
+        """
+        checkpoint_store = IngestionCheckpointStore(job_id)
+        documents = []
+        failed_files = []
+        async for file, result, _ in self.astream(uploadedFiles, checkpoint_store):
+            if isinstance(result, ExtractionFailed):
+                failed_files.append(FailedFile(file=str(file), error=str(result), attempts=result.attempts))
+            else:
+                documents.append(result)
+        return IngestionReport(job_id=checkpoint_store.job_id, documents=documents, failed_files=failed_files)
+
+    @trace("pdf_information_extraction_service.run")
+    def run(self, uploadedFiles: list[Path], job_id: str = None) -> IngestionReport:
         """
         Function to call asynchronous function to process all files parallely.
         Entry point for running the information extraction process synchronously.
         :param uploadedFiles: A list of paths to the uploaded PDF files.
-        :return list[PdfInformationRecipe]: A list of extracted information from the PDF files.
+        :param job_id: Identifier of an interrupted job to resume.
+        :return IngestionReport: Extracted documents and failed files of the job.
         """
-        return asyncio.run(self.arun(uploadedFiles))
-
+        return asyncio.run(self.arun(uploadedFiles, job_id))
@@ -0,0 +1,279 @@
+"""
+On-demand profiling of single requests, gated by the admin token.
+
+A request sent with the `X-Profile: true` and `X-Admin-Token` headers is profiled:
+    - a sampling CPU profiler records the stacks of the threads working for the request every
+      settings.PROFILING_SAMPLE_INTERVAL_SECONDS, written as folded stacks (flamegraph.pl, speedscope, ...),
+    - tracemalloc records the peak memory and the top allocation sites,
+    - every tracing span (model calls, code execution, JSON repair, recipe validation, Firestore reads and writes...)
+      is a stage, with its wall and CPU time.
+Profiles are written to settings.PROFILING_DIR, keeping the settings.PROFILING_MAX_PROFILES most recent ones.
+The middleware is only installed when settings.ADMIN_TOKEN is set, and requests without the header run untouched.
+"""
+import contextvars
+import hmac
+import json
+import logging
+import shutil
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from pathlib import Path
+
+from starlette.responses import JSONResponse
+
+from app.settings import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+_active_profile = contextvars.ContextVar("active_profile", default=None)
+# tracemalloc and the sampler are process-wide, so one request is profiled at a time
+_profile_lock = threading.Lock()
+
+PROFILE_HEADER = b"x-profile"
+ADMIN_TOKEN_HEADER = b"x-admin-token"
+TOP_ALLOCATIONS = 25
+
+
+def get_active_profile():
+    """
+    :return RequestProfile: The profile of the current request, None if it is not profiled.
+    """
+    return _active_profile.get()
+
+
+def is_admin_token(token: str | None) -> bool:
+    """
+    Check a token against settings.ADMIN_TOKEN, in constant time. Always False if no admin token is configured.
+    """
+    return (bool(settings.ADMIN_TOKEN) and token is not None
+            and hmac.compare_digest(token.encode("utf-8"), settings.ADMIN_TOKEN.encode("utf-8")))
+
+
+class _Stage:
+    __slots__ = ("name", "thread_id", "start_wall", "start_cpu")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.thread_id = threading.get_ident()
+        self.start_wall = time.perf_counter()
+        self.start_cpu = time.thread_time()
+
+
+class RequestProfile:
+    """
+    Profile of a single request: stage timings, sampled stacks and allocations.
+    """
+    def __init__(self, method: str, path: str):
+        self.profile_id = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.method = method
+        self.path = path
+        self.stages = {}
+        self.stacks = Counter()
+        self.samples = 0
+        self._lock = threading.Lock()
+        # Threads working for the request, with the number of stages they are in
+        self._threads = {}
+        self._stop = threading.Event()
+        self._sampler = None
+        self._start_wall = None
+        self._start_cpu = None
+        self._owns_tracemalloc = False
+
+    def start_stage(self, name: str) -> _Stage:
+        stage = _Stage(name)
+        with self._lock:
+            self._threads[stage.thread_id] = self._threads.get(stage.thread_id, 0) + 1
+        return stage
+
+    def end_stage(self, stage: _Stage):
+        wall = time.perf_counter() - stage.start_wall
+        cpu = time.thread_time() - stage.start_cpu
+        with self._lock:
+            self._threads[stage.thread_id] -= 1
+            if not self._threads[stage.thread_id]:
+                del self._threads[stage.thread_id]
+            totals = self.stages.setdefault(stage.name, {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0})
+            totals["calls"] += 1
+            totals["wall_seconds"] += wall
+            totals["cpu_seconds"] += cpu
+
+    @staticmethod
+    def _folded_stack(frame) -> str:
+        frames = []
+        while frame is not None:
+            code = frame.f_code
+            frames.append(f"{code.co_name} ({Path(code.co_filename).name}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(frames))
+
+    def _sample(self):
+        interval = settings.PROFILING_SAMPLE_INTERVAL_SECONDS
+        while not self._stop.wait(interval):
+            with self._lock:
+                thread_ids = list(self._threads)
+            if not thread_ids:
+                continue
+            frames = sys._current_frames()
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    self.stacks[self._folded_stack(frame)] += 1
+                    self.samples += 1
+
+    def start(self):
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+        # tracemalloc may already be tracing, e.g. with python -X tracemalloc, it is then left running
+        self._owns_tracemalloc = not tracemalloc.is_tracing()
+        if self._owns_tracemalloc:
+            tracemalloc.start(settings.PROFILING_TRACEMALLOC_FRAMES)
+        tracemalloc.reset_peak()
+        self._sampler = threading.Thread(target=self._sample, name=f"profiler-{self.profile_id}", daemon=True)
+        self._sampler.start()
+
+    def stop(self, status_code: int) -> Path:
+        """
+        Stop profiling and write the profile.
+
+        :param status_code: Status code of the response.
+        :return Path: Directory of the profile.
+        """
+        wall = time.perf_counter() - self._start_wall
+        process_cpu = time.process_time() - self._start_cpu
+        self._stop.set()
+        self._sampler.join()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        snapshot = tracemalloc.take_snapshot()
+        if self._owns_tracemalloc:
+            tracemalloc.stop()
+        snapshot = snapshot.filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),))
+        top_allocations = [
+            {"location": str(statistic.traceback[0]), "size_bytes": statistic.size, "count": statistic.count}
+            for statistic in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+        ]
+
+        profile_dir = Path(settings.PROFILING_DIR) / self.profile_id
+        profile_dir.mkdir(parents=True, exist_ok=True)
+        with open(profile_dir / "cpu.folded", "w", encoding="utf-8") as file:
+            file.writelines(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+        summary = {
+            "profile_id": self.profile_id,
+            "method": self.method,
+            "path": self.path,
+            "status_code": status_code,
+            "wall_seconds": round(wall, 6),
+            # CPU of the whole process during the request, other requests included
+            "process_cpu_seconds": round(process_cpu, 6),
+            "samples": self.samples,
+            "sample_interval_seconds": settings.PROFILING_SAMPLE_INTERVAL_SECONDS,
+            "stages": {
+                name: {"calls": totals["calls"], "wall_seconds": round(totals["wall_seconds"], 6),
+                       "cpu_seconds": round(totals["cpu_seconds"], 6)}
+                for name, totals in sorted(self.stages.items(), key=lambda item: -item[1]["wall_seconds"])
+            },
+            "peak_traced_memory_bytes": peak_memory,
+            "top_allocations": top_allocations,
+        }
+        with open(profile_dir / "summary.json", "w", encoding="utf-8") as file:
+            json.dump(summary, file, indent=2)
+        enforce_retention()
+        return profile_dir
+
+
+def enforce_retention(max_profiles: int = None):
+    """
+    Delete the oldest profiles beyond settings.PROFILING_MAX_PROFILES.
+    """
+    max_profiles = max_profiles or settings.PROFILING_MAX_PROFILES
+    profiles_dir = Path(settings.PROFILING_DIR)
+    if not profiles_dir.exists():
+        return
+    profile_dirs = sorted((path for path in profiles_dir.iterdir() if path.is_dir()), key=lambda path: path.name)
+    for profile_dir in profile_dirs[:-max_profiles]:
+        shutil.rmtree(profile_dir, ignore_errors=True)
+
+
+def list_profiles() -> list[dict]:
+    """
+    :return list[dict]: Summaries of the stored profiles, without their allocations, most recent first.
+    """
+    profiles_dir = Path(settings.PROFILING_DIR)
+    if not profiles_dir.exists():
+        return []
+    summaries = []
+    for summary_path in sorted(profiles_dir.glob("*/summary.json"), reverse=True):
+        with open(summary_path, encoding="utf-8") as file:
+            summary = json.load(file)
+        summary.pop("top_allocations", None)
+        summaries.append(summary)
+    return summaries
+
+
+def load_profile(profile_id: str) -> dict | None:
+    """
+    :return dict: Summary of a profile with its folded stacks, None if it does not exist.
+    """
+    profile_dir = Path(settings.PROFILING_DIR) / profile_id
+    if profile_dir.name != profile_id or not (profile_dir / "summary.json").exists():
+        return None
+    with open(profile_dir / "summary.json", encoding="utf-8") as file:
+        summary = json.load(file)
+    summary["cpu_folded"] = (profile_dir / "cpu.folded").read_text(encoding="utf-8")
+    return summary
+
+
+class ProfilingMiddleware:
+    """
+    ASGI middleware profiling the requests sent with `X-Profile: true` and a valid `X-Admin-Token`.
+    The profile id is returned in the `X-Profile-Id` response header.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers", []))
+        if headers.get(PROFILE_HEADER, b"").lower() not in (b"1", b"true"):
+            await self.app(scope, receive, send)
+            return
+        if not is_admin_token(headers.get(ADMIN_TOKEN_HEADER, b"").decode("latin-1")):
+            await JSONResponse(status_code=403, content={"detail": "Profiling requires a valid admin token."})(
+                scope, receive, send)
+            return
+        if not _profile_lock.acquire(blocking=False):
+            await JSONResponse(status_code=409, content={"detail": "Another request is being profiled."},
+                               headers={"Retry-After": "5"})(scope, receive, send)
+            return
+
+        profile = RequestProfile(scope.get("method"), scope.get("path"))
+        status_code = 500
+
+        async def send_with_profile_id(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                message = {**message, "headers": [*message.get("headers", []),
+                                                  (b"x-profile-id", profile.profile_id.encode("latin-1"))]}
+            await send(message)
+
+        # Stacks are sampled in the threads running a traced stage, not in the event loop serving other requests
+        token = _active_profile.set(profile)
+        try:
+            profile.start()
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            _active_profile.reset(token)
+            try:
+                profile_dir = profile.stop(status_code)
+                logger.info(f"Profile of {profile.method} {profile.path} written to {profile_dir}.")
+            except Exception as e:
+                logger.error(f"Error writing the profile of {profile.method} {profile.path}: {e}")
+            finally:
+                _profile_lock.release()
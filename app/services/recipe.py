@@ -1,4 +1,7 @@
-from pydantic import BaseModel
+from functools import lru_cache
+from typing import ClassVar
+
+from pydantic import BaseModel, TypeAdapter
 
 class ReferenceRecipe(BaseModel):
     title: str
@@ -19,27 +22,72 @@ class FigureRecipe(BaseModel):
     caption_of_figure: str
     figure_description: str
 
+# Recipes extracted from the PDFs carry a version, stored per document. Bump it when the fields or the prompt
+# of a recipe change, the outdated documents are then backfilled with app/services/recipe_backfill.py.
+
 class PdfContentDataRecipe(BaseModel):
+    recipe_version: ClassVar[int] = 1
     references: list[ReferenceRecipe]
     sections: list[SectionRecipe]
 
 class TablesAndFiguresRecipe(BaseModel):
+    recipe_version: ClassVar[int] = 1
     tables: list[TableRecipe]
     figures: list[FigureRecipe]
 
 class PdfMetaDataRecipe(BaseModel):
+    recipe_version: ClassVar[int] = 1
+    title: str
+    authors: list[str]
+    publication_date: str
+    abstract: str
+
+class PaperDigestRecipe(BaseModel):
+    summary: str
+    key_contributions: list[str]
+    methods: list[str]
+    datasets: list[str]
+    metrics: list[str]
+
+# Index document of a stored paper, the schema the db_agent queries. Sections, references, tables and figures are
+# stored in sub-collections of the index document, `part_counts` holds the number of items of each of them.
+class PdfIndexRecipe(BaseModel):
     title: str
     authors: list[str]
     publication_date: str
     abstract: str
+    part_counts: dict[str, int]
+    digest: PaperDigestRecipe | None = None
+    recipe_versions: dict[str, int] | None = None
 
 class PdfInformationRecipe(BaseModel):
     title: str
     authors: list[str]
     publication_date: str
     abstract: str
-    content_data: PdfContentDataRecipe
-    tables_and_figures: TablesAndFiguresRecipe
+    content_data: PdfContentDataRecipe | None = None
+    tables_and_figures: TablesAndFiguresRecipe | None = None
+    digest: PaperDigestRecipe | None = None
+    # Fingerprint of the document content the digest was generated from
+    digest_fingerprint: str | None = None
+    # SHA-256 of the PDF file the document was extracted from, and version of every extracted recipe
+    source_hash: str | None = None
+    recipe_versions: dict[str, int] | None = None
+
+# Recipes of a document by field of PdfInformationRecipe, the metadata fields are stored at the top level
+DOCUMENT_RECIPES = {
+    "metadata": PdfMetaDataRecipe,
+    "content_data": PdfContentDataRecipe,
+    "tables_and_figures": TablesAndFiguresRecipe,
+}
+
+@lru_cache
+def get_recipe_list_adapter(recipe: type[BaseModel]) -> TypeAdapter:
+    """
+    Get the adapter validating the JSON output of the model, a list of recipe objects, straight from JSON.
+    Adapters are built once per recipe.
+    """
+    return TypeAdapter(list[recipe])
 
 if __name__ == "__main__":
     import json
@@ -0,0 +1,260 @@
+"""
+Backfill of a recipe over the stored documents.
+
+Every stored document records the SHA-256 of its PDF file (`source_hash`) and the version of every recipe it was
+extracted with (`recipe_versions`). When a recipe is enabled, or its `recipe_version` is bumped in
+app/services/recipe.py, the backfill finds the documents missing the recipe or extracted with an older version,
+extracts only that recipe from their PDF and patches only its fields in the database, instead of re-ingesting
+every paper with every recipe.
+
+The PDF of a document is read from a directory of files matched by content (`--files`), or from the blob store
+while it still holds the file. Documents stored before their source was recorded are matched to the other files of
+`--files` by file name, then by the title extracted with the metadata recipe, and their hash is recorded.
+"""
+import asyncio
+import logging
+import time
+import uuid
+from pathlib import Path
+
+from app.settings import get_settings
+from app.services.blob_store import get_blob_store
+from app.services.checkpoint_service import IngestionCheckpointStore
+from app.services.citation_graph import get_citation_graph_store, normalize_title
+from app.services.recipe import DOCUMENT_RECIPES
+from app.services.table_store import get_table_store
+from app.services.tracing import trace
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# The metadata recipe is not backfilled: the title is the identifier of the stored document
+BACKFILL_RECIPES = ("content_data", "tables_and_figures")
+
+
+class RecipeBackfillService:
+    """
+    Targeted re-extraction of one recipe for the stored documents that are missing it or outdated.
+    Documents are extracted concurrently (settings.RECIPE_BACKFILL_MAX_CONCURRENCY), and every model call goes
+    through the process-wide model request limiter, like the ingestion. A document whose extraction fails keeps
+    its previous version and is backfilled by the next run.
+    """
+
+    def __init__(self, db_service=None, extraction_service=None, blob_store=None):
+        """
+        :param db_service: DatabaseService of the stored documents. Created on first use if not provided.
+        :param extraction_service: PdfInformationExtractionService extracting the recipe. Created on first use
+                                   if not provided.
+        :param blob_store: Store of the uploaded files. Defaults to the process-wide blob store.
+        """
+        self.db_service = db_service
+        self.extraction_service = extraction_service
+        self.blob_store = blob_store or get_blob_store()
+
+    def _get_db_service(self):
+        if self.db_service is None:
+            from app.services.service_factory import get_database_service
+            self.db_service = get_database_service()
+        return self.db_service
+
+    def _get_extraction_service(self):
+        if self.extraction_service is None:
+            from app.services.service_factory import get_pdf_information_extraction_service
+            self.extraction_service = get_pdf_information_extraction_service()
+        return self.extraction_service
+
+    @staticmethod
+    def _validate_recipe(recipe_name: str):
+        if recipe_name not in BACKFILL_RECIPES:
+            raise ValueError(f"Recipe '{recipe_name}' cannot be backfilled. Available recipes: {list(BACKFILL_RECIPES)}")
+
+    def plan(self, recipe_name: str, force: bool = False) -> list:
+        """
+        Find the stored documents to backfill. Only the index documents are read.
+
+        :param recipe_name: Name of the recipe, one of BACKFILL_RECIPES.
+        :param force: Backfill every document, even if its recipe is up to date.
+        :return list[LazyPdfDocument]: Documents missing the recipe or extracted with an older version.
+        """
+        self._validate_recipe(recipe_name)
+        version = DOCUMENT_RECIPES[recipe_name].recipe_version
+        return [document for document in self._get_db_service().get_documents()
+                if force or document.recipe_versions.get(recipe_name, 0) < version]
+
+    @staticmethod
+    def index_files(files_dir: str) -> dict[str, Path]:
+        """
+        :return dict: Path of the PDF files of a directory and its sub-directories by SHA-256.
+        """
+        return {IngestionCheckpointStore.checksum(path): path for path in sorted(Path(files_dir).rglob("*.pdf"))}
+
+    def _source_path(self, document, files: dict[str, Path], job_id: str) -> Path | None:
+        """
+        Find the PDF file of a document. A file of the blob store is referenced by the backfill job,
+        so it is not collected while it is extracted.
+        """
+        source_hash = document.source_hash
+        if source_hash is None:
+            return None
+        if source_hash in files:
+            return files[source_hash]
+        try:
+            self.blob_store.add_ref(source_hash, job_id, name=document.title)
+        except ValueError:
+            return None
+        return self.blob_store.path(source_hash)
+
+    async def _identify_files(self, documents: list, files: dict[str, Path], counts: dict,
+                              dry_run: bool) -> dict[str, Path]:
+        """
+        Match the PDF files of a directory to the documents stored without source_hash, whose file cannot be found
+        by content: by file name first, then by the title extracted with the metadata recipe (cached by content).
+        The hash of a matched file is recorded on its document.
+
+        :param documents: Documents to backfill.
+        :param files: Path of the PDF files by SHA-256.
+        :param counts: Counts of the run, updated with the identified files.
+        :param dry_run: Only match the file names, and count the files to identify with the metadata recipe.
+        :return dict: Path and SHA-256 of the matched file by document title.
+        """
+        unhashed = {normalize_title(document.title): document.title for document in documents
+                    if document.source_hash is None and document.title}
+        known_hashes = {document.source_hash for document in documents}
+        candidates = {source_hash: path for source_hash, path in files.items() if source_hash not in known_hashes}
+        if not unhashed or not candidates:
+            return {}
+
+        matches = {}
+        for source_hash, path in list(candidates.items()):
+            title = unhashed.pop(normalize_title(path.stem), None)
+            if title is not None:
+                matches[title] = (path, source_hash)
+                del candidates[source_hash]
+        if unhashed and candidates:
+            if dry_run:
+                counts["files_to_identify"] = len(candidates)
+            else:
+                semaphore = asyncio.Semaphore(settings.RECIPE_BACKFILL_MAX_CONCURRENCY)
+
+                async def extract_title(path: Path) -> str:
+                    async with semaphore:
+                        extracted_recipes = await self._get_extraction_service().extract_recipes(path, ["metadata"])
+                        return extracted_recipes["metadata"].title
+
+                titles = await asyncio.gather(*(extract_title(path) for path in candidates.values()),
+                                              return_exceptions=True)
+                for (source_hash, path), title in zip(candidates.items(), titles):
+                    if isinstance(title, BaseException):
+                        logger.error(f"Error extracting the title of {path}: {title}")
+                        continue
+                    title = unhashed.pop(normalize_title(title), None)
+                    if title is not None:
+                        matches[title] = (path, source_hash)
+
+        counts["identified_files"] = len(matches)
+        if not dry_run:
+            for title, (_, source_hash) in matches.items():
+                await asyncio.to_thread(self._get_db_service().set_source_hash, title, source_hash)
+        return {title: path for title, (path, _) in matches.items()}
+
+    async def _backfill_document(self, title: str, source_path: Path, recipe_name: str, semaphore: asyncio.Semaphore):
+        async with semaphore:
+            extracted_recipes = await self._get_extraction_service().extract_recipes(source_path, [recipe_name])
+            data = extracted_recipes[recipe_name].model_dump()
+            version = DOCUMENT_RECIPES[recipe_name].recipe_version
+            await asyncio.to_thread(self._get_db_service().patch_recipe, title, recipe_name, data, version)
+            # Stores derived from the recipe are updated with the new fields only
+            patched_document = {"title": title, recipe_name: data}
+            if recipe_name == "content_data":
+                await asyncio.to_thread(get_citation_graph_store().add_papers, [patched_document])
+            elif recipe_name == "tables_and_figures":
+                await asyncio.to_thread(get_table_store().add_documents, [patched_document])
+
+    async def arun(self, recipe_name: str, files_dir: str = None, force: bool = False, limit: int = None,
+                   dry_run: bool = False) -> dict:
+        """
+        Backfill a recipe over the stored documents missing it or extracted with an older version.
+
+        :param recipe_name: Name of the recipe, one of BACKFILL_RECIPES.
+        :param files_dir: Directory of the PDF files of the documents, matched by content, or by file name and title
+                          for the documents stored before their source was recorded.
+        :param force: Backfill every document, even if its recipe is up to date.
+        :param limit: Maximum number of documents to backfill.
+        :param dry_run: Only find the documents to backfill and their files.
+        :return dict: Counts of the outdated, backfilled and failed documents, and of those without PDF file.
+        """
+        start_time = time.monotonic()
+        documents = await asyncio.to_thread(self.plan, recipe_name, force)
+        counts = {"recipe": recipe_name, "version": DOCUMENT_RECIPES[recipe_name].recipe_version,
+                  "outdated": len(documents), "missing_file": 0, "backfilled": 0, "failed": 0}
+        if limit is not None:
+            documents = documents[:limit]
+        files = await asyncio.to_thread(self.index_files, files_dir) if files_dir else {}
+
+        identified_files = await self._identify_files(documents, files, counts, dry_run)
+
+        job_id = f"backfill-{uuid.uuid4().hex}"
+        try:
+            sources = {}
+            for document in documents:
+                source_path = identified_files.get(document.title) or self._source_path(document, files, job_id)
+                if source_path is None:
+                    logger.warning(f"No PDF file found for '{document.title}', upload it again to backfill {recipe_name}.")
+                    counts["missing_file"] += 1
+                else:
+                    sources[document.title] = source_path
+            if dry_run:
+                counts["to_backfill"] = len(sources)
+                return counts
+
+            logger.info(f"Backfilling {recipe_name} for {len(sources)} document(s).")
+            semaphore = asyncio.Semaphore(settings.RECIPE_BACKFILL_MAX_CONCURRENCY)
+            results = await asyncio.gather(
+                *(self._backfill_document(title, source_path, recipe_name, semaphore)
+                  for title, source_path in sources.items()),
+                return_exceptions=True,
+            )
+        finally:
+            self.blob_store.release(job_id)
+
+        for title, result in zip(sources, results):
+            if isinstance(result, BaseException):
+                logger.error(f"Error backfilling {recipe_name} for '{title}': {result}")
+                counts["failed"] += 1
+            else:
+                counts["backfilled"] += 1
+        counts["elapsed_seconds"] = round(time.monotonic() - start_time, 1)
+        return counts
+
+    @trace("recipe_backfill.run")
+    def run(self, recipe_name: str, files_dir: str = None, force: bool = False, limit: int = None,
+            dry_run: bool = False) -> dict:
+        """
+        Synchronous entry point of `arun`.
+        """
+        return asyncio.run(self.arun(recipe_name, files_dir=files_dir, force=force, limit=limit, dry_run=dry_run))
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Extract a recipe for the stored documents missing it or "
+                                                 "extracted with an older version of the recipe.")
+    parser.add_argument("--recipe", required=True, choices=BACKFILL_RECIPES)
+    parser.add_argument("--files", help="Directory of the PDF files, matched to the documents by content. "
+                                        "Files still in the blob store are used otherwise.")
+    parser.add_argument("--force", action="store_true", help="Backfill every document, even if its recipe is up to date.")
+    parser.add_argument("--limit", type=int, help="Maximum number of documents to backfill.")
+    parser.add_argument("--dry-run", action="store_true", help="Only count the documents to backfill.")
+    parser.add_argument("--chunked", action="store_true",
+                        help="Extract the recipe chunk by chunk, e.g. the full content of long papers.")
+    args = parser.parse_args()
+
+    extraction_service = None
+    if args.chunked:
+        from app.services.pdf_information_extraction_service import PdfInformationExtractionService
+        extraction_service = PdfInformationExtractionService(chunked=True)
+    backfill_service = RecipeBackfillService(extraction_service=extraction_service)
+    print(json.dumps(backfill_service.run(args.recipe, files_dir=args.files, force=args.force, limit=args.limit,
+                                          dry_run=args.dry_run)))
@@ -0,0 +1,100 @@
+import gzip
+import logging
+from pathlib import Path
+
+import orjson
+from fastapi import Request
+from fastapi.responses import Response
+from pydantic import BaseModel
+
+from app.settings import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+def _default(value):
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, Path):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content) -> bytes:
+    """
+    Serialize content to JSON bytes with orjson.
+    Pydantic models are dumped, but callers should pass dicts dumped once and reused.
+    """
+    return orjson.dumps(content, default=_default)
+
+
+def parse_fields(fields: str | None) -> list[str] | None:
+    """
+    Parse a `fields=` projection parameter, e.g. "title,authors,tables_and_figures.tables".
+    """
+    if not fields:
+        return None
+    return [field.strip() for field in fields.split(",") if field.strip()]
+
+
+def project(data: dict, fields: list[str] | None) -> dict:
+    """
+    Keep only the requested fields of a dict. Nested fields are selected with dotted paths.
+
+    :param data: The dict to project.
+    :param fields: Field paths to keep, all fields are kept if not provided.
+    :return dict: The projected dict, sharing its values with data.
+    """
+    if not fields:
+        return data
+    projected = {}
+    for field in fields:
+        source, target = data, projected
+        *parents, leaf = field.split(".")
+        for parent in parents:
+            source = source.get(parent) if isinstance(source, dict) else None
+            if source is None:
+                break
+            target = target.setdefault(parent, {})
+        if isinstance(source, dict) and leaf in source:
+            target[leaf] = source[leaf]
+    return projected
+
+
+class FastJSONResponse(Response):
+    """
+    JSON response rendered with `dumps`, optionally gzip-compressed.
+    """
+    media_type = "application/json"
+
+    def __init__(self, content, status_code: int = 200, headers: dict = None, compress: bool = False):
+        """
+        :param content: JSON serializable content, preferably plain dicts and lists.
+        :param compress: Gzip the body if it is larger than settings.RESPONSE_GZIP_MIN_BYTES.
+        """
+        self.compress = compress
+        self.compressed = False
+        super().__init__(content, status_code=status_code, headers=headers)
+        if self.compressed:
+            self.headers["content-encoding"] = "gzip"
+            self.headers["vary"] = "Accept-Encoding"
+
+    def render(self, content) -> bytes:
+        body = dumps(content)
+        if self.compress and len(body) >= settings.RESPONSE_GZIP_MIN_BYTES:
+            body = gzip.compress(body, compresslevel=settings.RESPONSE_GZIP_LEVEL)
+            self.compressed = True
+        return body
+
+
+def json_response(content, request: Request = None, status_code: int = 200) -> FastJSONResponse:
+    """
+    Build a FastJSONResponse, compressed if the client accepts gzip.
+
+    :param content: JSON serializable content.
+    :param request: The request, used to check the Accept-Encoding header.
+    :param status_code: HTTP status code.
+    """
+    accepts_gzip = request is not None and "gzip" in request.headers.get("accept-encoding", "")
+    return FastJSONResponse(content, status_code=status_code, compress=accepts_gzip)
@@ -0,0 +1,112 @@
+"""
+Factories of the application services.
+
+The service modules import heavy SDKs (google-genai, firebase-admin) at module level.
+The API routes create services only through these factories, so the SDKs are imported on first use
+(or by the warm-up at startup) instead of when the application module is imported.
+"""
+import importlib
+import logging
+import threading
+import time
+
+from app.settings import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+def get_upload_pdf_service():
+    from app.services.upload_pdf_service import UploadPdfService
+    return UploadPdfService()
+
+
+def get_pdf_information_extraction_service():
+    from app.services.pdf_information_extraction_service import PdfInformationExtractionService
+    return PdfInformationExtractionService()
+
+
+def get_batch_ingestion_service():
+    from app.services.batch_ingestion_service import BatchIngestionService
+    return BatchIngestionService()
+
+
+def get_paper_digest_service():
+    from app.services.paper_digest_service import PaperDigestService
+    return PaperDigestService()
+
+
+def get_database_service():
+    from app.services.db_service import DatabaseService
+    return DatabaseService()
+
+
+def get_chatbot_service():
+    from app.services.chatbot_service import ChatbotService
+    return ChatbotService()
+
+
+class ServiceReadiness:
+    """
+    Tracks the warm-up of the subsystems: SDK imports and client creation.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started_at = None
+        self.finished_at = None
+        self.subsystems = {"model": "pending", "database": "pending", "agents": "pending"}
+        self.errors = {}
+
+    def set_status(self, subsystem: str, status: str, error: str = None):
+        with self._lock:
+            self.subsystems[subsystem] = status
+            if error:
+                self.errors[subsystem] = error
+
+    @property
+    def is_ready(self) -> bool:
+        return all(status == "ready" for status in self.subsystems.values())
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "ready": self.is_ready,
+                "subsystems": dict(self.subsystems),
+                "errors": dict(self.errors),
+                "warm_up_seconds": round(self.finished_at - self.started_at, 3) if self.finished_at else None,
+            }
+
+
+readiness = ServiceReadiness()
+
+
+def warm_up():
+    """
+    Import the service modules and create their clients, so that the first requests do not pay for it.
+    Each subsystem is warmed independently, a missing setting only affects its own subsystem.
+    """
+    readiness.started_at = time.monotonic()
+    steps = {
+        "model": lambda: get_pdf_information_extraction_service(),
+        "database": lambda: get_database_service(),
+        "agents": lambda: importlib.import_module("app.services.chatbot_service"),
+    }
+    for subsystem, step in steps.items():
+        readiness.set_status(subsystem, "warming")
+        try:
+            step()
+            readiness.set_status(subsystem, "ready")
+        except Exception as e:
+            logger.error(f"Warm-up of the {subsystem} subsystem failed: {e}")
+            readiness.set_status(subsystem, "failed", str(e))
+    readiness.finished_at = time.monotonic()
+    logger.info(f"Warm-up finished: {readiness.to_dict()}")
+
+
+def start_warm_up() -> threading.Thread:
+    """
+    Run the warm-up in a background thread.
+    """
+    thread = threading.Thread(target=warm_up, name="service-warm-up", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,286 @@
+import contextvars
+import json
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache
+
+from app.settings import get_settings
+from app.services.metrics import metrics_registry
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Chat session of the request being processed. Context variables follow the request into the code
+# generated by the db_agent, which runs in the request thread, so the database service can use its cache.
+_active_session = contextvars.ContextVar("active_chat_session", default=None)
+# Cache key of the scan of the whole collection
+ALL_DOCUMENTS_KEY = "__all_documents__"
+
+
+def _summarize(text: str, max_chars: int) -> str:
+    text = " ".join(str(text).split())
+    return text if len(text) <= max_chars else text[:max_chars - 3] + "..."
+
+
+class ChatSession:
+    """
+    Server-side state of a conversation: summarised turns and the documents retrieved so far.
+    Documents are cached as the lazy proxies returned by the database service, with the parts they loaded,
+    so a follow-up question reads them from memory instead of Firestore.
+    """
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        # Guards the cached documents, held only while they are read or updated
+        self.lock = threading.RLock()
+        # Serialises the requests of the session, so that turns are recorded in order
+        self.request_lock = threading.Lock()
+        self.created_at = time.time()
+        self.last_access = time.monotonic()
+        self.turns = []
+        # Summary of the turns older than settings.SESSION_MAX_TURNS
+        self.earlier_turns_summary = ""
+        self.documents = OrderedDict()
+        self.document_scans = {}
+        self.stats = {"document_hits": 0, "document_misses": 0, "evicted_documents": 0}
+
+    def add_turn(self, query: str, response: str):
+        """
+        Record a turn, summarised to settings.SESSION_TURN_SUMMARY_CHARS characters.
+        The oldest turns are folded into a one-line summary when there are more than settings.SESSION_MAX_TURNS.
+        """
+        self.turns.append({
+            "query": _summarize(query, settings.SESSION_TURN_SUMMARY_CHARS),
+            "response": _summarize(response, settings.SESSION_TURN_SUMMARY_CHARS),
+        })
+        while len(self.turns) > settings.SESSION_MAX_TURNS:
+            oldest_turn = self.turns.pop(0)
+            self.earlier_turns_summary = _summarize(
+                f"{self.earlier_turns_summary} Asked: {oldest_turn['query']}",
+                settings.SESSION_TURN_SUMMARY_CHARS,
+            )
+
+    def history_message(self) -> str:
+        """
+        :return str: The conversation so far, to add to the context of the agents.
+        """
+        if not self.turns and not self.earlier_turns_summary:
+            return ""
+        lines = ["Conversation History:"]
+        if self.earlier_turns_summary:
+            lines.append(f"Earlier: {self.earlier_turns_summary}")
+        for turn in self.turns:
+            lines.append(f"User: {turn['query']}")
+            lines.append(f"Assistant: {turn['response']}")
+        return "\n".join(lines) + "\n"
+
+    def documents_message(self) -> str:
+        """
+        :return str: Titles of the documents retrieved so far, to add to the context of the db_agent.
+        """
+        if not self.documents:
+            return ""
+        return ("Documents retrieved earlier in this conversation, cached in memory "
+                f"(use db_service.get_document(title) to reuse them): {json.dumps(list(self.documents), ensure_ascii=False)}\n")
+
+    def get_document(self, title: str):
+        with self.lock:
+            document = self.documents.get(title)
+            if document is None:
+                self.stats["document_misses"] += 1
+                return None
+            self.documents.move_to_end(title)
+            self.stats["document_hits"] += 1
+            return document
+
+    def put_documents(self, documents: list):
+        with self.lock:
+            for document in documents:
+                if document.title:
+                    self.documents[document.title] = document
+                    self.documents.move_to_end(document.title)
+
+    def get_scan(self, key: str) -> list | None:
+        with self.lock:
+            titles = self.document_scans.get(key)
+            if titles is None or any(title not in self.documents for title in titles):
+                self.stats["document_misses"] += 1
+                return None
+            self.stats["document_hits"] += 1
+            return [self.documents[title] for title in titles]
+
+    def put_scan(self, key: str, documents: list):
+        with self.lock:
+            self.put_documents(documents)
+            self.document_scans[key] = [document.title for document in documents if document.title]
+
+    def size_bytes(self) -> int:
+        """
+        Estimated memory of the session: turns and cached documents with their loaded parts.
+        """
+        with self.lock:
+            size = len(json.dumps(self.turns, ensure_ascii=False)) + len(self.earlier_turns_summary)
+            return size + sum(document.estimated_size() for document in self.documents.values())
+
+    def enforce_memory_cap(self, max_bytes: int) -> int:
+        """
+        Evict the least recently used documents until the session fits in max_bytes.
+
+        :return int: Number of evicted documents.
+        """
+        evicted_titles = set()
+        with self.lock:
+            # The size is computed once, then decreased by the size of each evicted document
+            size = self.size_bytes()
+            while self.documents and size > max_bytes:
+                title, document = self.documents.popitem(last=False)
+                size -= document.estimated_size()
+                evicted_titles.add(title)
+            if evicted_titles:
+                self.document_scans = {key: titles for key, titles in self.document_scans.items()
+                                       if evicted_titles.isdisjoint(titles)}
+            self.stats["evicted_documents"] += len(evicted_titles)
+        return len(evicted_titles)
+
+
+class SessionStore:
+    """
+    In-process store of chat sessions, with TTL and LRU eviction.
+    Sessions expire settings.SESSION_TTL_SECONDS after their last request, the least recently used session
+    is evicted beyond settings.SESSION_MAX_SESSIONS, and each session is capped to settings.SESSION_MAX_BYTES.
+    Sessions live in the worker process that created them: with several uvicorn workers,
+    route the requests of a session to the same worker (sticky sessions).
+    """
+    def __init__(self, ttl_seconds: float = None, max_sessions: int = None, max_session_bytes: int = None):
+        self.ttl_seconds = settings.SESSION_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.max_sessions = max_sessions or settings.SESSION_MAX_SESSIONS
+        self.max_session_bytes = max_session_bytes or settings.SESSION_MAX_BYTES
+        self._lock = threading.Lock()
+        self._sessions = OrderedDict()
+        self._stats = {"created": 0, "expired": 0, "evicted": 0, "unknown": 0, "evicted_documents": 0}
+        # Document cache hits and misses of the sessions that no longer exist
+        self._retired_stats = {"document_hits": 0, "document_misses": 0}
+
+    def _retire(self, session: ChatSession):
+        for stat in self._retired_stats:
+            self._retired_stats[stat] += session.stats[stat]
+
+    def _evict_expired(self):
+        now = time.monotonic()
+        for session_id, session in list(self._sessions.items()):
+            if now - session.last_access > self.ttl_seconds:
+                self._retire(self._sessions.pop(session_id))
+                self._stats["expired"] += 1
+
+    def create(self) -> ChatSession:
+        """
+        Create a session with a new random identifier.
+
+        :return ChatSession: The session.
+        """
+        with self._lock:
+            self._evict_expired()
+            session = ChatSession(uuid.uuid4().hex)
+            self._sessions[session.session_id] = session
+            self._stats["created"] += 1
+            while len(self._sessions) > self.max_sessions:
+                self._retire(self._sessions.popitem(last=False)[1])
+                self._stats["evicted"] += 1
+            return session
+
+    def get(self, session_id: str) -> ChatSession | None:
+        """
+        Get a session created by this store.
+
+        :param session_id: Identifier returned by create.
+        :return ChatSession: The session, None if it does not exist, has expired or was evicted.
+        """
+        with self._lock:
+            self._evict_expired()
+            session = self._sessions.get(session_id)
+            if session is None:
+                self._stats["unknown"] += 1
+                return None
+            session.last_access = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is not None:
+                self._retire(session)
+            return session is not None
+
+    def release(self, session: ChatSession):
+        """
+        End a request of a session: enforce its memory cap and refresh its TTL.
+        """
+        evicted = session.enforce_memory_cap(self.max_session_bytes)
+        with self._lock:
+            session.last_access = time.monotonic()
+            self._stats["evicted_documents"] += evicted
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            sessions = list(self._sessions.values())
+            stats = dict(self._stats)
+            document_stats = dict(self._retired_stats)
+        for session in sessions:
+            for stat in document_stats:
+                document_stats[stat] += session.stats[stat]
+        return {
+            **stats,
+            **document_stats,
+            "active": len(sessions),
+            "cached_documents": sum(len(session.documents) for session in sessions),
+        }
+
+
+@lru_cache
+def get_session_store() -> SessionStore:
+    """
+    Get the process-wide chat session store.
+    """
+    session_store = SessionStore()
+    metrics_registry.register("sessions", session_store.to_dict)
+    return session_store
+
+
+def get_active_session() -> ChatSession | None:
+    """
+    :return ChatSession: The session of the current request, None for a request without session.
+    """
+    return _active_session.get()
+
+
+@contextmanager
+def use_session(session: ChatSession):
+    """
+    Make a session the active session of the current request.
+    Requests of the same session are serialised by its request lock, so that turns are recorded in order.
+    Requests of other sessions and the store are not blocked.
+    """
+    with session.request_lock:
+        token = _active_session.set(session)
+        try:
+            yield session
+        finally:
+            _active_session.reset(token)
+            get_session_store().release(session)
+
+
+@contextmanager
+def use_document_cache(cache: ChatSession):
+    """
+    Share the document cache of a session with the current thread, without its lock or its history.
+    Used by the queries of a batch, which run concurrently and fetch overlapping documents.
+    """
+    token = _active_session.set(cache)
+    try:
+        yield cache
+    finally:
+        _active_session.reset(token)
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from functools import lru_cache
+
+from app.services.metrics import metrics_registry
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent computations.
+    The first caller of a key (the leader) runs the computation, callers arriving while it is running
+    (the followers) wait for it and share its result or exception. Nothing is cached: once the computation
+    finishes, the next caller starts a new one.
+
+    The in-flight computations are shared across threads and event loops, as API requests run
+    in the threadpool and every extraction run has its own event loop.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._in_flight = {}
+        self._stats = {"leaders": 0, "followers": 0}
+
+    def _join(self, key) -> tuple[Future, bool]:
+        with self._lock:
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._stats["followers"] += 1
+                return future, False
+            future = Future()
+            self._in_flight[key] = future
+            self._stats["leaders"] += 1
+            return future, True
+
+    def _finish(self, key, future: Future, result=None, exception: BaseException = None):
+        with self._lock:
+            self._in_flight.pop(key, None)
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+
+    def do(self, key, function, *args, **kwargs):
+        """
+        Run a blocking computation, or wait for the identical one already running.
+
+        :param key: Hashable key identifying the computation.
+        :param function: The computation.
+        :return: Result of the computation.
+        """
+        future, is_leader = self._join(key)
+        if not is_leader:
+            logger.info(f"Joining in-flight {self.name} computation.")
+            return future.result()
+        try:
+            result = function(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, future, exception=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    async def ado(self, key, coroutine_function, *args, **kwargs):
+        """
+        Run a coroutine, or await the identical computation already running, possibly in another event loop.
+
+        :param key: Hashable key identifying the computation.
+        :param coroutine_function: Function returning the coroutine to run.
+        :return: Result of the computation.
+        """
+        future, is_leader = self._join(key)
+        if not is_leader:
+            logger.info(f"Joining in-flight {self.name} computation.")
+            return await asyncio.wrap_future(future)
+        try:
+            result = await coroutine_function(*args, **kwargs)
+        except BaseException as e:
+            self._finish(key, future, exception=e)
+            raise
+        self._finish(key, future, result=result)
+        return result
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._in_flight)}
+
+
+@lru_cache
+def get_single_flight(name: str) -> SingleFlight:
+    """
+    Get the process-wide single-flight group of a kind of computation, e.g. "chatbot" or "extraction".
+    """
+    single_flight = SingleFlight(name)
+    metrics_registry.register(f"single_flight_{name}", single_flight.to_dict)
+    return single_flight
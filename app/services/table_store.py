@@ -0,0 +1,522 @@
+"""
+Typed store of the tables extracted from the papers, for numeric questions across papers.
+
+At ingest time, the free-form `table_content` of every extracted table is parsed into a frame: a header of
+normalised column names and units, and typed columns (numbers or text). Numeric cells are stored one value per row
+in a local SQLite database, with the caption, the row label and the text of their row, so questions like "best
+accuracy on dataset Z across papers" are one indexed query instead of the model reading every table.
+
+    tables        paper title, table index, caption, raw header
+    table_rows    label and text cells of every row
+    table_values  numeric cells: normalised column, unit and value
+    table_columns value and table counts of every column, maintained on write
+"""
+import json
+import logging
+import re
+import sqlite3
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+
+from app.settings import get_settings
+from app.services.metrics import metrics_registry
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+# Share of the non-empty cells of a column that must be numbers for the column to be numeric
+NUMERIC_COLUMN_RATIO = 0.6
+MARKDOWN_SEPARATOR_PATTERN = re.compile(r"^\s*\|?\s*:?-{2,}:?\s*(\|\s*:?-{2,}:?\s*)*\|?\s*$")
+MULTIPLE_SPACES_PATTERN = re.compile(r"\s{2,}")
+HEADER_UNIT_PATTERN = re.compile(r"[(\[]\s*([^)\]]*)\s*[)\]]")
+NON_ALPHANUMERIC_PATTERN = re.compile(r"[^0-9a-z]+")
+CELL_DECORATION_PATTERN = re.compile(r"[*_`†‡§¶∗]|\\textbf|\\underline|[{}]")
+CELL_PATTERN = re.compile(
+    r"^\(?(?P<number>[-+]?(?:\d{1,3}(?:,\d{3})+|\d+)?(?:\.\d+)?(?:e[-+]?\d+)?)\s*"
+    r"(?P<suffix>%|ms|µs|us|sec|s|min|h|x|[kmbgt])?\)?"
+    r"\s*(?:(?:±|\+/-|\+-)\s*[\d.]+\s*%?)?\s*(?:\([^)]*\))?$",
+    re.IGNORECASE,
+)
+# Units of the values, and the factor converting them to the stored unit
+UNITS = {
+    "%": ("%", 1.0), "percent": ("%", 1.0),
+    "ms": ("ms", 1.0), "µs": ("ms", 1e-3), "us": ("ms", 1e-3), "s": ("ms", 1e3), "sec": ("ms", 1e3),
+    "seconds": ("ms", 1e3), "min": ("ms", 6e4), "minutes": ("ms", 6e4), "h": ("ms", 3.6e6), "hours": ("ms", 3.6e6),
+    "k": ("", 1e3), "thousands": ("", 1e3), "m": ("", 1e6), "millions": ("", 1e6), "b": ("", 1e9), "g": ("", 1e9),
+    "billions": ("", 1e9), "t": ("", 1e12), "x": ("x", 1.0),
+}
+# Words of the metrics reported either as fractions (0.853) or as percentages (85.3), stored as percentages
+PERCENTAGE_METRIC_WORDS = {"accuracy", "f1", "precision", "recall", "exact_match", "bleu", "rouge", "auc", "map",
+                           "iou", "miou", "error"}
+# Words of the columns holding years or dates, which are not metric values
+YEAR_COLUMN_WORDS = {"year", "date", "published"}
+YEAR_RANGE = (1900, 2100)
+# Synonyms of the words of the column names
+HEADER_SYNONYMS = {
+    "acc": "accuracy", "accuracy": "accuracy", "f1score": "f1", "params": "parameters", "param": "parameters",
+    "parameter": "parameters", "em": "exact_match", "exactmatch": "exact_match", "ppl": "perplexity",
+    "prec": "precision", "rec": "recall", "time": "latency", "runtime": "latency",
+}
+
+
+def normalize_header(header: str) -> str:
+    """
+    Normalise a column name: units and decorations removed, words lowercased and mapped to their canonical
+    form, e.g. "Top-1 Acc. (%) ↑" -> "top_1_accuracy".
+    """
+    text = HEADER_UNIT_PATTERN.sub(" ", header or "").lower().replace("f1-score", "f1score").replace("f1 score", "f1score")
+    text = text.replace("exact match", "exactmatch").replace("#", " params ")
+    words = []
+    for word in NON_ALPHANUMERIC_PATTERN.sub(" ", text).split():
+        word = HEADER_SYNONYMS.get(word, word)
+        if not words or words[-1] != word:
+            words.append(word)
+    return "_".join(words)
+
+
+def header_unit(header: str) -> tuple[str, float]:
+    """
+    :return tuple: Stored unit and conversion factor of the values of a column, from its name, e.g. "Latency (s)".
+    """
+    for match in HEADER_UNIT_PATTERN.finditer(header or ""):
+        unit = match.group(1).strip().lower()
+        if unit in UNITS:
+            return UNITS[unit]
+    if "%" in (header or ""):
+        return UNITS["%"]
+    return "", 1.0
+
+
+def parse_number(cell: str) -> tuple[float, str | None] | None:
+    """
+    Parse a numeric cell, e.g. "85.3", "**85.3**", "85.3 ± 0.2", "1,234", "12.5M", "120 ms", "−3.1%".
+
+    :return tuple: The value and the unit suffix of the cell, None if the cell is not a number.
+    """
+    text = CELL_DECORATION_PATTERN.sub("", cell).replace("−", "-").replace("–", "-").strip()
+    match = CELL_PATTERN.match(text)
+    if match is None or not any(character.isdigit() for character in match.group("number")):
+        return None
+    try:
+        value = float(match.group("number").replace(",", ""))
+    except ValueError:
+        return None
+    suffix = match.group("suffix")
+    return value, suffix.lower() if suffix else None
+
+
+def is_year_like(cell: str) -> bool:
+    """
+    :return bool: True if a cell is a year, e.g. "2019", "(2021)".
+    """
+    parsed = parse_number(cell)
+    return (parsed is not None and parsed[1] is None and parsed[0].is_integer()
+            and YEAR_RANGE[0] <= parsed[0] <= YEAR_RANGE[1] and len(CELL_DECORATION_PATTERN.sub("", cell).strip("() ")) == 4)
+
+
+def split_rows(table_content: str) -> list[list[str]]:
+    """
+    Split the text of a table into rows of cells. Markdown (pipes), tab, comma, semicolon separated
+    and space aligned tables are supported.
+    """
+    lines = [line for line in (table_content or "").splitlines()
+             if line.strip() and not MARKDOWN_SEPARATOR_PATTERN.match(line)]
+    if not lines:
+        return []
+    for delimiter in ("|", "\t", ";", ","):
+        if sum(delimiter in line for line in lines) >= max(1, len(lines) * 0.8):
+            rows = []
+            for line in lines:
+                cells = line.strip()
+                if delimiter == "|":
+                    cells = cells.strip("|")
+                rows.append([cell.strip() for cell in cells.split(delimiter)])
+            return rows
+    return [MULTIPLE_SPACES_PATTERN.split(line.strip()) for line in lines]
+
+
+class TableFrame:
+    """
+    A parsed table: column names and units, typed columns, and row labels.
+    """
+
+    def __init__(self, caption: str, headers: list[str], rows: list[list[str]]):
+        width = max([len(headers), *map(len, rows)])
+        self.caption = caption
+        self.headers = [*headers, *[f"column {index + 1}" for index in range(len(headers), width)]]
+        self.rows = [[*row, *[""] * (width - len(row))] for row in rows]
+        self.columns = [normalize_header(header) or f"column_{index + 1}" for index, header in enumerate(self.headers)]
+        self.units = [header_unit(header) for header in self.headers]
+        self.numeric = []
+        for index in range(width):
+            cells = [row[index] for row in self.rows if row[index].strip() not in ("", "-", "–", "—", "n/a", "N/A")]
+            numbers = [parse_number(cell) for cell in cells]
+            numeric = bool(cells) and sum(number is not None for number in numbers) >= len(cells) * NUMERIC_COLUMN_RATIO
+            # Years are text: a publication year is not a metric value
+            if numeric and (YEAR_COLUMN_WORDS.intersection(self.columns[index].split("_"))
+                            or all(is_year_like(cell) for cell, number in zip(cells, numbers) if number is not None)):
+                numeric = False
+            self.numeric.append(numeric)
+            # A unitless percentage metric whose values are all fractions is converted to percent
+            if (numeric and self.units[index] == ("", 1.0)
+                    and PERCENTAGE_METRIC_WORDS.intersection(self.columns[index].split("_"))
+                    and all(number[1] is None and 0 <= number[0] <= 1 for number in numbers if number is not None)):
+                self.units[index] = ("%", 100.0)
+
+    @classmethod
+    def parse(cls, caption: str, table_content: str) -> "TableFrame | None":
+        """
+        :return TableFrame: The parsed table, None if the text has no numeric column.
+        """
+        rows = split_rows(table_content)
+        if len(rows) < 2:
+            return None
+        frame = cls(caption, rows[0], rows[1:])
+        return frame if any(frame.numeric) else None
+
+    def row_label(self, row: list[str]) -> str:
+        labels = [cell for cell, numeric in zip(row, self.numeric) if not numeric and cell]
+        return next((cell for cell in labels if not is_year_like(cell)), labels[0] if labels else "")
+
+    def values(self):
+        """
+        Yield the numeric cells as (row index, column index, column, unit, value), converted to the unit of the column.
+        Fractions of percentage metrics are yielded as percentages, so they are compared with the values of other papers.
+        """
+        for row_index, row in enumerate(self.rows):
+            for column_index, cell in enumerate(row):
+                if not self.numeric[column_index]:
+                    continue
+                parsed = parse_number(cell)
+                if parsed is None:
+                    continue
+                value, suffix = parsed
+                # The unit written in the cell takes precedence over the unit of the column
+                unit, factor = UNITS[suffix] if suffix in UNITS else self.units[column_index]
+                yield row_index, column_index, self.columns[column_index], unit, value * factor
+
+
+class TableStore:
+    """
+    SQLite store of the parsed tables, shared by the API and the worker processes.
+    """
+
+    def __init__(self, db_path: str = None):
+        """
+        :param db_path: Path to the SQLite database file. Defaults to settings.TABLE_STORE_PATH.
+        """
+        self.db_path = db_path or settings.TABLE_STORE_PATH
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        with self._connect() as connection:
+            connection.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS tables (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    paper_title TEXT NOT NULL,
+                    table_index INTEGER NOT NULL,
+                    caption TEXT,
+                    headers TEXT NOT NULL,
+                    created_at REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_tables_paper ON tables (paper_title);
+                CREATE TABLE IF NOT EXISTS table_rows (
+                    table_id INTEGER NOT NULL,
+                    row_index INTEGER NOT NULL,
+                    label TEXT,
+                    text TEXT,
+                    PRIMARY KEY (table_id, row_index)
+                );
+                CREATE TABLE IF NOT EXISTS table_values (
+                    table_id INTEGER NOT NULL,
+                    row_index INTEGER NOT NULL,
+                    column_index INTEGER NOT NULL,
+                    column_name TEXT NOT NULL,
+                    header TEXT NOT NULL,
+                    unit TEXT NOT NULL,
+                    value REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_table_values_column ON table_values (column_name, value);
+                CREATE INDEX IF NOT EXISTS idx_table_values_table ON table_values (table_id);
+                CREATE TABLE IF NOT EXISTS table_columns (
+                    column_name TEXT NOT NULL,
+                    unit TEXT NOT NULL,
+                    value_count INTEGER NOT NULL,
+                    table_count INTEGER NOT NULL,
+                    PRIMARY KEY (column_name, unit)
+                );
+                """
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def _reader(self) -> sqlite3.Connection:
+        # Lookups reuse a connection per thread
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = self._connect()
+            # The store is small, its pages stay in the cache of the connection between lookups
+            connection.execute(f"PRAGMA cache_size = -{settings.TABLE_STORE_CACHE_KIB}")
+            connection.execute(f"PRAGMA mmap_size = {settings.TABLE_STORE_CACHE_KIB * 1024}")
+        return connection
+
+    def add_documents(self, documents: list) -> int:
+        """
+        Parse and store the tables of ingested papers, replacing the tables of papers ingested again.
+        Errors are logged, the documents are stored anyway.
+
+        :param documents: PdfInformationRecipe or dicts of the ingested papers.
+        :return int: Number of stored tables.
+        """
+        if not settings.TABLE_STORE_ENABLED or not documents:
+            return 0
+        try:
+            frames = {}
+            for document in documents:
+                title, tables = self._document_tables(document)
+                if title:
+                    frames[title] = [(index, TableFrame.parse(caption, content))
+                                     for index, (caption, content) in enumerate(tables)]
+            return self._write(frames)
+        except Exception as e:
+            logger.error(f"Error storing the tables of {len(documents)} paper(s): {e}")
+            return 0
+
+    @staticmethod
+    def _document_tables(document) -> tuple[str, list[tuple[str, str]]]:
+        if isinstance(document, dict):
+            tables = (document.get("tables_and_figures") or {}).get("tables") or []
+            title = document.get("title")
+        elif hasattr(document, "load_part"):
+            # Only the tables part of a lazy document is read
+            tables = document.tables or []
+            title = document.title
+        else:
+            tables = document.tables_and_figures.tables if document.tables_and_figures else []
+            title = document.title
+        return title, [(table["table_caption"], table["table_content"]) if isinstance(table, dict)
+                       else (table.table_caption, table.table_content) for table in tables]
+
+    def _write(self, frames: dict) -> int:
+        now = time.time()
+        stored = 0
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            for title, paper_frames in frames.items():
+                table_ids = [row[0] for row in connection.execute("SELECT id FROM tables WHERE paper_title = ?", (title,))]
+                for table_id in table_ids:
+                    counts = connection.execute(
+                        "SELECT column_name, unit, COUNT(*) FROM table_values WHERE table_id = ? GROUP BY column_name, unit",
+                        (table_id,)).fetchall()
+                    connection.executemany(
+                        "UPDATE table_columns SET value_count = value_count - ?, table_count = table_count - 1 "
+                        "WHERE column_name = ? AND unit = ?",
+                        [(count, column, unit) for column, unit, count in counts],
+                    )
+                if table_ids:
+                    connection.execute("DELETE FROM table_columns WHERE value_count <= 0")
+                for table_name in ("table_values", "table_rows"):
+                    connection.executemany(f"DELETE FROM {table_name} WHERE table_id = ?", [(table_id,) for table_id in table_ids])
+                connection.execute("DELETE FROM tables WHERE paper_title = ?", (title,))
+                for table_index, frame in paper_frames:
+                    if frame is None:
+                        continue
+                    table_id = connection.execute(
+                        "INSERT INTO tables (paper_title, table_index, caption, headers, created_at) VALUES (?, ?, ?, ?, ?)",
+                        (title, table_index, frame.caption, json.dumps(frame.headers, ensure_ascii=False), now),
+                    ).lastrowid
+                    connection.executemany(
+                        "INSERT INTO table_rows (table_id, row_index, label, text) VALUES (?, ?, ?, ?)",
+                        [(table_id, row_index, frame.row_label(row),
+                          " ".join(cell for cell, numeric in zip(row, frame.numeric) if not numeric and cell))
+                         for row_index, row in enumerate(frame.rows)],
+                    )
+                    values = list(frame.values())
+                    connection.executemany(
+                        "INSERT INTO table_values (table_id, row_index, column_index, column_name, header, unit, value) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [(table_id, row_index, column_index, column, frame.headers[column_index], unit, value)
+                         for row_index, column_index, column, unit, value in values],
+                    )
+                    counts = {}
+                    for _, _, column, unit, _ in values:
+                        counts[column, unit] = counts.get((column, unit), 0) + 1
+                    connection.executemany(
+                        "INSERT INTO table_columns (column_name, unit, value_count, table_count) VALUES (?, ?, ?, 1) "
+                        "ON CONFLICT (column_name, unit) DO UPDATE SET "
+                        "value_count = value_count + excluded.value_count, table_count = table_count + 1",
+                        [(column, unit, count) for (column, unit), count in counts.items()],
+                    )
+                    stored += 1
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+        return stored
+
+    def metric_columns(self, metric: str) -> list[str]:
+        """
+        :return list[str]: Stored columns matching a metric: the normalised metric itself, and the columns
+                           containing its words, e.g. `accuracy` matches `top_1_accuracy`.
+        """
+        column = normalize_header(metric)
+        rows = self._reader().execute("SELECT DISTINCT column_name FROM table_columns").fetchall()
+        return [row[0] for row in rows if row[0] == column or f"_{column}_" in f"_{row[0]}_"]
+
+    def query(self, operation: str = "top", metric: str = None, context: str = None, paper: str = None,
+              unit: str = None, order: str = "desc", limit: int = 20) -> dict:
+        """
+        Query the numeric cells of the tables.
+
+        :param operation: `top`: values of a metric, best first,
+                          `best_per_paper`: best value of a metric in every paper, best first,
+                          `summary`: count, min, max and average of a metric,
+                          `metrics`: the metric columns with their number of values.
+        :param metric: Column of the values, normalised like the headers, see metric_columns.
+        :param context: Text the caption, the header or the row of the value must contain, e.g. a dataset name.
+        :param paper: Text the title of the paper must contain.
+        :param unit: Unit of the values: `%`, `ms`, `x` or an empty string for unitless values. Required by `top`,
+                     `best_per_paper` and `summary` if the matching values have several units.
+        :param order: `desc` if higher is better, `asc` if lower is better.
+        :param limit: Maximum number of values, papers or metrics returned.
+        :return dict: The matching values or metrics.
+        :raises ValueError: If the values to rank or summarise have several units and no unit is given.
+        """
+        if operation not in ("top", "best_per_paper", "summary", "metrics"):
+            raise ValueError(f"Unknown operation '{operation}', use top, best_per_paper, summary or metrics.")
+        if order not in ("desc", "asc"):
+            raise ValueError("order must be 'desc' or 'asc'.")
+        if operation != "metrics" and not metric:
+            raise ValueError(f"Operation '{operation}' requires a metric.")
+
+        conditions, parameters = [], []
+        if metric:
+            columns = self.metric_columns(metric)
+            if not columns:
+                return {"metric_columns": [], "values": []}
+            # Matching columns are resolved first, so the values are read through the (column_name, value) index
+            conditions.append(f"v.column_name IN ({', '.join('?' * len(columns))})")
+            parameters += columns
+        if context:
+            conditions.append("(t.caption LIKE ? OR v.header LIKE ? OR r.text LIKE ?)")
+            parameters += [f"%{context}%"] * 3
+        if paper:
+            conditions.append("t.paper_title LIKE ?")
+            parameters.append(f"%{paper}%")
+        if unit is not None:
+            conditions.append("v.unit = ?")
+            parameters.append(unit)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        # Tables and rows are only joined when they are filtered or returned
+        joins = "FROM table_values v"
+        if context or paper or operation in ("top", "best_per_paper", "summary"):
+            joins += " JOIN tables t ON t.id = v.table_id"
+        if context or operation in ("top", "best_per_paper"):
+            joins += " JOIN table_rows r ON r.table_id = v.table_id AND r.row_index = v.row_index"
+        connection = self._reader()
+
+        if operation == "metrics" and not conditions:
+            rows = connection.execute(
+                "SELECT column_name AS metric, unit, value_count, table_count FROM table_columns "
+                "ORDER BY value_count DESC LIMIT ?", (limit,)).fetchall()
+            return {"metrics": [dict(row) for row in rows]}
+        if operation == "metrics":
+            rows = connection.execute(
+                f"SELECT v.column_name AS metric, v.unit, COUNT(*) AS value_count, COUNT(DISTINCT v.table_id) AS table_count "
+                f"{joins} {where} GROUP BY v.column_name, v.unit ORDER BY value_count DESC LIMIT ?",
+                (*parameters, limit)).fetchall()
+            return {"metrics": [dict(row) for row in rows]}
+        if unit is None:
+            # Values in different units (percentages and fractions, ms and unitless) cannot be ranked together.
+            # Without filters the units of the columns are read from the counts instead of the values.
+            if context or paper:
+                unit_joins = "FROM table_values v JOIN tables t ON t.id = v.table_id"
+                if context:
+                    unit_joins += " JOIN table_rows r ON r.table_id = v.table_id AND r.row_index = v.row_index"
+                units_query = f"SELECT DISTINCT v.unit {unit_joins} {where}"
+            else:
+                units_query = (f"SELECT DISTINCT unit FROM table_columns "
+                               f"WHERE column_name IN ({', '.join('?' * len(columns))})")
+            units = [row[0] for row in connection.execute(units_query, parameters)]
+            if len(units) > 1:
+                raise ValueError(f"The values of '{metric}' have several units {units}, query them with one unit.")
+        result = {"metric_columns": columns}
+        if operation == "summary":
+            row = connection.execute(
+                f"SELECT COUNT(*) AS value_count, COUNT(DISTINCT t.paper_title) AS paper_count, MIN(v.value) AS min, "
+                f"MAX(v.value) AS max, AVG(v.value) AS avg {joins} {where}", parameters).fetchone()
+            return {**result, **dict(row)}
+
+        selected = "t.paper_title AS paper, t.caption, r.label AS row, v.header AS column, v.value, v.unit"
+        if operation == "top":
+            rows = connection.execute(
+                f"SELECT {selected} {joins} {where} ORDER BY v.value {order.upper()} LIMIT ?",
+                (*parameters, limit)).fetchall()
+        else:
+            # SQLite returns the other columns of the row holding the MAX/MIN of a group
+            best = "MAX" if order == "desc" else "MIN"
+            rows = connection.execute(
+                f"SELECT {selected.replace('v.value', f'{best}(v.value) AS value')} {joins} {where} "
+                f"GROUP BY t.paper_title ORDER BY value {order.upper()} LIMIT ?", (*parameters, limit)).fetchall()
+        return {**result, "values": [dict(row) for row in rows]}
+
+    def rebuild(self, db_service) -> int:
+        """
+        Parse the tables of every document of the database again, e.g. to backfill the papers ingested before the
+        store existed.
+
+        :return int: Number of stored tables.
+        """
+        stored = 0
+        for document in db_service.get_documents():
+            stored += self.add_documents([document])
+        logger.info(f"Table store rebuilt with {stored} tables.")
+        return stored
+
+    def to_dict(self) -> dict:
+        connection = self._reader()
+        tables, papers = connection.execute("SELECT COUNT(*), COUNT(DISTINCT paper_title) FROM tables").fetchone()
+        values, = connection.execute("SELECT COUNT(*) FROM table_values").fetchone()
+        return {"tables": tables, "papers": papers, "values": values}
+
+
+@lru_cache
+def get_table_store() -> TableStore:
+    """
+    Get the process-wide table store.
+    """
+    store = TableStore()
+    metrics_registry.register("table_store", store.to_dict)
+    return store
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Build or query the table store.")
+    parser.add_argument("--rebuild", action="store_true", help="Parse the tables of every document of the database.")
+    parser.add_argument("--operation", choices=["top", "best_per_paper", "summary", "metrics"])
+    parser.add_argument("--metric")
+    parser.add_argument("--context")
+    parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    store = get_table_store()
+    if args.rebuild:
+        from app.services.service_factory import get_database_service
+
+        store.rebuild(get_database_service())
+    if args.operation:
+        print(json.dumps(store.query(args.operation, metric=args.metric, context=args.context, limit=args.limit),
+                         indent=2, ensure_ascii=False))
+    else:
+        print(json.dumps(store.to_dict()))
@@ -0,0 +1,224 @@
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+
+from app.settings import get_settings
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+TASK_PENDING = "pending"
+TASK_RUNNING = "running"
+TASK_DONE = "done"
+TASK_FAILED = "failed"
+
+
+class IngestionTaskQueue:
+    """
+    Local SQLite backed queue of PDF ingestion tasks.
+    The API process enqueues one task per uploaded PDF and worker processes claim them.
+    SQLite serialises writers, so claiming a task is atomic across processes.
+    """
+
+    def __init__(self, db_path: str = None):
+        """
+        :param db_path: Path to the SQLite database file. Defaults to settings.INGEST_QUEUE_PATH.
+        """
+        self.db_path = db_path or settings.INGEST_QUEUE_PATH
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+        with self._connect() as connection:
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS ingestion_tasks (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    job_id TEXT NOT NULL,
+                    file_path TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker_id TEXT,
+                    result TEXT,
+                    error TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_ingestion_tasks_status ON ingestion_tasks (status, id)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_ingestion_tasks_job ON ingestion_tasks (job_id)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        connection.row_factory = sqlite3.Row
+        connection.execute("PRAGMA journal_mode=WAL")
+        return connection
+
+    def enqueue(self, file_paths: list[Path], job_id: str = None) -> str:
+        """
+        Add one ingestion task per file.
+
+        :param file_paths: Paths of the PDF files to ingest.
+        :param job_id: Identifier grouping the tasks, generated if not provided.
+        :return str: The job id.
+        """
+        job_id = job_id or uuid.uuid4().hex
+        now = time.time()
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT INTO ingestion_tasks (job_id, file_path, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(job_id, str(Path(file_path).resolve()), TASK_PENDING, now, now) for file_path in file_paths],
+            )
+        logger.info(f"Enqueued {len(file_paths)} ingestion task(s) for job {job_id}")
+        return job_id
+
+    def claim(self, worker_id: str) -> dict | None:
+        """
+        Claim the oldest pending task. Running tasks whose lease expired (e.g. a crashed worker)
+        are claimed again until settings.WORKER_MAX_ATTEMPTS is reached, then marked as failed.
+
+        :param worker_id: Identifier of the claiming worker.
+        :return dict: The claimed task, None if the queue is empty.
+        """
+        now = time.time()
+        lease_expiry = now - settings.WORKER_TASK_LEASE_SECONDS
+        connection = self._connect()
+        try:
+            connection.execute("BEGIN IMMEDIATE")
+            # fail() is never called for a task that crashed or hung its worker
+            connection.execute(
+                "UPDATE ingestion_tasks SET status = ?, error = ?, updated_at = ? "
+                "WHERE status = ? AND updated_at < ? AND attempts >= ?",
+                (TASK_FAILED, f"Lease expired after {settings.WORKER_MAX_ATTEMPTS} attempt(s), the worker crashed or hung.",
+                 now, TASK_RUNNING, lease_expiry, settings.WORKER_MAX_ATTEMPTS),
+            )
+            row = connection.execute(
+                """
+                SELECT * FROM ingestion_tasks
+                WHERE status = ? OR (status = ? AND updated_at < ? AND attempts < ?)
+                ORDER BY id LIMIT 1
+                """,
+                (TASK_PENDING, TASK_RUNNING, lease_expiry, settings.WORKER_MAX_ATTEMPTS),
+            ).fetchone()
+            if row is None:
+                connection.execute("COMMIT")
+                return None
+            connection.execute(
+                "UPDATE ingestion_tasks SET status = ?, worker_id = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (TASK_RUNNING, worker_id, now, row["id"]),
+            )
+            connection.execute("COMMIT")
+            task = dict(row)
+            task["attempts"] += 1
+            task["worker_id"] = worker_id
+            return task
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        finally:
+            connection.close()
+
+    def renew(self, task_id: int, worker_id: str) -> bool:
+        """
+        Renew the lease of a running task.
+
+        :param task_id: The task id.
+        :param worker_id: Identifier of the worker running the task.
+        :return bool: False if the task is no longer running for this worker, e.g. its lease expired
+                      and another worker claimed it.
+        """
+        with self._connect() as connection:
+            cursor = connection.execute(
+                "UPDATE ingestion_tasks SET updated_at = ? WHERE id = ? AND worker_id = ? AND status = ?",
+                (time.time(), task_id, worker_id, TASK_RUNNING),
+            )
+        return cursor.rowcount == 1
+
+    @contextmanager
+    def heartbeat(self, task: dict):
+        """
+        Renew the lease of a task in a background thread while it runs, so a task longer than
+        settings.WORKER_TASK_LEASE_SECONDS is not claimed by another worker. The lease is renewed for at most
+        settings.WORKER_TASK_MAX_SECONDS, after which a hung task expires and is claimed again.
+
+        :param task: The claimed task.
+        """
+        stopped = threading.Event()
+
+        def renew_lease():
+            deadline = time.monotonic() + settings.WORKER_TASK_MAX_SECONDS
+            while not stopped.wait(settings.WORKER_TASK_HEARTBEAT_SECONDS):
+                if time.monotonic() > deadline:
+                    logger.warning(f"Task {task['id']} exceeded {settings.WORKER_TASK_MAX_SECONDS}s, "
+                                   "its lease is no longer renewed.")
+                    return
+                try:
+                    if not self.renew(task["id"], task["worker_id"]):
+                        logger.warning(f"Task {task['id']} is no longer leased by {task['worker_id']}.")
+                        return
+                except Exception as e:
+                    logger.error(f"Error renewing the lease of task {task['id']}: {e}")
+
+        thread = threading.Thread(target=renew_lease, name=f"lease-{task['id']}", daemon=True)
+        thread.start()
+        try:
+            yield task
+        finally:
+            stopped.set()
+            thread.join()
+
+    def complete(self, task_id: int, result: str):
+        """
+        Mark a task as done.
+
+        :param task_id: The task id.
+        :param result: Short description of the result, e.g. the stored document title.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE ingestion_tasks SET status = ?, result = ?, error = NULL, updated_at = ? WHERE id = ?",
+                (TASK_DONE, result, time.time(), task_id),
+            )
+
+    def fail(self, task_id: int, error: str):
+        """
+        Record a task failure. The task is retried until settings.WORKER_MAX_ATTEMPTS is reached.
+
+        :param task_id: The task id.
+        :param error: The error message.
+        """
+        with self._connect() as connection:
+            connection.execute(
+                "UPDATE ingestion_tasks SET status = CASE WHEN attempts >= ? THEN ? ELSE ? END, error = ?, updated_at = ? WHERE id = ?",
+                (settings.WORKER_MAX_ATTEMPTS, TASK_FAILED, TASK_PENDING, error, time.time(), task_id),
+            )
+
+    def is_job_finished(self, job_id: str) -> bool:
+        """
+        :return bool: True if every task of the job is done or failed for good.
+        """
+        with self._connect() as connection:
+            row = connection.execute(
+                "SELECT COUNT(*) FROM ingestion_tasks WHERE job_id = ? AND status NOT IN (?, ?)",
+                (job_id, TASK_DONE, TASK_FAILED),
+            ).fetchone()
+        return row[0] == 0
+
+    def get_job(self, job_id: str) -> list[dict]:
+        """
+        Get the tasks of a job.
+
+        :param job_id: The job id.
+        :return list[dict]: Tasks of the job, empty if the job does not exist.
+        """
+        with self._connect() as connection:
+            rows = connection.execute(
+                "SELECT * FROM ingestion_tasks WHERE job_id = ? ORDER BY id", (job_id,)
+            ).fetchall()
+        return [dict(row) for row in rows]
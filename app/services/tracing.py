@@ -0,0 +1,530 @@
+"""
+Tracing of the request path, replacing the inline opik `@track` and `track_genai` wrappers.
+
+Spans are recorded in memory by the request threads and handed over to a background exporter through a bounded
+queue, so a slow or unavailable tracing backend never slows requests down. Traces are sampled:
+    - head sampling: settings.TRACING_SAMPLE_RATE of the traces are recorded with their (redacted and truncated)
+      inputs and outputs,
+    - tail sampling: the other traces only record names and timings, and are exported only if they failed or
+      took longer than settings.TRACING_TAIL_LATENCY_SECONDS.
+Exporters are pluggable: opik, OTLP/HTTP (JSON encoding) or a local JSONL file, see EXPORTERS.
+Spans are also the stages of the requests profiled on demand, see app/services/profiling.py.
+"""
+import atexit
+import contextvars
+import functools
+import inspect
+import json
+import logging
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+
+from pydantic import BaseModel
+
+from app.settings import get_settings
+from app.services.metrics import metrics_registry
+from app.services.profiling import get_active_profile
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+SENSITIVE_KEY_PATTERN = re.compile(r"api_?key|token|secret|password|authorization|credential", re.IGNORECASE)
+REDACTED = "[REDACTED]"
+# Nested containers deeper than this are summarised, and containers are cut after this many items
+MAX_PAYLOAD_DEPTH = 4
+MAX_PAYLOAD_ITEMS = 50
+
+
+def redact(value, max_chars: int = None, depth: int = 0):
+    """
+    Convert a payload to JSON serializable data, with sensitive keys redacted and long strings truncated.
+
+    :param value: Input or output of a span.
+    :param max_chars: Maximum length of strings. Defaults to settings.TRACING_MAX_PAYLOAD_CHARS.
+    :return: The redacted payload.
+    """
+    max_chars = max_chars or settings.TRACING_MAX_PAYLOAD_CHARS
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    if isinstance(value, str):
+        return value if len(value) <= max_chars else f"{value[:max_chars]}...[{len(value) - max_chars} chars truncated]"
+    if isinstance(value, BaseModel):
+        value = value.model_dump()
+    if isinstance(value, dict):
+        if depth >= MAX_PAYLOAD_DEPTH:
+            return f"<dict of {len(value)} items>"
+        items = list(value.items())[:MAX_PAYLOAD_ITEMS]
+        return {str(key): REDACTED if SENSITIVE_KEY_PATTERN.search(str(key)) else redact(item, max_chars, depth + 1)
+                for key, item in items}
+    if isinstance(value, (list, tuple, set)):
+        if depth >= MAX_PAYLOAD_DEPTH:
+            return f"<{type(value).__name__} of {len(value)} items>"
+        items = [redact(item, max_chars, depth + 1) for item in list(value)[:MAX_PAYLOAD_ITEMS]]
+        if len(value) > MAX_PAYLOAD_ITEMS:
+            items.append(f"...[{len(value) - MAX_PAYLOAD_ITEMS} items truncated]")
+        return items
+    return redact(f"<{type(value).__name__}> {value}", max_chars, depth)
+
+
+class _Trace:
+    def __init__(self, sampled: bool):
+        self.trace_id = f"{random.getrandbits(128):032x}"
+        self.sampled = sampled
+        self.start_time = time.time()
+        self.spans = []
+        self.failed = False
+        self.finished = False
+        self.lock = threading.Lock()
+
+
+class Span:
+    """
+    A timed operation of a trace. Inputs and outputs are only recorded for head-sampled traces.
+    """
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_time", "end_time",
+                 "input", "output", "error", "attributes")
+
+    def __init__(self, trace: _Trace, parent_id: str | None, name: str, kind: str):
+        self.trace = trace
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_time = time.time()
+        self.end_time = None
+        self.input = None
+        self.output = None
+        self.error = None
+        self.attributes = {}
+
+    @property
+    def is_recording(self) -> bool:
+        return self.trace.sampled
+
+    def set_output(self, output):
+        if self.trace.sampled:
+            self.output = redact(output)
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace.trace_id,
+            "trace_start_time": self.trace.start_time,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start_time": self.start_time,
+            "end_time": self.end_time,
+            "duration_ms": round((self.end_time - self.start_time) * 1000, 3),
+            "input": self.input,
+            "output": self.output,
+            "error": self.error,
+            "attributes": self.attributes,
+            "sampling": "head" if self.trace.sampled else "tail",
+        }
+
+
+class _NoopSpan:
+    is_recording = False
+
+    def set_output(self, output):
+        pass
+
+    def set_attribute(self, key: str, value):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class JsonlExporter:
+    """
+    Appends the spans to a local JSONL file, one span per line.
+    """
+    def __init__(self, path: str = None):
+        self.path = Path(path or settings.TRACING_JSONL_PATH)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def export(self, spans: list[dict]):
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.writelines(json.dumps(span, ensure_ascii=False, default=str) + "\n" for span in spans)
+
+    def shutdown(self):
+        pass
+
+
+class OtlpExporter:
+    """
+    Sends the spans to an OpenTelemetry collector with OTLP/HTTP, JSON encoding.
+    """
+    def __init__(self, endpoint: str = None, headers: dict = None):
+        self.endpoint = endpoint or settings.TRACING_OTLP_ENDPOINT
+        self.headers = {"Content-Type": "application/json", **(headers or settings.TRACING_OTLP_HEADERS)}
+
+    @staticmethod
+    def _attribute(key: str, value) -> dict:
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        if not isinstance(value, str):
+            value = json.dumps(value, ensure_ascii=False, default=str)
+        return {"key": key, "value": {"stringValue": value}}
+
+    def _span(self, span: dict) -> dict:
+        attributes = {**span["attributes"], "span.kind": span["kind"], "sampling": span["sampling"]}
+        if span["input"] is not None:
+            attributes["input"] = span["input"]
+        if span["output"] is not None:
+            attributes["output"] = span["output"]
+        otlp_span = {
+            "traceId": span["trace_id"],
+            "spanId": span["span_id"],
+            "name": span["name"],
+            # SPAN_KIND_CLIENT for model calls, SPAN_KIND_INTERNAL otherwise
+            "kind": 3 if span["kind"] == "llm" else 1,
+            "startTimeUnixNano": str(int(span["start_time"] * 1e9)),
+            "endTimeUnixNano": str(int(span["end_time"] * 1e9)),
+            "attributes": [self._attribute(key, value) for key, value in attributes.items()],
+            "status": {"code": 2, "message": span["error"]} if span["error"] else {"code": 1},
+        }
+        if span["parent_id"]:
+            otlp_span["parentSpanId"] = span["parent_id"]
+        return otlp_span
+
+    def export(self, spans: list[dict]):
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [self._attribute("service.name", settings.TRACING_SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": [self._span(span) for span in spans]}],
+        }]}
+        request = urllib.request.Request(self.endpoint, data=json.dumps(payload).encode("utf-8"),
+                                         headers=self.headers, method="POST")
+        with urllib.request.urlopen(request, timeout=10):
+            pass
+
+    def shutdown(self):
+        pass
+
+
+class OpikExporter:
+    """
+    Sends the spans to opik, root spans as traces. The opik SDK is imported when the exporter is created.
+    """
+    SPAN_TYPES = {"llm": "llm", "tool": "tool"}
+
+    def __init__(self):
+        import opik
+        from opik.id_helpers import uuid4_to_uuid7
+
+        settings.validate_subsystem("tracing")
+        self.client = opik.Opik(project_name=settings.OPIK_PROJECT_NAME, workspace=settings.OPIK_WORKSPACE,
+                                api_key=settings.OPIK_API_KEY)
+        self._uuid4_to_uuid7 = uuid4_to_uuid7
+
+    def _id(self, hex_id: str, trace_start_time: float) -> str:
+        # Opik expects UUID v7 identifiers, derived from the trace start time so that references match
+        random_uuid = uuid.UUID(hex=hex_id.rjust(32, "0"), version=4)
+        return str(self._uuid4_to_uuid7(datetime.fromtimestamp(trace_start_time, tz=timezone.utc), str(random_uuid)))
+
+    @staticmethod
+    def _payload(value) -> dict | None:
+        if value is None or isinstance(value, dict):
+            return value
+        return {"value": value}
+
+    def export(self, spans: list[dict]):
+        for span in spans:
+            trace_id = self._id(span["trace_id"], span["trace_start_time"])
+            common = {
+                "name": span["name"],
+                "start_time": datetime.fromtimestamp(span["start_time"], tz=timezone.utc),
+                "end_time": datetime.fromtimestamp(span["end_time"], tz=timezone.utc),
+                "input": self._payload(span["input"]),
+                "output": self._payload(span["output"]),
+                "metadata": {**span["attributes"], "sampling": span["sampling"]},
+                "error_info": {"exception_type": span["error"].split(":")[0], "message": span["error"],
+                               "traceback": ""} if span["error"] else None,
+            }
+            if span["parent_id"] is None:
+                self.client.trace(id=trace_id, **common)
+            else:
+                self.client.span(trace_id=trace_id, id=self._id(span["span_id"], span["trace_start_time"]),
+                                 parent_span_id=(self._id(span["parent_id"], span["trace_start_time"])),
+                                 type=self.SPAN_TYPES.get(span["kind"], "general"), **common)
+
+    def shutdown(self):
+        self.client.flush()
+
+
+EXPORTERS = {
+    "jsonl": JsonlExporter,
+    "otlp": OtlpExporter,
+    "opik": OpikExporter,
+}
+
+
+class Tracer:
+    """
+    Records spans and exports the sampled traces from a background thread.
+    """
+    def __init__(self, exporter=None, enabled: bool = None, sample_rate: float = None,
+                 tail_latency_seconds: float = None, queue_size: int = None):
+        """
+        :param exporter: Exporter of the spans. Defaults to the settings.TRACING_EXPORTER exporter, created on first export.
+        :param enabled: Record spans. Defaults to settings.TRACING_ENABLED, and to False for the opik exporter
+                        without opik settings.
+        :param sample_rate: Share of the traces recorded with their payloads. Defaults to settings.TRACING_SAMPLE_RATE.
+        :param tail_latency_seconds: Unsampled traces slower than this are exported. Defaults to
+                                     settings.TRACING_TAIL_LATENCY_SECONDS.
+        :param queue_size: Maximum number of traces waiting to be exported. Defaults to settings.TRACING_QUEUE_SIZE.
+        """
+        if enabled is None:
+            enabled = settings.TRACING_ENABLED and (
+                    exporter is not None or settings.TRACING_EXPORTER != "opik" or settings.is_subsystem_configured("tracing"))
+        self.enabled = enabled
+        self.exporter = exporter
+        self.sample_rate = settings.TRACING_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.tail_latency_seconds = (settings.TRACING_TAIL_LATENCY_SECONDS
+                                     if tail_latency_seconds is None else tail_latency_seconds)
+        self._queue = queue.Queue(maxsize=queue_size or settings.TRACING_QUEUE_SIZE)
+        self._lock = threading.Lock()
+        self._worker = None
+        self._stats = {"traces": 0, "head_sampled": 0, "tail_sampled": 0, "dropped_traces": 0,
+                       "exported_spans": 0, "export_errors": 0}
+
+    def _count(self, stat: str, value: int = 1):
+        with self._lock:
+            self._stats[stat] += value
+
+    @contextmanager
+    def start_span(self, name: str, kind: str = "general", input=None, attributes: dict = None):
+        """
+        Record a span, child of the current span of the request.
+
+        :param name: Name of the span, e.g. "agent.invoke".
+        :param kind: "general", "llm" or "tool".
+        :param input: Input of the span, or a function returning it, only evaluated for sampled traces.
+        :param attributes: Attributes recorded for every trace, e.g. the model name.
+        """
+        profile = get_active_profile()
+        if not self.enabled:
+            if profile is None:
+                yield NOOP_SPAN
+                return
+            # Tracing is off, the span is only a stage of the profiled request
+            stage = profile.start_stage(name)
+            try:
+                yield NOOP_SPAN
+            finally:
+                profile.end_stage(stage)
+            return
+        stage = profile.start_stage(name) if profile is not None else None
+        parent = _current_span.get()
+        if parent is None:
+            trace = _Trace(sampled=random.random() < self.sample_rate)
+            self._count("traces")
+        else:
+            trace = parent.trace
+        span = Span(trace, parent.span_id if parent is not None else None, name, kind)
+        if attributes:
+            span.attributes.update(attributes)
+        if trace.sampled and input is not None:
+            span.input = redact(input() if callable(input) else input)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            trace.failed = True
+            raise
+        finally:
+            span.end_time = time.time()
+            _current_span.reset(token)
+            self._end_span(span, is_root=parent is None)
+            if stage is not None:
+                profile.end_stage(stage)
+
+    def _end_span(self, span: Span, is_root: bool):
+        trace = span.trace
+        with trace.lock:
+            if trace.finished:
+                # Span ending after its trace, e.g. a discarded hedged call: exported alone if the trace is head-sampled
+                late_spans = [span.to_dict()] if trace.sampled else None
+            else:
+                late_spans = None
+                if len(trace.spans) < settings.TRACING_MAX_SPANS_PER_TRACE:
+                    trace.spans.append(span)
+                if is_root:
+                    trace.finished = True
+        if late_spans:
+            self._enqueue(late_spans)
+        if not is_root:
+            return
+        if trace.sampled:
+            self._count("head_sampled")
+        elif trace.failed or span.end_time - span.start_time >= self.tail_latency_seconds:
+            self._count("tail_sampled")
+        else:
+            return
+        self._enqueue([recorded_span.to_dict() for recorded_span in trace.spans])
+
+    def _enqueue(self, spans: list[dict]):
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(spans)
+        except queue.Full:
+            self._count("dropped_traces")
+
+    def _ensure_worker(self):
+        if self._worker is not None:
+            return
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._export_loop, name="tracing-exporter", daemon=True)
+                self._worker.start()
+                atexit.register(self.flush)
+
+    def _export_loop(self):
+        while True:
+            batch = self._queue.get()
+            traces = 1
+            # Batch the traces already waiting in the queue, up to settings.TRACING_BATCH_SIZE spans
+            while len(batch) < settings.TRACING_BATCH_SIZE:
+                try:
+                    batch = batch + self._queue.get_nowait()
+                    traces += 1
+                except queue.Empty:
+                    break
+            try:
+                if self.exporter is None:
+                    self.exporter = EXPORTERS[settings.TRACING_EXPORTER]()
+                self.exporter.export(batch)
+                self._count("exported_spans", len(batch))
+            except Exception as e:
+                logger.error(f"Error exporting {len(batch)} spans: {e}")
+                self._count("export_errors")
+            finally:
+                for _ in range(traces):
+                    self._queue.task_done()
+
+    def flush(self, timeout: float = 10.0) -> bool:
+        """
+        Wait until the queued spans are exported.
+
+        :return bool: True if the queue was drained before the timeout.
+        """
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+        return not self._queue.unfinished_tasks
+
+    def shutdown(self):
+        """
+        Export the queued spans and flush the exporter, on application shutdown.
+        """
+        self.flush()
+        if self.exporter is not None:
+            try:
+                self.exporter.shutdown()
+            except Exception as e:
+                logger.error(f"Error shutting down the tracing exporter: {e}")
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {**self._stats, "enabled": self.enabled, "queued_traces": self._queue.qsize()}
+
+
+@lru_cache
+def get_tracer() -> Tracer:
+    """
+    Get the process-wide tracer.
+    """
+    tracer = Tracer()
+    metrics_registry.register("tracing", tracer.to_dict)
+    return tracer
+
+
+def start_span(name: str, kind: str = "general", input=None, attributes: dict = None):
+    """
+    Record a span with the process-wide tracer, see Tracer.start_span.
+    """
+    return get_tracer().start_span(name, kind, input, attributes)
+
+
+def record_model_response(span, response):
+    """
+    Record the text and the token usage of a genai response on an "llm" span.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        span.set_attribute("prompt_tokens", getattr(usage, "prompt_token_count", None))
+        span.set_attribute("completion_tokens", getattr(usage, "candidates_token_count", None))
+    if span.is_recording:
+        try:
+            span.set_output(response.text)
+        except Exception:
+            span.set_output(response)
+
+
+def trace(name: str = None, kind: str = "general", capture_input: bool = True, capture_output: bool = True):
+    """
+    Decorator recording a span for each call of a function or coroutine function.
+
+    :param name: Name of the span. Defaults to the qualified name of the function.
+    :param kind: "general", "llm" or "tool".
+    :param capture_input: Record the arguments (except self) of sampled calls.
+    :param capture_output: Record the return value of sampled calls.
+    """
+    def decorator(function):
+        span_name = name or function.__qualname__
+        parameter_names = list(inspect.signature(function).parameters)
+
+        def arguments(args, kwargs):
+            if not capture_input:
+                return None
+            named_args = dict(zip(parameter_names, args))
+            named_args.pop("self", None)
+            named_args.pop("cls", None)
+            return {**named_args, **kwargs}
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                tracer = get_tracer()
+                if not tracer.enabled and get_active_profile() is None:
+                    return await function(*args, **kwargs)
+                with tracer.start_span(span_name, kind, input=lambda: arguments(args, kwargs)) as span:
+                    result = await function(*args, **kwargs)
+                    if capture_output:
+                        span.set_output(result)
+                    return result
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            tracer = get_tracer()
+            if not tracer.enabled and get_active_profile() is None:
+                return function(*args, **kwargs)
+            with tracer.start_span(span_name, kind, input=lambda: arguments(args, kwargs)) as span:
+                result = function(*args, **kwargs)
+                if capture_output:
+                    span.set_output(result)
+                return result
+        return wrapper
+    return decorator
@@ -1,12 +1,10 @@
-import asyncio
 import logging
-import os
-import shutil
 import zipfile
-from pathlib import Path
+from pathlib import PurePosixPath
 from fastapi import UploadFile
 
 from app.settings import get_settings
+from app.services.blob_store import get_blob_store
 
 settings = get_settings()
 logger = logging.getLogger(__name__)
@@ -14,77 +12,66 @@ logger = logging.getLogger(__name__)
 
 class UploadPdfService:
     """
-    Service for handling the upload and extraction of PDF files, including those within zip archives.
+    Service for handling the upload of PDF files, including those within zip archives.
+    Files are stored in the content-addressed blob store, referenced by the ingestion job, and identified by
+    their hash in the rest of the pipeline.
     """
 
-    def __init__(self):
-        self.save_dir = Path(settings.EXTRACTED_FILES_DIR)
-        self.save_dir.mkdir(parents=True, exist_ok=True)
+    def __init__(self, blob_store=None):
+        """
+        :param blob_store: Store of the uploaded files. Defaults to the process-wide blob store.
+        """
+        self.blob_store = blob_store or get_blob_store()
+
+    @staticmethod
+    def _is_pdf_member(name: str) -> bool:
+        path = PurePosixPath(name)
+        return (path.suffix.lower() == '.pdf' and '__MACOSX' not in path.parts
+                and not path.name.startswith('.'))
 
-    async def _save_pdf(self, file: UploadFile) -> list[Path]:
+    def _save_pdf(self, file: UploadFile, job_id: str) -> dict[str, str]:
         """
-        Saves a single uploaded PDF file to disk.
+        Stores a single uploaded PDF file.
         """
         try:
-            pdf_path = self.save_dir / Path(file.filename)
-            content = await file.read()
-            await asyncio.to_thread(self._write_file, pdf_path, content)
-            return [pdf_path]
+            file.file.seek(0)
+            return {self.blob_store.put_stream(file.file, job_id, name=file.filename): file.filename}
         except Exception as e:
             logger.error(f"Error saving PDF file: {e}")
             raise
 
-    async def _save_zipped_files(self, file: UploadFile) -> list[Path]:
+    def _save_zipped_files(self, file: UploadFile, job_id: str) -> dict[str, str]:
         """
-        Extracts PDF files from a zip and saves them in parallel.
+        Stores the PDF files of a zip. Members are streamed from the uploaded file to the store,
+        the zip is never extracted on disk, so same-named files of different zips do not collide.
         """
-        temp_zip_file_path = self.save_dir / Path(file.filename)
         try:
-            content = await file.read()
-            await asyncio.to_thread(self._write_file, temp_zip_file_path, content)
-
-            extracted_pdf_names = []
-
-            # Extract the zip file
-            with zipfile.ZipFile(temp_zip_file_path, 'r') as zip_ref:
-                zip_ref.extractall(self.save_dir)
-                for name in zip_ref.namelist():
-                    if name.endswith('.pdf') and '__MACOSX' not in name and not name.startswith('.'):
-                        extracted_pdf_names.append(name)
-
-            # Create tasks to get file paths in parallel
-            tasks = [
-                asyncio.to_thread(lambda name=name: self.save_dir / name)
-                for name in extracted_pdf_names
-            ]
-            pdf_paths = await asyncio.gather(*tasks)
-
-            # Remove __MACOSX directory if present
-            macosx_dir = self.save_dir / '__MACOSX'
-            if macosx_dir.exists():
-                shutil.rmtree(macosx_dir)
-
-            return pdf_paths
+            file.file.seek(0)
+            stored_files = {}
+            with zipfile.ZipFile(file.file, 'r') as zip_ref:
+                for member in zip_ref.infolist():
+                    if member.is_dir() or not self._is_pdf_member(member.filename):
+                        continue
+                    with zip_ref.open(member) as member_file:
+                        blob_hash = self.blob_store.put_stream(member_file, job_id, name=member.filename)
+                    stored_files.setdefault(blob_hash, member.filename)
+            return stored_files
         except Exception as e:
             logger.error(f"Error processing ZIP file: {e}")
             raise
-        finally:
-            if temp_zip_file_path.exists():
-                os.remove(temp_zip_file_path)
 
-    @staticmethod
-    def _write_file(path: Path, content: bytes):
-        """
-        Helper to write file content to disk.
+    def upload(self, file: UploadFile, job_id: str) -> dict[str, str]:
         """
-        with open(path, 'wb') as f:
-            f.write(content)
+        Store the uploaded PDF, or the PDFs of the uploaded zip, referenced by an ingestion job.
+        The references are released with `blob_store.release(job_id)` once the job no longer needs the files.
 
-    def upload(self, file: UploadFile) -> list[Path]:
-        """
-        Synchronous wrapper for async file processing logic.
+        :param file: The uploaded PDF or ZIP file.
+        :param job_id: The ingestion job using the files.
+        :return dict: Original file name by blob hash, identical files are stored and returned once.
         """
         if file.filename.endswith('.zip'):
-            return asyncio.run(self._save_zipped_files(file))
+            stored_files = self._save_zipped_files(file, job_id)
         else:
-            return asyncio.run(self._save_pdf(file))
+            stored_files = self._save_pdf(file, job_id)
+        self.blob_store.maybe_gc()
+        return stored_files
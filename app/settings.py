@@ -11,9 +11,22 @@ class Settings(BaseSettings):
     )
 
     EXTRACTED_FILES_DIR: str = "extracted_files"
+    # Content-addressed store of the uploaded files in EXTRACTED_FILES_DIR, see app/services/blob_store.py
+    BLOB_STORE_MAX_BYTES: int = 10 * 1024 ** 3
+    BLOB_GC_MIN_AGE_SECONDS: float = 24 * 3600.0
+    BLOB_GC_INTERVAL_SECONDS: float = 600.0
+    BLOB_REF_TTL_SECONDS: float = 7 * 24 * 3600.0
+    BLOB_TEMP_MAX_AGE_SECONDS: float = 3600.0
 
     INFORMATION_EXTRACTION_MODEL: str = "gemini-2.0-flash"
     INFORMATION_EXTRACTION_PROMPT_FILE_PATH: str = "prompts/information_extraction.yaml"
+    EXTRACTION_MAX_ATTEMPTS: int = 3
+    EXTRACTION_RETRY_BACKOFF_SECONDS: float = 2.0
+    CHECKPOINT_DIR: str = "checkpoints"
+    CHUNKED_EXTRACTION_ENABLED: bool = False
+    EXTRACTION_CHUNK_PAGES: int = 4
+    MODEL_MAX_CONCURRENT_REQUESTS: int = 8
+    MODEL_REQUESTS_PER_MINUTE: int = 60
 
     DB_AGENT_MODEL: str = "gemini-2.0-flash"
     DB_AGENT_PROMPT_FILE_PATH: str = "prompts/db_agent.yaml"
@@ -23,12 +36,187 @@ class Settings(BaseSettings):
     SUPER_AGENT_PROMPT_FILE_PATH: str = "prompts/super_agent.yaml"
     MAX_LOOPS: int = 3
 
-    API_KEY: str
-    GOOGLE_APPLICATION_CREDENTIALS: str
-    FIREBASE_COLLECTION_NAME: str
-    OPIK_API_KEY: str
-    OPIK_WORKSPACE: str
-    OPIK_PROJECT_NAME: str
+    # Chat sessions, see app/services/session_store.py
+    SESSION_TTL_SECONDS: float = 1800.0
+    SESSION_MAX_SESSIONS: int = 1000
+    SESSION_MAX_BYTES: int = 4 * 1024 * 1024
+    SESSION_MAX_TURNS: int = 10
+    SESSION_TURN_SUMMARY_CHARS: int = 600
+
+    # Paper digests generated at ingest time, see app/services/paper_digest_service.py
+    PAPER_DIGEST_ENABLED: bool = True
+    PAPER_DIGEST_MODEL: str = "gemini-2.0-flash"
+    PAPER_DIGEST_PROMPT_FILE_PATH: str = "prompts/paper_digest.yaml"
+    PAPER_DIGEST_MAX_INPUT_CHARS: int = 200000
+
+    # Model cascade routing, see app/services/model_router.py. When enabled, the tiers replace the models
+    # configured per agent and for the extraction (SUPER_AGENT_MODEL, INFORMATION_EXTRACTION_MODEL, ...)
+    MODEL_ROUTING_ENABLED: bool = False
+    MODEL_TIERS: dict[str, str] = {
+        "small": "gemini-2.0-flash-lite",
+        "standard": "gemini-2.0-flash",
+        "large": "gemini-2.5-flash",
+    }
+    MODEL_TIER_ORDER: list[str] = ["small", "standard", "large"]
+    MODEL_ROUTING_BASELINE_TIER: str = "standard"
+    MODEL_ROUTING_POLICIES: dict[str, dict] = {
+        "routing": {"tier": "small", "max_prompt_chars": 12000},
+        "validation": {"tier": "small", "max_prompt_chars": 12000},
+        "code_generation": {"tier": "standard"},
+        "metadata_extraction": {"tier": "small"},
+        "tables_and_figures_extraction": {"tier": "standard", "max_prompt_chars": 120000},
+        "content_data_extraction": {"tier": "standard", "max_prompt_chars": 120000},
+        "paper_digest": {"tier": "small"},
+    }
+    # Agent responses with a "confidence" field below this value are escalated to the next tier
+    MODEL_ROUTING_MIN_CONFIDENCE: float = 0.5
+    # Uploaded PDFs count as this many characters per page in the prompt size of an extraction
+    MODEL_ROUTING_CHARS_PER_PAGE: int = 3000
+
+    # Batch queries, see app/services/batch_query_service.py
+    CHATBOT_BATCH_MAX_QUERIES: int = 500
+    CHATBOT_BATCH_MAX_CONCURRENCY: int = 8
+
+    # Deadlines and hedged model calls, see app/services/hedging.py
+    CHATBOT_REQUEST_DEADLINE_SECONDS: float = 120.0
+    PDF_UPLOAD_REQUEST_DEADLINE_SECONDS: float = 900.0
+    MODEL_CALL_TIMEOUT_SECONDS: float = 90.0
+    HEDGING_ENABLED: bool = True
+    HEDGING_PERCENTILE: float = 0.95
+    HEDGING_MIN_SAMPLES: int = 20
+    HEDGING_LATENCY_WINDOW: int = 200
+    HEDGING_MAX_RATE: float = 0.1
+    HEDGING_MAX_WORKERS: int = 32
+
+    # Tracing of the request path, see app/services/tracing.py. The opik exporter is disabled without the OPIK_* settings.
+    TRACING_ENABLED: bool = True
+    TRACING_EXPORTER: str = "opik"  # "opik", "otlp" or "jsonl"
+    # Share of the traces recorded with their inputs and outputs
+    TRACING_SAMPLE_RATE: float = 0.1
+    # Other traces are only exported, without payloads, if they failed or were slower than this
+    TRACING_TAIL_LATENCY_SECONDS: float = 30.0
+    TRACING_MAX_PAYLOAD_CHARS: int = 2000
+    TRACING_MAX_SPANS_PER_TRACE: int = 500
+    TRACING_QUEUE_SIZE: int = 1000
+    TRACING_BATCH_SIZE: int = 200
+    TRACING_JSONL_PATH: str = "traces/spans.jsonl"
+    TRACING_OTLP_ENDPOINT: str = "http://localhost:4318/v1/traces"
+    TRACING_OTLP_HEADERS: dict = {}
+    TRACING_SERVICE_NAME: str = "scientific-chatbot"
+
+    # On-demand profiling of single requests, see app/services/profiling.py. Enabled when ADMIN_TOKEN is set.
+    PROFILING_DIR: str = "profiles"
+    PROFILING_MAX_PROFILES: int = 50
+    PROFILING_SAMPLE_INTERVAL_SECONDS: float = 0.005
+    PROFILING_TRACEMALLOC_FRAMES: int = 1
+
+    # Admission control of the LLM-heavy endpoints, see app/services/admission_control.py
+    ADMISSION_CONTROL_ENABLED: bool = True
+    ADMISSION_MAX_CONCURRENCY: int = 16
+    # Lower priority values are served first. Ingest is capped below the total so chat always has free slots,
+    # and has a reserved slot so it is not starved by a sustained chat overload.
+    ADMISSION_CLASSES: dict = {
+        "chat": {"priority": 0, "max_concurrency": 16, "max_queue": 64, "max_wait_seconds": 20.0,
+                 "client_max_concurrency": 4, "initial_service_seconds": 10.0},
+        "ingest": {"priority": 1, "max_concurrency": 4, "max_queue": 16, "max_wait_seconds": 120.0,
+                   "client_max_concurrency": 2, "initial_service_seconds": 60.0, "reserved_concurrency": 1},
+        # Queries of /chatbot/batch, each one takes a slot. Batches are clients, waiting for slots instead of being shed.
+        "batch": {"priority": 2, "max_concurrency": 8, "max_queue": 1000, "max_wait_seconds": 600.0,
+                  "client_max_concurrency": 8, "initial_service_seconds": 10.0},
+    }
+    ADMISSION_ROUTES: dict = {
+        "/chatbot": "chat",
+        "/pdf_upload": "ingest",
+    }
+    ADMISSION_CLIENT_HEADER: str = "X-Client-Id"
+
+    # Firestore document limit is 1 MiB, heavy document parts are chunked well below it
+    DB_CHUNK_MAX_BYTES: int = 256 * 1024
+    DB_BATCH_MAX_WRITES: int = 400
+
+    INGEST_QUEUE_PATH: str = "ingest_queue/tasks.sqlite3"
+    WORKER_PROCESSES: int = 2
+    WORKER_POLL_INTERVAL_SECONDS: float = 2.0
+    WORKER_TASK_LEASE_SECONDS: int = 1800
+    # The lease of a running task is renewed at this interval, for at most WORKER_TASK_MAX_SECONDS so that
+    # the task of a hung worker expires and is claimed again
+    WORKER_TASK_HEARTBEAT_SECONDS: int = 60
+    WORKER_TASK_MAX_SECONDS: int = 4 * 3600
+    WORKER_MAX_ATTEMPTS: int = 3
+
+    BATCH_JOBS_DIR: str = "batch_jobs"
+    BATCH_POLL_INTERVAL_SECONDS: float = 60.0
+    # A job left collecting longer than this (e.g. the polling process crashed) is collected again by the next poll
+    BATCH_COLLECT_LEASE_SECONDS: int = 1800
+
+    WARM_UP_ON_STARTUP: bool = True
+
+    # JSON responses are gzip-compressed above this size when the client accepts it
+    RESPONSE_GZIP_MIN_BYTES: int = 64 * 1024
+    RESPONSE_GZIP_LEVEL: int = 5
+
+    # Columnar corpus snapshot shared by the worker processes, see app/services/corpus_snapshot.py
+    CORPUS_SNAPSHOT_ENABLED: bool = True
+    CORPUS_SNAPSHOT_PATH: str = "corpus_snapshot/corpus.col"
+    CORPUS_SNAPSHOT_REFRESH_SECONDS: float = 300.0
+
+    # Citation graph built at ingest time from the extracted references, see app/services/citation_graph.py
+    CITATION_GRAPH_ENABLED: bool = True
+    CITATION_GRAPH_PATH: str = "citation_graph/graph.bin"
+    CITATION_GRAPH_COMPACT_RECORDS: int = 1000
+    CITATION_MATCH_THRESHOLD: float = 0.9
+
+    # Typed store of the extracted tables for numeric questions, see app/services/table_store.py
+    TABLE_STORE_ENABLED: bool = True
+    TABLE_STORE_PATH: str = "table_store/tables.sqlite3"
+    TABLE_STORE_CACHE_KIB: int = 64 * 1024
+
+    # Backfill of a changed recipe over the stored documents, see app/services/recipe_backfill.py.
+    # Model calls also go through the model request limiter (MODEL_MAX_CONCURRENT_REQUESTS, MODEL_REQUESTS_PER_MINUTE).
+    RECIPE_BACKFILL_MAX_CONCURRENCY: int = 4
+
+    # Cache shared by the processes (sqlite) or the nodes (redis) of the service, see app/services/cache.py
+    CACHE_BACKEND: str = "memory"
+    CACHE_PATH: str = "cache/cache.sqlite3"
+    CACHE_URL: str = "redis://localhost:6379/0"
+    CACHE_TIMEOUT_SECONDS: float = 1.0
+    CACHE_MAX_BYTES: int = 512 * 1024 * 1024
+    CACHE_DEFAULT_TTL_SECONDS: float = 7 * 24 * 3600.0
+    CACHE_COMPRESS_MIN_BYTES: int = 1024
+    EXTRACTION_CACHE_TTL_SECONDS: float = 30 * 24 * 3600.0
+    URL_FETCH_CACHE_TTL_SECONDS: float = 24 * 3600.0
+
+    # Secrets are validated per subsystem when the subsystem is first used, see SUBSYSTEM_SETTINGS,
+    # so the API can start (and answer /health) before every secret is available.
+    API_KEY: str | None = None
+    GOOGLE_APPLICATION_CREDENTIALS: str | None = None
+    FIREBASE_COLLECTION_NAME: str | None = None
+    OPIK_API_KEY: str | None = None
+    OPIK_WORKSPACE: str | None = None
+    OPIK_PROJECT_NAME: str | None = None
+    # Token of the admin-only features (X-Admin-Token header), disabled if not set
+    ADMIN_TOKEN: str | None = None
+
+    def validate_subsystem(self, subsystem: str):
+        """
+        Check that the settings required by a subsystem are set.
+
+        :param subsystem: One of SUBSYSTEM_SETTINGS.
+        :raises ValueError: If a required setting is missing.
+        """
+        missing_settings = [name for name in SUBSYSTEM_SETTINGS[subsystem] if not getattr(self, name)]
+        if missing_settings:
+            raise ValueError(f"Missing settings for the {subsystem} subsystem: {', '.join(missing_settings)}")
+
+    def is_subsystem_configured(self, subsystem: str) -> bool:
+        return all(getattr(self, name) for name in SUBSYSTEM_SETTINGS[subsystem])
+
+
+SUBSYSTEM_SETTINGS = {
+    "model": ("API_KEY",),
+    "database": ("GOOGLE_APPLICATION_CREDENTIALS", "FIREBASE_COLLECTION_NAME"),
+    "tracing": ("OPIK_API_KEY", "OPIK_WORKSPACE", "OPIK_PROJECT_NAME"),
+}
 
 @lru_cache
 def get_settings() -> Settings:
@@ -41,7 +229,9 @@ def get_settings() -> Settings:
 
 def load_env():
     settings = get_settings()
-    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = settings.GOOGLE_APPLICATION_CREDENTIALS
-    os.environ["OPIK_API_KEY"] = settings.OPIK_API_KEY
-    os.environ["OPIK_WORKSPACE"] = settings.OPIK_WORKSPACE
-    os.environ["OPIK_PROJECT_NAME"] = settings.OPIK_PROJECT_NAME
+    if settings.GOOGLE_APPLICATION_CREDENTIALS:
+        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = settings.GOOGLE_APPLICATION_CREDENTIALS
+    if settings.is_subsystem_configured("tracing"):
+        os.environ["OPIK_API_KEY"] = settings.OPIK_API_KEY
+        os.environ["OPIK_WORKSPACE"] = settings.OPIK_WORKSPACE
+        os.environ["OPIK_PROJECT_NAME"] = settings.OPIK_PROJECT_NAME
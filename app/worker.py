@@ -0,0 +1,139 @@
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import uuid
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.settings import get_settings, load_env
+from app.services.task_queue import IngestionTaskQueue
+
+settings = get_settings()
+logger = logging.getLogger(__name__)
+
+
+def _configure_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(processName)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.StreamHandler()],
+    )
+
+
+def worker_loop(worker_index: int, stop_event):
+    """
+    Worker process main loop: claims ingestion tasks, extracts information and writes it to the database.
+    Every process creates its own model and database clients.
+
+    :param worker_index: Index of the worker process.
+    :param stop_event: Event set by the parent process to request a graceful shutdown.
+    """
+    _configure_logging()
+    load_env()
+    # The parent process handles the signals and sets the stop event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Heavy SDK clients are created after the fork/spawn, inside the worker process
+    from app.services.pdf_information_extraction_service import PdfInformationExtractionService
+    from app.services.db_service import DatabaseService
+    from app.services.paper_digest_service import PaperDigestService
+    from app.services.blob_store import get_blob_store
+    from app.services.citation_graph import get_citation_graph_store
+    from app.services.table_store import get_table_store
+
+    worker_id = f"{os.uname().nodename}-{os.getpid()}-{worker_index}"
+    task_queue = IngestionTaskQueue()
+    extraction_service = PdfInformationExtractionService()
+    db_service = DatabaseService()
+    paper_digest_service = PaperDigestService(db_service=db_service)
+    blob_store = get_blob_store()
+    logger.info(f"Worker {worker_id} started.")
+
+    while not stop_event.is_set():
+        task = task_queue.claim(worker_id)
+        if task is None:
+            stop_event.wait(settings.WORKER_POLL_INTERVAL_SECONDS)
+            continue
+        logger.info(f"Worker {worker_id} processing task {task['id']}: {task['file_path']}")
+        try:
+            with task_queue.heartbeat(task):
+                document = asyncio.run(extraction_service.execute(Path(task["file_path"])))
+                document, = paper_digest_service.add_digests([document])
+                db_service.add_documents([document])
+                get_citation_graph_store().add_papers([document])
+                get_table_store().add_documents([document])
+            task_queue.complete(task["id"], document.title)
+        except Exception as e:
+            logger.error(f"Worker {worker_id} failed task {task['id']}: {e}")
+            task_queue.fail(task["id"], str(e))
+        # The uploaded files of a job are released once its last task is finished
+        if task_queue.is_job_finished(task["job_id"]):
+            blob_store.release(task["job_id"])
+            blob_store.maybe_gc()
+    logger.info(f"Worker {worker_id} stopped.")
+
+
+def run_workers(processes: int):
+    """
+    Start worker processes and wait until they are stopped with SIGINT/SIGTERM.
+
+    :param processes: Number of worker processes.
+    """
+    context = multiprocessing.get_context("spawn")
+    stop_event = context.Event()
+
+    def request_stop(signum, frame):
+        logger.info("Stopping workers after their current task.")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGTERM, request_stop)
+
+    workers = [
+        context.Process(target=worker_loop, args=(index, stop_event), name=f"ingest-worker-{index}")
+        for index in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestion worker for the Scientific Chatbot.")
+    subparsers = parser.add_subparsers(dest="command")
+    run_parser = subparsers.add_parser("run", help="Run worker processes (default).")
+    run_parser.add_argument("--processes", type=int, default=settings.WORKER_PROCESSES,
+                            help="Number of worker processes.")
+    enqueue_parser = subparsers.add_parser("enqueue", help="Enqueue PDF files for ingestion.")
+    enqueue_parser.add_argument("paths", nargs="+", help="PDF files or directories containing PDF files.")
+    status_parser = subparsers.add_parser("status", help="Show the tasks of an ingestion job.")
+    status_parser.add_argument("job_id")
+    args = parser.parse_args()
+
+    _configure_logging()
+    if args.command == "enqueue":
+        file_paths = []
+        for path in map(Path, args.paths):
+            file_paths.extend(sorted(path.rglob("*.pdf")) if path.is_dir() else [path])
+        # Files are copied to the blob store, so the originals can be moved or deleted once enqueued
+        from app.services.blob_store import get_blob_store
+
+        blob_store = get_blob_store()
+        job_id = uuid.uuid4().hex
+        blob_paths = list(dict.fromkeys(blob_store.path(blob_store.put_file(path, job_id)) for path in file_paths))
+        print(IngestionTaskQueue().enqueue(blob_paths, job_id=job_id))
+    elif args.command == "status":
+        for task in IngestionTaskQueue().get_job(args.job_id):
+            print(f"{task['id']}\t{task['status']}\t{task['attempts']}\t{task['file_path']}\t{task['result'] or task['error'] or ''}")
+    else:
+        run_workers(getattr(args, "processes", settings.WORKER_PROCESSES))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,138 @@
+"""
+Goodput of the LLM-heavy endpoints under overload, with and without admission control.
+
+A fake backend serves at most `--capacity` requests at once (the model API quota), chat requests take
+`--chat-seconds` and ingest requests `--ingest-seconds`. Chat and ingest requests arrive at a fixed rate,
+above the capacity of the backend, and clients give up after `--client-timeout` seconds.
+Goodput is the rate of successful responses received before the client timeout.
+
+Without admission control every request is queued in the threadpool: latencies grow until most responses
+arrive after the clients gave up, while the backend keeps working on them. With admission control the
+excess is shed with 503 + Retry-After and the admitted requests are answered in time.
+
+Usage:
+    python benchmarks/admission_load_test.py --duration 5 --chat-rate 150 --ingest-rate 10
+"""
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+import httpx
+from fastapi import FastAPI
+
+from app.services.admission_control import AdmissionController, AdmissionControlMiddleware
+
+
+def build_app(capacity: int, chat_seconds: float, ingest_seconds: float, controller: AdmissionController | None):
+    backend = threading.Semaphore(capacity)
+    app = FastAPI()
+
+    @app.post("/chatbot")
+    def chatbot():
+        with backend:
+            time.sleep(chat_seconds)
+        return {"response": "ok"}
+
+    @app.post("/pdf_upload")
+    def pdf_upload():
+        with backend:
+            time.sleep(ingest_seconds)
+        return {"documents": []}
+
+    if controller is not None:
+        app.add_middleware(AdmissionControlMiddleware, controller=controller,
+                           routes={"/chatbot": "chat", "/pdf_upload": "ingest"})
+    return app
+
+
+async def run_load(app, args) -> dict:
+    results = {"chat": [], "ingest": []}
+    generator = random.Random(args.seed)
+    transport = httpx.ASGITransport(app=app)
+
+    async def send(client: httpx.AsyncClient, kind: str, path: str):
+        start_time = time.monotonic()
+        try:
+            response = await asyncio.wait_for(
+                client.post(path, headers={"X-Client-Id": f"client-{generator.randrange(args.clients)}"}),
+                timeout=args.client_timeout)
+            status = response.status_code
+        except asyncio.TimeoutError:
+            status = "timeout"
+        results[kind].append((status, time.monotonic() - start_time))
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+        tasks = []
+        start_time = time.monotonic()
+        next_chat, next_ingest = start_time, start_time
+        while time.monotonic() - start_time < args.duration:
+            now = time.monotonic()
+            if now >= next_chat:
+                tasks.append(asyncio.create_task(send(client, "chat", "/chatbot")))
+                next_chat += generator.expovariate(args.chat_rate)
+            if now >= next_ingest:
+                tasks.append(asyncio.create_task(send(client, "ingest", "/pdf_upload")))
+                next_ingest += generator.expovariate(args.ingest_rate)
+            await asyncio.sleep(min(next_chat, next_ingest) - time.monotonic() if min(next_chat, next_ingest) > now else 0)
+        await asyncio.gather(*tasks)
+    return results
+
+
+def report(name: str, results: dict, duration: float):
+    print(name)
+    for kind, outcomes in results.items():
+        good_latencies = [latency for status, latency in outcomes if status == 200]
+        shed = sum(1 for status, _ in outcomes if status in (429, 503))
+        timeouts = sum(1 for status, _ in outcomes if status == "timeout")
+        p95 = statistics.quantiles(good_latencies, n=20)[-1] if len(good_latencies) > 1 else float("nan")
+        print(f"  {kind:<7} sent {len(outcomes):>5}  goodput {len(good_latencies) / duration:>7.1f}/s  "
+              f"shed {shed:>5}  timed out {timeouts:>5}  p95 {p95 * 1000:>8.0f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Goodput under overload with and without admission control.")
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--chat-rate", type=float, default=150.0, help="Chat requests per second.")
+    parser.add_argument("--ingest-rate", type=float, default=10.0, help="Ingest requests per second.")
+    parser.add_argument("--capacity", type=int, default=8, help="Requests the fake backend serves at once.")
+    parser.add_argument("--chat-seconds", type=float, default=0.1)
+    parser.add_argument("--ingest-seconds", type=float, default=0.4)
+    parser.add_argument("--client-timeout", type=float, default=2.0)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    logging.getLogger("app.services.admission_control").setLevel(logging.ERROR)
+
+    capacity = args.capacity / args.chat_seconds
+    print(f"backend capacity ~{capacity:.0f} chat requests/s, offered {args.chat_rate:.0f} chat "
+          f"+ {args.ingest_rate:.0f} ingest requests/s for {args.duration:.0f}s")
+
+    app = build_app(args.capacity, args.chat_seconds, args.ingest_seconds, controller=None)
+    report("without admission control", asyncio.run(run_load(app, args)), args.duration)
+
+    controller = AdmissionController(
+        classes={
+            "chat": {"priority": 0, "max_concurrency": args.capacity, "max_queue": 4 * args.capacity,
+                     "max_wait_seconds": args.client_timeout / 2, "client_max_concurrency": 4,
+                     "initial_service_seconds": args.chat_seconds},
+            "ingest": {"priority": 1, "max_concurrency": max(1, args.capacity // 4), "max_queue": args.capacity,
+                       "max_wait_seconds": args.client_timeout / 2, "client_max_concurrency": 2,
+                       "initial_service_seconds": args.ingest_seconds, "reserved_concurrency": 1},
+        },
+        max_concurrency=args.capacity,
+    )
+    app = build_app(args.capacity, args.chat_seconds, args.ingest_seconds, controller=controller)
+    report("with admission control", asyncio.run(run_load(app, args)), args.duration)
+    print(f"  metrics {controller.to_dict()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Runtime and Firestore reads of a batch of overlapping queries, answered one by one and with /chatbot/batch.
+
+A fake Firestore answers reads after `--read-seconds` and counts them, and a fake chatbot takes `--llm-seconds`
+per query and reads the papers named in its query, like the database agent does. Queries name `--papers-per-query`
+papers drawn from a small corpus, so most papers are shared by several queries, and some queries are repeated.
+
+Answered one by one, every query reads its papers again. The batch service answers the distinct queries
+concurrently, fetches the named papers once before the agents run, and shares them through a document cache.
+
+Usage:
+    python benchmarks/batch_query.py --queries 100 --papers 20
+"""
+import argparse
+import asyncio
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.services.batch_query_service import BatchQueryService
+from app.services.corpus_snapshot import CorpusSnapshotStore, write_snapshot
+from app.services.db_service import DatabaseService
+
+
+class FakeSnapshot:
+    def __init__(self, collection, title):
+        self.collection = collection
+        self.exists = title in collection.titles
+        self.title = title
+
+    def to_dict(self):
+        return {"title": self.title, "authors": ["A. Author"], "part_counts": {}}
+
+
+class FakeDocumentReference:
+    def __init__(self, collection, title):
+        self.collection = collection
+        self.title = title
+
+    def get(self):
+        with self.collection.lock:
+            self.collection.reads += 1
+        time.sleep(self.collection.read_seconds)
+        return FakeSnapshot(self.collection, self.title)
+
+
+class FakeCollection:
+    def __init__(self, titles: list[str], read_seconds: float):
+        self.titles = set(titles)
+        self.read_seconds = read_seconds
+        self.reads = 0
+        self.lock = threading.Lock()
+
+    def document(self, title: str):
+        return FakeDocumentReference(self, title)
+
+
+class FakeFirestore:
+    def __init__(self, collection: FakeCollection):
+        self._collection = collection
+
+    def collection(self, name: str):
+        return self._collection
+
+
+class FakeChatbotService:
+    def __init__(self, titles: list[str], llm_seconds: float):
+        self.titles = titles
+        self.llm_seconds = llm_seconds
+
+    def get_response(self, query: str, db_service=None, session=None, shared_documents=None) -> str:
+        found = [title for title in self.titles if title.lower() in query.lower()
+                 and db_service.get_document(title) is not None]
+        time.sleep(self.llm_seconds)
+        return f"Answer based on {len(found)} papers."
+
+
+def build_queries(titles: list[str], args) -> list[str]:
+    generator = random.Random(args.seed)
+    queries = []
+    for _ in range(args.queries):
+        if queries and generator.random() < args.duplicate_ratio:
+            queries.append(generator.choice(queries).upper())
+        else:
+            papers = generator.sample(titles, args.papers_per_query)
+            queries.append(f"Compare the methods of {' and '.join(papers)}?")
+    return queries
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch of overlapping queries, one by one and with shared retrieval.")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--papers", type=int, default=20, help="Papers of the corpus.")
+    parser.add_argument("--papers-per-query", type=int, default=3)
+    parser.add_argument("--duplicate-ratio", type=float, default=0.2)
+    parser.add_argument("--read-seconds", type=float, default=0.05, help="Latency of a Firestore read.")
+    parser.add_argument("--llm-seconds", type=float, default=0.2, help="Latency of the agents answering a query.")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    titles = [f"Scientific Paper Number {index:04d}" for index in range(args.papers)]
+    queries = build_queries(titles, args)
+    collection = FakeCollection(titles, args.read_seconds)
+    db_service = DatabaseService.__new__(DatabaseService)
+    db_service.db = FakeFirestore(collection)
+    db_service.collection_name = "benchmark"
+
+    def chatbot_service_factory():
+        return FakeChatbotService(titles, args.llm_seconds)
+
+    start_time = time.perf_counter()
+    for query in queries:
+        chatbot_service_factory().get_response(query, db_service=db_service)
+    print(f"one by one   {time.perf_counter() - start_time:>7.2f} s  firestore reads {collection.reads:>5}")
+
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        snapshot_path = Path(snapshot_dir) / "corpus.col"
+        write_snapshot([{"title": title, "authors": ["A. Author"]} for title in titles], snapshot_path)
+        service = BatchQueryService(db_service=db_service, chatbot_service_factory=chatbot_service_factory,
+                                    snapshot_store=CorpusSnapshotStore(snapshot_path), admission_controller=None,
+                                    max_concurrency=args.concurrency)
+
+        async def run_batch() -> list[dict]:
+            return [record async for record in service.astream(queries)]
+
+        collection.reads = 0
+        start_time = time.perf_counter()
+        records = asyncio.run(run_batch())
+        print(f"batch        {time.perf_counter() - start_time:>7.2f} s  firestore reads {collection.reads:>5}")
+        print(f"  plan {dict(records[0]['plan'], planned_documents=len(records[0]['plan']['planned_documents']))}")
+        print(f"  summary {records[-1]['summary']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Latency and hit rate of the cache backends.
+
+A recipe-sized value is written and read back with every backend (memory, SQLite, and the Redis protocol client
+against the stand-in server of app/services/cache.py), then several worker processes look up keys drawn from a
+skewed distribution, computing and caching the missing ones, as uvicorn workers extracting the same papers would.
+With the memory backend every worker has its own cache, with the shared backends a value computed by one worker
+is a hit for the others.
+
+Usage:
+    python benchmarks/cache_backends.py --workers 4 --lookups 2000
+"""
+import argparse
+import multiprocessing
+import random
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.services.cache import (
+    Cache,
+    MemoryCacheBackend,
+    RespCacheBackend,
+    RespServer,
+    SQLiteCacheBackend,
+)
+from app.services.recipe import TableRecipe, TablesAndFiguresRecipe
+
+
+def make_backend(spec: tuple):
+    name, location = spec
+    if name == "memory":
+        return MemoryCacheBackend()
+    if name == "sqlite":
+        return SQLiteCacheBackend(location)
+    return RespCacheBackend(location)
+
+
+def sample_recipe(generator: random.Random) -> TablesAndFiguresRecipe:
+    tables = [TableRecipe(table_caption=f"Results {index}",
+                          table_content="\n".join("| " + " | ".join(f"{generator.uniform(0, 100):.1f}" for _ in range(6))
+                                                  + " |" for _ in range(20)))
+              for index in range(6)]
+    return TablesAndFiguresRecipe(tables=tables, figures=[])
+
+
+def time_operations(spec: tuple, repeat: int) -> tuple[float, float, int]:
+    cache = Cache(make_backend(spec), "benchmark", "latency")
+    recipe = sample_recipe(random.Random(7))
+    start_time = time.perf_counter()
+    for index in range(repeat):
+        cache.set(("paper", index), recipe)
+    set_seconds = (time.perf_counter() - start_time) / repeat
+    start_time = time.perf_counter()
+    for index in range(repeat):
+        cache.get(("paper", index), model=TablesAndFiguresRecipe)
+    get_seconds = (time.perf_counter() - start_time) / repeat
+    return set_seconds, get_seconds, len(cache.backend.get(cache.key(("paper", 0))))
+
+
+def worker(args: tuple) -> tuple[int, int]:
+    spec, worker_index, lookups, keys, run_id = args
+    cache = Cache(make_backend(spec), "benchmark", run_id)
+    generator = random.Random(worker_index)
+    weights = [1 / (rank + 1) for rank in range(keys)]
+    value = {"result": "x" * 2000}
+    for key in generator.choices(range(keys), weights=weights, k=lookups):
+        if cache.get(key) is None:
+            cache.set(key, value)
+    return cache.stats["hits"], cache.stats["misses"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency and hit rate of the cache backends.")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--lookups", type=int, default=2000, help="Lookups per worker.")
+    parser.add_argument("--keys", type=int, default=2000, help="Distinct keys.")
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as cache_dir, RespServer(("127.0.0.1", 0)) as server:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        specs = {
+            "memory": ("memory", None),
+            "sqlite": ("sqlite", str(Path(cache_dir) / "cache.sqlite3")),
+            "redis (stand-in)": ("redis", f"redis://127.0.0.1:{server.server_address[1]}/0"),
+        }
+        recipe_bytes = len(sample_recipe(random.Random(7)).model_dump_json())
+        print(f"recipe: {recipe_bytes} bytes as JSON")
+        for name, spec in specs.items():
+            set_seconds, get_seconds, stored_bytes = time_operations(spec, args.repeat)
+            print(f"{name:<18} set {set_seconds * 1e6:>8.1f} us  get {get_seconds * 1e6:>8.1f} us  "
+                  f"{stored_bytes} bytes stored")
+
+        with multiprocessing.get_context("fork").Pool(args.workers) as pool:
+            for name, spec in specs.items():
+                results = pool.map(worker, [(spec, index, args.lookups, args.keys, f"hit-rate-{name}")
+                                            for index in range(args.workers)])
+                hits = sum(result[0] for result in results)
+                lookups = sum(result[0] + result[1] for result in results)
+                print(f"{name:<18} hit rate {hits / lookups:>6.1%} over {args.workers} workers")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Build time, size and lookup latency of the citation graph.
+
+A synthetic corpus cites works drawn from a skewed pool, and a fraction of the reference titles is perturbed
+(case, punctuation, a dropped character) like the titles extracted by the model. The graph is built by adding the
+papers one by one, as at ingest time, then compacted, written and loaded back. Lookups are timed on the loaded
+graph and compared with a scan of the references of every paper, the work done by the code the db_agent writes
+without the graph.
+
+Usage:
+    python benchmarks/citation_graph_query.py --papers 5000 --references 30
+"""
+import argparse
+import random
+import string
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.services.citation_graph import CitationGraph, normalize_title
+
+
+def perturb(title: str, generator: random.Random) -> str:
+    variant = generator.randrange(3)
+    if variant == 0:
+        return title.lower() + "."
+    if variant == 1:
+        return title.replace(" ", "  ").replace("-", " ")
+    position = generator.randrange(len(title))
+    return title[:position] + title[position + 1:]
+
+
+def synthetic_corpus(papers: int, works: int, references: int, noise: float, seed: int) -> list[dict]:
+    generator = random.Random(seed)
+    words = ["".join(generator.choices(string.ascii_lowercase, k=generator.randint(4, 10))) for _ in range(3000)]
+    pool = [" ".join(generator.choices(words, k=generator.randint(5, 12))).title() for _ in range(works)]
+    weights = [1 / (rank + 1) for rank in range(works)]
+    corpus = []
+    for _ in range(papers):
+        cited = {title for title in generator.choices(pool, weights=weights, k=references)}
+        corpus.append({
+            "title": " ".join(generator.choices(words, k=8)).title(),
+            "references": [perturb(title, generator) if generator.random() < noise else title for title in cited],
+        })
+    return corpus
+
+
+def time_lookups(function, titles: list[str]) -> float:
+    start_time = time.perf_counter()
+    for title in titles:
+        function(title)
+    return (time.perf_counter() - start_time) / len(titles)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build time, size and lookup latency of the citation graph.")
+    parser.add_argument("--papers", type=int, default=5000)
+    parser.add_argument("--works", type=int, default=20000, help="Distinct cited works.")
+    parser.add_argument("--references", type=int, default=30, help="References per paper.")
+    parser.add_argument("--noise", type=float, default=0.2, help="Fraction of perturbed reference titles.")
+    parser.add_argument("--lookups", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    corpus = synthetic_corpus(args.papers, args.works, args.references, args.noise, args.seed)
+    graph = CitationGraph()
+    start_time = time.perf_counter()
+    for paper in corpus:
+        graph.add_paper(paper["title"], paper["references"])
+    build_seconds = time.perf_counter() - start_time
+    print(f"build        {build_seconds:>8.2f} s  {build_seconds / args.papers * 1e3:>7.3f} ms/paper  "
+          f"{graph.node_count} works, {graph.edge_count} citations")
+
+    start_time = time.perf_counter()
+    data = graph.to_bytes()
+    graph = CitationGraph.from_bytes(data)
+    print(f"write+load   {time.perf_counter() - start_time:>8.2f} s  {len(data) / 2 ** 20:.1f} MiB")
+
+    generator = random.Random(args.seed)
+    cited_titles = [generator.choice(paper["references"]) for paper in generator.choices(corpus, k=args.lookups)]
+    paper_titles = [paper["title"] for paper in generator.choices(corpus, k=args.lookups)]
+    for operation, titles in (("cited_by", cited_titles), ("references", paper_titles),
+                              ("shared_references", paper_titles)):
+        per_lookup = time_lookups(lambda title: graph.lookup(operation, title, limit=20), titles)
+        print(f"{operation:<18}{per_lookup * 1e6:>10.1f} us/lookup")
+
+    def scan_cited_by(title: str) -> list[str]:
+        key = normalize_title(title)
+        return [paper["title"] for paper in corpus
+                if any(normalize_title(reference) == key for reference in paper["references"])]
+
+    per_scan = time_lookups(scan_cited_by, cited_titles[:20])
+    print(f"{'cited_by (scan)':<18}{per_scan * 1e6:>10.1f} us/lookup  exact titles only, references in memory")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""
+Query latency of the columnar corpus snapshot.
+
+A synthetic corpus is written as a snapshot, memory-mapped, and the aggregate questions answered by the
+corpus_stats tool are timed. The time to open the snapshot is reported separately: it does not depend
+on the corpus size, as no column is read or copied when the file is mapped. The first run of a query also
+builds the indexes of its columns, it is reported separately from the fastest run.
+
+Usage:
+    python benchmarks/corpus_snapshot_query.py --documents 100000
+"""
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.services.corpus_snapshot import CorpusSnapshot, write_snapshot
+
+QUERIES = {
+    "papers after 2022": {"filters": [["publication_year", "gt", 2022]]},
+    "papers per author": {"group_by": "authors"},
+    "papers per year by an author": {"filters": [["authors", "eq", "Author 7"]], "group_by": "publication_year"},
+    "title contains 'graph'": {"filters": [["title", "contains", "graph"]]},
+    "average tables after 2020": {"filters": [["publication_year", "gte", 2020]], "aggregate": "avg", "column": "tables"},
+}
+
+
+def synthetic_corpus(documents: int, authors: int, seed: int) -> list[dict]:
+    generator = random.Random(seed)
+    topics = ["graph", "language", "vision", "retrieval", "agents", "protein", "diffusion", "robotics"]
+    return [
+        {
+            "title": f"On {generator.choice(topics)} models {index}",
+            "authors": [f"Author {generator.randrange(authors)}" for _ in range(generator.randint(1, 5))],
+            "publication_date": f"{generator.randint(2010, 2025)}-{generator.randint(1, 12):02d}",
+            "abstract": "We study " + " ".join(generator.choices(topics, k=40)),
+            "part_counts": {"sections": generator.randint(4, 12), "references": generator.randint(10, 80),
+                            "tables": generator.randint(0, 8), "figures": generator.randint(0, 12)},
+        }
+        for index in range(documents)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query latency of the columnar corpus snapshot.")
+    parser.add_argument("--documents", type=int, default=100000)
+    parser.add_argument("--authors", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rows = synthetic_corpus(args.documents, args.authors, args.seed)
+    with tempfile.TemporaryDirectory() as snapshot_dir:
+        snapshot_path = Path(snapshot_dir) / "corpus.col"
+        start_time = time.perf_counter()
+        write_snapshot(rows, snapshot_path)
+        print(f"write   {(time.perf_counter() - start_time) * 1000:>10.1f} ms  "
+              f"{snapshot_path.stat().st_size / 2 ** 20:.1f} MiB for {args.documents} documents")
+
+        start_time = time.perf_counter()
+        snapshot = CorpusSnapshot(snapshot_path)
+        print(f"open    {(time.perf_counter() - start_time) * 1000:>10.3f} ms")
+
+        for name, query in QUERIES.items():
+            timings = []
+            for _ in range(args.repeat):
+                start_time = time.perf_counter()
+                result = snapshot.query(**query)
+                timings.append(time.perf_counter() - start_time)
+            print(f"{name:<32}{min(timings) * 1000:>10.1f} ms  first run {timings[0] * 1000:>8.1f} ms  "
+                  f"matching rows {result['row_count']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+Tail-latency benchmark of hedged model calls.
+
+A fake model answers most calls quickly and stalls on a small fraction of them, like the occasional
+Gemini call that hangs. The same workload runs through HedgedCaller with and without hedging and
+the latency percentiles, hedge rate and hedge wins are printed.
+
+Usage:
+    python benchmarks/hedging_tail_latency.py --calls 400 --stall-probability 0.03
+"""
+import argparse
+import random
+import statistics
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.services.hedging import HedgedCaller, request_deadline
+
+
+class LatencyInjectingFakeModel:
+    """
+    Fake model call: normally distributed latency, with a probability of stalling.
+    A stalled call honours the per-call timeout like the real client does.
+    """
+    def __init__(self, latency_seconds: float, stall_seconds: float, stall_probability: float, seed: int):
+        self.latency_seconds = latency_seconds
+        self.stall_seconds = stall_seconds
+        self.stall_probability = stall_probability
+        self.random = random.Random(seed)
+
+    def __call__(self, timeout_seconds: float) -> str:
+        if self.random.random() < self.stall_probability:
+            latency = self.stall_seconds
+        else:
+            latency = max(0.001, self.random.gauss(self.latency_seconds, self.latency_seconds / 5))
+        time.sleep(min(latency, timeout_seconds))
+        if latency > timeout_seconds:
+            raise TimeoutError("Fake model call timed out.")
+        return "{}"
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_workload(hedging_enabled: bool, args) -> dict:
+    fake_model = LatencyInjectingFakeModel(args.latency_ms / 1000, args.stall_ms / 1000, args.stall_probability, args.seed)
+    hedged_caller = HedgedCaller("benchmark", hedging_enabled=hedging_enabled, max_hedge_rate=args.max_hedge_rate,
+                                 min_samples=20, max_workers=args.concurrency * 2)
+
+    def timed_call(_):
+        start_time = time.monotonic()
+        with request_deadline(args.deadline_ms / 1000):
+            try:
+                hedged_caller.call(fake_model)
+            except Exception:
+                pass
+        return time.monotonic() - start_time
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        latencies = list(executor.map(timed_call, range(args.calls)))
+    return {"latencies": latencies, **hedged_caller.to_dict()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tail-latency benchmark of hedged model calls.")
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=50)
+    parser.add_argument("--stall-ms", type=float, default=1500)
+    parser.add_argument("--stall-probability", type=float, default=0.03)
+    parser.add_argument("--deadline-ms", type=float, default=3000)
+    parser.add_argument("--max-hedge-rate", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    print(f"{'mode':<12}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'hedge rate':>12}{'hedge wins':>12}")
+    for hedging_enabled in (False, True):
+        result = run_workload(hedging_enabled, args)
+        latencies = result["latencies"]
+        print(f"{'hedged' if hedging_enabled else 'baseline':<12}"
+              f"{statistics.median(latencies) * 1000:>10.1f}"
+              f"{percentile(latencies, 0.95) * 1000:>10.1f}"
+              f"{percentile(latencies, 0.99) * 1000:>10.1f}"
+              f"{max(latencies) * 1000:>10.1f}"
+              f"{result['hedge_rate']:>12.3f}"
+              f"{result['hedge_wins']:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""
+Import-time benchmark of the API entrypoint.
+
+Runs `python -X importtime -c "import app.main"` in fresh interpreters and fails when the
+cumulative import time of `app.main` exceeds the threshold, or when a heavy SDK is imported
+eagerly again (they must stay behind the service factories).
+
+Usage:
+    python benchmarks/import_time.py --runs 5 --threshold-ms 800
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+
+PROJECT_ROOT = Path(__file__).parent.parent
+DEFAULT_THRESHOLD_MS = 800
+# SDKs that must not be imported when app.main is imported
+LAZY_MODULES = ("google.genai", "firebase_admin", "opik", "yaml", "requests")
+
+IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s+)(\S+)\s*$")
+
+
+def measure_import(module: str) -> tuple[int, dict[str, tuple[int, int]]]:
+    """
+    Import a module in a fresh interpreter with -X importtime.
+
+    :param module: The module to import.
+    :return: Cumulative import time of the module in microseconds, and the (self, cumulative)
+             import times of every imported module.
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=PROJECT_ROOT,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    imported_modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match:
+            imported_modules[match.group(4)] = (int(match.group(1)), int(match.group(2)))
+    return imported_modules[module][1], imported_modules
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Import-time benchmark with a regression threshold.")
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh interpreter runs, the best run is kept.")
+    parser.add_argument("--threshold-ms", type=float, default=DEFAULT_THRESHOLD_MS)
+    parser.add_argument("--top", type=int, default=10, help="Number of slowest modules to print.")
+    args = parser.parse_args()
+
+    measurements = [measure_import(args.module) for _ in range(args.runs)]
+    best_cumulative_us, imported_modules = min(measurements, key=lambda measurement: measurement[0])
+    best_ms = best_cumulative_us / 1000
+
+    print(f"{args.module}: best cumulative import time {best_ms:.1f} ms over {args.runs} run(s)"
+          f" (threshold {args.threshold_ms:.0f} ms)")
+    print(f"Slowest modules (self time):")
+    for name, (self_us, cumulative_us) in sorted(imported_modules.items(), key=lambda item: -item[1][0])[:args.top]:
+        print(f"  {self_us / 1000:8.1f} ms self  {cumulative_us / 1000:8.1f} ms cumulative  {name}")
+
+    failed = False
+    eager_modules = [name for name in LAZY_MODULES if name in imported_modules]
+    if eager_modules:
+        print(f"FAIL: heavy modules imported eagerly: {', '.join(eager_modules)}")
+        failed = True
+    if best_ms > args.threshold_ms:
+        print(f"FAIL: import time regression, {best_ms:.1f} ms > {args.threshold_ms:.0f} ms")
+        failed = True
+    if not failed:
+        print("OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
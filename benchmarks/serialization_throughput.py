@@ -0,0 +1,104 @@
+"""
+Serialization throughput of the /pdf_upload response path.
+
+Synthetic extracted documents go through the previous path and the current one:
+    - before: the model output is parsed with json.loads and the recipe validated from the dicts, the documents
+      are dumped for the database, then encoded again by FastAPI (jsonable_encoder + json.dumps),
+    - after: the model output is validated straight from JSON, the documents are dumped once, the dicts are
+      stored and encoded with `serialization.dumps` (orjson), gzip-compressed above
+      settings.RESPONSE_GZIP_MIN_BYTES, and optionally projected with `fields=`.
+
+Usage:
+    python benchmarks/serialization_throughput.py --documents 20 --sections 40
+"""
+import argparse
+import gzip
+import json
+import random
+import sys
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from fastapi.encoders import jsonable_encoder
+
+from app.services import serialization
+from app.services.recipe import PdfInformationRecipe, get_recipe_list_adapter
+from app.settings import get_settings
+
+settings = get_settings()
+
+
+def synthetic_model_output(index: int, sections: int, generator: random.Random) -> str:
+    words = ["model", "graph", "attention", "protein", "retrieval", "benchmark", "loss", "dataset"]
+    text = lambda count: " ".join(generator.choices(words, k=count))
+    document = {
+        "title": f"Paper {index}",
+        "authors": [f"Author {generator.randrange(500)}" for _ in range(4)],
+        "publication_date": "2024-05",
+        "abstract": text(200),
+        "content_data": {
+            "references": [{"title": text(8), "authors": ["A. Author"], "publication_date": "2020",
+                            "source": "arXiv", "link": "https://arxiv.org"} for _ in range(sections)],
+            "sections": [{"section_title": text(4), "section_content": text(400)} for _ in range(sections)],
+        },
+        "tables_and_figures": {
+            "tables": [{"table_caption": text(10), "table_content": text(120)} for _ in range(sections // 4)],
+            "figures": [{"caption_of_figure": text(10), "figure_description": text(60)} for _ in range(sections // 4)],
+        },
+    }
+    return json.dumps([document])
+
+
+def before(model_outputs: list[str]) -> bytes:
+    documents = [PdfInformationRecipe(**json.loads(output)[0]) for output in model_outputs]
+    stored = [document.model_dump() for document in documents]
+    response = {"job_id": "job", "documents": documents, "failed_files": []}
+    body = json.dumps(jsonable_encoder(response), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return body if stored else b""
+
+
+def after(model_outputs: list[str], fields: list[str] = None) -> bytes:
+    adapter = get_recipe_list_adapter(PdfInformationRecipe)
+    documents = [adapter.validate_json(output)[0].model_dump() for output in model_outputs]
+    response = {"job_id": "job", "documents": [serialization.project(document, fields) for document in documents],
+                "failed_files": []}
+    body = serialization.dumps(response)
+    if len(body) >= settings.RESPONSE_GZIP_MIN_BYTES:
+        body = gzip.compress(body, compresslevel=settings.RESPONSE_GZIP_LEVEL)
+    return body
+
+
+def measure(name: str, function, model_outputs: list[str], repeat: int, **kwargs):
+    timings = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        body = function(model_outputs, **kwargs)
+        timings.append(time.perf_counter() - start_time)
+    best = min(timings)
+    print(f"{name:<34}{best * 1000:>10.1f} ms  {len(model_outputs) / best:>10.1f} documents/s  "
+          f"{len(body) / 1024:>10.1f} KiB on the wire")
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serialization throughput of the /pdf_upload response path.")
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--sections", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    generator = random.Random(args.seed)
+    model_outputs = [synthetic_model_output(index, args.sections, generator) for index in range(args.documents)]
+    print(f"{args.documents} documents, {sum(map(len, model_outputs)) / 2 ** 20:.1f} MiB of model output")
+
+    before_time = measure("before", before, model_outputs, args.repeat)
+    after_time = measure("after", after, model_outputs, args.repeat)
+    measure("after, fields=title,authors", after, model_outputs, args.repeat, fields=["title", "authors"])
+    print(f"speedup {before_time / after_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
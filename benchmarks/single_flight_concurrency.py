@@ -0,0 +1,238 @@
+"""
+Concurrency scenarios of the single-flight coalescing, run against a slow fake model.
+
+Identical requests are sent concurrently and the number of calls reaching the fake model
+(or the fake pipeline behind the route) is checked:
+    extraction: the same PDF content is extracted by concurrent jobs, each with its own event loop.
+                The upload and every recipe must reach the model once.
+    pdf_upload: the same PDF is posted concurrently to `/pdf_upload`, the pipeline must run once.
+    chatbot:    the same question (up to case and whitespace) is posted concurrently to `/chatbot`,
+                the chatbot must run once.
+
+The leader of every computation is held at a gate until the other requests have joined it, so the checks
+do not depend on thread scheduling. The script exits with a non-zero status if a scenario does not coalesce
+the requests.
+
+Usage:
+    python benchmarks/single_flight_concurrency.py --requests 8 --model-latency-ms 300
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+REPO_DIR = Path(__file__).parent.parent
+sys.path.append(str(REPO_DIR))
+# Prompt files are resolved from the repository root, checkpoints are written to a temporary directory
+os.chdir(REPO_DIR)
+os.environ.setdefault("API_KEY", "benchmark")
+os.environ.setdefault("CHECKPOINT_DIR", tempfile.mkdtemp(prefix="single_flight_checkpoints_"))
+os.environ.setdefault("EXTRACTED_FILES_DIR", tempfile.mkdtemp(prefix="single_flight_blobs_"))
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app import routes
+from app.services.checkpoint_service import IngestionReport
+from app.services.pdf_information_extraction_service import PdfInformationExtractionService
+from app.services.recipe import PdfMetaDataRecipe, TablesAndFiguresRecipe
+from app.services.single_flight import get_single_flight
+
+# A gate that is never opened is passed after this delay, the scenario then fails on the call counts
+GATE_TIMEOUT_SECONDS = 10.0
+
+FAKE_RESPONSES = {
+    PdfMetaDataRecipe: [{"title": "Single Flight", "authors": ["A. Author"], "publication_date": "2024",
+                         "abstract": "Coalescing identical requests."}],
+    TablesAndFiguresRecipe: [{"tables": [], "figures": []}],
+}
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FollowerGate:
+    """
+    Gate the leader of a computation waits on: it opens once the given number of followers have joined
+    the single-flight group, counted from the creation of the gate.
+    """
+    def __init__(self, flight_name: str, followers: int):
+        self.single_flight = get_single_flight(flight_name)
+        self.expected_followers = self.single_flight.to_dict()["followers"] + followers
+        self.opened = threading.Event()
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def _watch(self):
+        deadline = time.monotonic() + GATE_TIMEOUT_SECONDS
+        while time.monotonic() < deadline:
+            if self.single_flight.to_dict()["followers"] >= self.expected_followers:
+                self.opened.set()
+                return
+            time.sleep(0.001)
+
+    def wait(self):
+        self.opened.wait(GATE_TIMEOUT_SECONDS)
+
+    async def await_open(self):
+        await asyncio.to_thread(self.wait)
+
+
+class SlowFakeModel:
+    """
+    Fake extraction model service: every upload and extraction call waits for its gate, takes the model latency
+    and is counted. Extraction calls sleep without blocking the event loop of their job.
+    """
+    def __init__(self, latency_seconds: float, upload_gate: FollowerGate, extraction_gate: FollowerGate):
+        self.latency_seconds = latency_seconds
+        self.upload_gate = upload_gate
+        self.extraction_gate = extraction_gate
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def _count(self, call: str):
+        with self._lock:
+            self.calls[call] = self.calls.get(call, 0) + 1
+
+    def upload_file(self, file_path: Path) -> str:
+        # Called in a worker thread of the job
+        self._count("upload")
+        self.upload_gate.wait()
+        time.sleep(self.latency_seconds)
+        return f"uploaded:{file_path.name}"
+
+    async def execute(self, content, recipe, page_range=None, step=None, page_count=None) -> FakeResponse:
+        self._count(step)
+        await self.extraction_gate.await_open()
+        await asyncio.sleep(self.latency_seconds)
+        return FakeResponse(json.dumps(FAKE_RESPONSES[recipe]))
+
+
+class CountingFake:
+    """
+    Fake service whose method waits for its gate, sleeps for the model latency, counts its calls and returns
+    a fixed result.
+    """
+    def __init__(self, latency_seconds: float, result, gate: FollowerGate = None):
+        self.latency_seconds = latency_seconds
+        self.result = result
+        self.gate = gate
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self._lock:
+            self.calls += 1
+        if self.gate is not None:
+            self.gate.wait()
+        time.sleep(self.latency_seconds)
+        return self.result
+
+
+def run_concurrently(function, count: int) -> list:
+    with ThreadPoolExecutor(max_workers=count) as executor:
+        return list(executor.map(function, range(count)))
+
+
+def extraction_scenario(args, work_dir: Path) -> tuple[bool, str]:
+    service = PdfInformationExtractionService(chunked=False)
+    # Every job joins the upload, then every recipe, of the first job
+    other_jobs = args.requests - 1
+    upload_gate = FollowerGate("extraction", other_jobs)
+    extraction_gate = FollowerGate("extraction", other_jobs * (1 + len(service.recipes)))
+    fake_model = SlowFakeModel(args.model_latency_ms / 1000, upload_gate, extraction_gate)
+    service.pdf_reader = fake_model
+    # The same content stored under different names, as when a ZIP is uploaded twice
+    pdf_content = b"%PDF-1.4\n1 0 obj << /Type /Page >> endobj\n%%EOF\n"
+    file_paths = []
+    for index in range(args.requests):
+        file_path = work_dir / f"copy_{index}.pdf"
+        file_path.write_bytes(pdf_content)
+        file_paths.append(file_path)
+
+    reports = run_concurrently(lambda index: service.run([file_paths[index]]), args.requests)
+    documents = sum(len(report.documents) for report in reports)
+    expected_calls = {"upload": 1, **{f"{recipe_name}_extraction": 1 for recipe_name in service.recipes}}
+    passed = fake_model.calls == expected_calls and documents == args.requests
+    return passed, f"model calls {fake_model.calls}, documents {documents}/{args.requests}"
+
+
+def pdf_upload_scenario(args, client: TestClient) -> tuple[bool, str]:
+    report = IngestionReport(job_id="benchmark", documents=[], failed_files=[])
+    # Original file name by blob hash, as returned by UploadPdfService.upload
+    stored_files = {hashlib.sha256(b"%PDF-1.4 same content").hexdigest(): "paper.pdf"}
+    upload = CountingFake(args.model_latency_ms / 1000, stored_files, FollowerGate("pdf_upload", args.requests - 1))
+    extraction = CountingFake(args.model_latency_ms / 1000, report)
+
+    class FakeUploadPdfService:
+        def upload(self, file, job_id):
+            return upload(file, job_id)
+
+    class FakeExtractionService:
+        def run(self, files, job_id=None):
+            return extraction(files, job_id)
+
+    routes.get_upload_pdf_service = FakeUploadPdfService
+    routes.get_pdf_information_extraction_service = FakeExtractionService
+
+    def post(_):
+        return client.post("/pdf_upload", files={"file": ("paper.pdf", b"%PDF-1.4 same content", "application/pdf")})
+
+    responses = run_concurrently(post, args.requests)
+    succeeded = sum(response.status_code == 200 for response in responses)
+    passed = upload.calls == 1 and extraction.calls == 1 and succeeded == args.requests
+    return passed, f"uploads {upload.calls}, extractions {extraction.calls}, succeeded {succeeded}/{args.requests}"
+
+
+def chatbot_scenario(args, client: TestClient) -> tuple[bool, str]:
+    chatbot = CountingFake(args.model_latency_ms / 1000, "Single flight shares in-flight results.",
+                           FollowerGate("chatbot", args.requests - 1))
+
+    class FakeChatbotService:
+        def get_response(self, query, db_service=None):
+            return chatbot(query)
+
+    routes.get_chatbot_service = FakeChatbotService
+    routes.get_database_service = lambda: None
+    queries = ["What is single flight?", "what is  single flight?", "  WHAT is single flight?"]
+
+    def post(index):
+        return client.post("/chatbot", data={"query": queries[index % len(queries)]})
+
+    responses = run_concurrently(post, args.requests)
+    succeeded = sum(response.status_code == 200 for response in responses)
+    passed = chatbot.calls == 1 and succeeded == args.requests
+    return passed, f"chatbot runs {chatbot.calls}, succeeded {succeeded}/{args.requests}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrency scenarios of the single-flight coalescing.")
+    parser.add_argument("--requests", type=int, default=8)
+    parser.add_argument("--model-latency-ms", type=float, default=300)
+    args = parser.parse_args()
+
+    app = FastAPI()
+    app.include_router(routes.router)
+    client = TestClient(app)
+    with tempfile.TemporaryDirectory() as work_dir:
+        results = {
+            "extraction": extraction_scenario(args, Path(work_dir)),
+            "pdf_upload": pdf_upload_scenario(args, client),
+            "chatbot": chatbot_scenario(args, client),
+        }
+
+    for scenario, (passed, details) in results.items():
+        print(f"{scenario:<12}{'PASS' if passed else 'FAIL':<6}{details}")
+    sys.exit(0 if all(passed for passed, _ in results.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
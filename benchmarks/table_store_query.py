@@ -0,0 +1,93 @@
+"""
+Ingest throughput and query latency of the table store.
+
+A synthetic corpus of result tables (Markdown, with decorated cells like "**81.2**" and "79.4 ± 0.3", and units in
+the headers) is parsed and stored as at ingest time, then the numeric questions of the table_stats tool are timed.
+The characters of table text the model would read to answer the same questions without the store are reported
+for comparison.
+
+Usage:
+    python benchmarks/table_store_query.py --papers 2000 --tables 4
+"""
+import argparse
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.services.table_store import TableStore
+
+DATASETS = ["ImageNet", "CIFAR-10", "CIFAR-100", "COCO", "SQuAD", "GLUE", "WMT14", "MNIST"]
+METRICS = ["Top-1 Acc. (%)", "Accuracy", "F1-score", "BLEU", "Latency (ms)", "Params (M)", "EM"]
+QUERIES = {
+    "available metrics": {"operation": "metrics"},
+    "best accuracy on ImageNet": {"operation": "top", "metric": "accuracy", "context": "ImageNet", "unit": "%",
+                                  "limit": 10},
+    "best F1 per paper": {"operation": "best_per_paper", "metric": "f1", "limit": 10},
+    "fastest models": {"operation": "top", "metric": "latency", "order": "asc", "limit": 10},
+    "summary of BLEU": {"operation": "summary", "metric": "bleu"},
+}
+
+
+def cell(generator: random.Random) -> str:
+    value = f"{generator.uniform(20, 99):.1f}"
+    variant = generator.randrange(4)
+    if variant == 0:
+        return f"**{value}**"
+    if variant == 1:
+        return f"{value} ± {generator.uniform(0, 2):.1f}"
+    return value
+
+
+def synthetic_corpus(papers: int, tables: int, seed: int) -> list[dict]:
+    generator = random.Random(seed)
+    corpus = []
+    for index in range(papers):
+        paper_tables = []
+        for _ in range(tables):
+            dataset = generator.choice(DATASETS)
+            metrics = generator.sample(METRICS, 3)
+            lines = ["| Method | " + " | ".join(metrics) + " |", "|---" * (len(metrics) + 1) + "|"]
+            for row in range(generator.randint(3, 10)):
+                lines.append(f"| Method {row} | " + " | ".join(cell(generator) for _ in metrics) + " |")
+            paper_tables.append({"table_caption": f"Results on {dataset}", "table_content": "\n".join(lines)})
+        corpus.append({"title": f"Paper {index}", "tables_and_figures": {"tables": paper_tables}})
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest throughput and query latency of the table store.")
+    parser.add_argument("--papers", type=int, default=2000)
+    parser.add_argument("--tables", type=int, default=4, help="Tables per paper.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    corpus = synthetic_corpus(args.papers, args.tables, args.seed)
+    table_characters = sum(len(table["table_content"]) + len(table["table_caption"])
+                           for paper in corpus for table in paper["tables_and_figures"]["tables"])
+    with tempfile.TemporaryDirectory() as store_dir:
+        store = TableStore(str(Path(store_dir) / "tables.sqlite3"))
+        start_time = time.perf_counter()
+        for paper in corpus:
+            store.add_documents([paper])
+        ingest_seconds = time.perf_counter() - start_time
+        print(f"ingest  {ingest_seconds:>8.2f} s  {args.papers * args.tables / ingest_seconds:>8.0f} tables/s  "
+              f"{store.to_dict()}")
+        print(f"table text read by the model without the store: {table_characters / 1e6:.1f} M characters per question")
+
+        for name, query in QUERIES.items():
+            timings = []
+            for _ in range(args.repeat):
+                start_time = time.perf_counter()
+                result = store.query(**query)
+                timings.append(time.perf_counter() - start_time)
+            rows = len(result.get("values", result.get("metrics", [result])))
+            print(f"{name:<28}{min(timings) * 1000:>10.2f} ms  {rows} row(s)")
+
+
+if __name__ == "__main__":
+    main()
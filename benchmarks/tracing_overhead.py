@@ -0,0 +1,85 @@
+"""
+Per-request overhead of tracing.
+
+A request shaped like a chatbot query (a root span, agent invocations, model calls, tools and code execution,
+with prompt-sized inputs and outputs) is run with tracing off, and with tracing on at several head sampling rates.
+Spans are exported to a JSONL file by the background exporter, so the timings only include the work done on
+the request path. The model calls themselves are not simulated: the reported time is the tracing overhead.
+
+Usage:
+    python benchmarks/tracing_overhead.py --requests 2000
+"""
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from app.services import tracing
+from app.services.tracing import JsonlExporter, Tracer, start_span, trace
+
+PROMPT = "You are a scientific assistant. " * 600
+DOCUMENT = {"title": "Paper", "authors": ["A", "B"], "sections": [{"section_content": "text " * 400}] * 20}
+
+
+@trace("agent.invoke")
+def invoke(query: str, context: str) -> str:
+    with start_span("genai.generate_content", kind="llm", input=lambda: {"contents": [PROMPT, query, context]},
+                    attributes={"model": "gemini"}) as span:
+        span.set_output('{"response": "' + "answer " * 200 + '"}')
+    return "answer " * 200
+
+
+@trace("agent.invoke_tool")
+def invoke_tool(arguments: dict) -> dict:
+    return DOCUMENT
+
+
+@trace("agent.invoke_code")
+def invoke_code(code_snippet: str) -> str:
+    return str(DOCUMENT)[:5000]
+
+
+@trace("chatbot_service.get_response")
+def get_response(query: str) -> str:
+    context = ""
+    for _ in range(3):
+        context += invoke(query, context)[:2000]
+        invoke_tool({"title": "Paper"})
+        invoke_code("result = db_service.get_document('Paper')")
+    return invoke(query, context)
+
+
+def run(requests: int) -> float:
+    start_time = time.perf_counter()
+    for index in range(requests):
+        get_response(f"Compare paper {index} with paper {index + 1}")
+    return (time.perf_counter() - start_time) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-request overhead of tracing.")
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as trace_dir:
+        configurations = [("tracing off", None)] + [
+            (f"tracing on, sample rate {sample_rate}", sample_rate) for sample_rate in (0.0, 0.1, 1.0)]
+        baseline = None
+        for name, sample_rate in configurations:
+            tracer = Tracer(exporter=JsonlExporter(str(Path(trace_dir) / "spans.jsonl")),
+                            enabled=sample_rate is not None, sample_rate=sample_rate or 0.0,
+                            tail_latency_seconds=60.0)
+            tracing.get_tracer = lambda: tracer
+            run(min(100, args.requests))
+            per_request = run(args.requests)
+            baseline = per_request if baseline is None else baseline
+            tracer.flush()
+            print(f"{name:<32}{per_request * 1e6:>10.1f} us/request  overhead {(per_request - baseline) * 1e6:>8.1f} us  "
+                  f"{tracer.to_dict()}")
+
+
+if __name__ == "__main__":
+    main()